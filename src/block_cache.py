@@ -0,0 +1,141 @@
+"""Memory-bounded cache of decoded posting blocks of an on-disk index
+
+Blocks are keyed on (term, block number) and held until their decoded arrays exceed the byte budget.
+Eviction follows LRU order, but admission favors terms that are queried often:
+a new block only replaces the least recently used one if its term has been queried at least as often,
+so a burst of rare terms can not flush the blocks of frequent ones. Query frequencies are halved every
+FREQUENCY_WINDOW term lookups, so terms that stop being queried lose their advantage.
+
+Attributes:
+    BLOCK_CACHE_BYTES (int): Default byte budget
+    FREQUENCY_WINDOW (int): Number of term lookups after which query frequencies are halved
+"""
+from collections import OrderedDict
+
+BLOCK_CACHE_BYTES = 1 << 25
+FREQUENCY_WINDOW = 1 << 16
+
+
+class BlockCache:
+    """Cache of decoded posting blocks with a byte budget
+
+    Attributes:
+        max_bytes (int): Byte budget of the decoded arrays
+        bytes_resident (int): Bytes of the decoded arrays in the cache
+        entries (OrderedDict): (term, block) - (doc numbers, term frequencies), least recently used first
+        query_freqs (dict): term - number of lookups of the term, halved every FREQUENCY_WINDOW lookups
+        lookups (int): Number of term lookups since the frequencies were last halved
+        hits (int): Number of blocks found in the cache
+        misses (int): Number of blocks not in the cache
+        rejections (int): Number of blocks not admitted
+        evictions (int): Number of blocks evicted
+    """
+
+    def __init__(self, max_bytes=BLOCK_CACHE_BYTES):
+        """Creates an empty cache
+
+        Args:
+            max_bytes (int, optional): Byte budget of the decoded arrays
+        """
+        self.max_bytes = max_bytes
+        self.bytes_resident = 0
+        self.entries = OrderedDict()
+        self.query_freqs = {}
+        self.lookups = 0
+        self.hits = 0
+        self.misses = 0
+        self.rejections = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def record_query(self, term):
+        """Counts a lookup of a term, its query frequency decides the admission of its blocks
+        """
+        self.query_freqs[term] = self.query_freqs.get(term, 0) + 1
+        self.lookups += 1
+        if self.lookups >= FREQUENCY_WINDOW:
+            self.query_freqs = {term: freq // 2 for term, freq in self.query_freqs.items() if freq > 1}
+            self.lookups = 0
+
+    def get(self, key):
+        """Looks up a decoded block
+
+        Args:
+            key (str, int): Term and block number
+
+        Returns:
+            (np.ndarray, np.ndarray): Doc numbers and term frequencies, None if not cached
+        """
+        block = self.entries.get(key)
+        if block is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return block
+
+    def put(self, key, block):
+        """Offers a decoded block to the cache, evicting least recently used blocks of terms
+        that are queried less or as often
+
+        Args:
+            key (str, int): Term and block number
+            block (np.ndarray, np.ndarray): Doc numbers and term frequencies, not views on larger arrays
+
+        Returns:
+            bool: Whether the block was admitted
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            return True
+        size = block[0].nbytes + block[1].nbytes
+        if size > self.max_bytes:
+            self.rejections += 1
+            return False
+        freq = self.query_freqs.get(key[0], 0)
+        # All victims are chosen before any is evicted, so a rejected block leaves the cache as it was
+        victims = []
+        freed = 0
+        entries = iter(self.entries.items())
+        while self.bytes_resident - freed + size > self.max_bytes:
+            victim_key, victim = next(entries)
+            if self.query_freqs.get(victim_key[0], 0) > freq:
+                self.rejections += 1
+                return False
+            victims.append(victim_key)
+            freed += victim[0].nbytes + victim[1].nbytes
+        for victim_key in victims:
+            del self.entries[victim_key]
+        self.bytes_resident -= freed
+        self.evictions += len(victims)
+        self.entries[key] = block
+        self.bytes_resident += size
+        return True
+
+    def clear(self):
+        """Removes all blocks, the query frequencies are kept
+        """
+        self.entries.clear()
+        self.bytes_resident = 0
+
+    def stats(self):
+        """Metrics to size the cache with
+
+        Returns:
+            dict: hits, misses, hit_rate, rejections, evictions, blocks and bytes_resident
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'rejections': self.rejections,
+            'evictions': self.evictions,
+            'blocks': len(self.entries),
+            'bytes_resident': self.bytes_resident,
+        }
@@ -1,27 +1,38 @@
-"""Methods used for building indexes for TREC data
-   this is an ad-hoc approach, index was build once and shared via USB
+"""Methods used for building indexes for TREC data, in one build of all collections,
+   or incrementally, each new batch of files as a segment of a segmented index (see segments.py)
    
 Attributes:
-    DOC_FREQ_INDEX (dict): term - doc_freq
-    DOC_LEN_INDEX (dict): doc_id - doc_len
+    DOC_IDS (list of str): doc_id of each indexed document, indexed by doc number
+    DOC_LEN_INDEX (array): doc number - doc_len
     FB_DIR (str): directory of FB files
     FB_FILE_NAMES (TYPE): file names in FB directory
     FR_DIR (str): directory of FR files
     FR_FILE_NAMES (TYPE): Descriptiofile names in FR directory
     FT_DIR (str): directory of FT files
     FT_FILE_NAMES (TYPE): file names in FR directory
-    INVERTED_INDEX (dict): term - postings
+    INVERTED_INDEX (dict): term - postings (doc numbers, term frequencies), see postings.py
     LA_DIR (str): directory of LA files
     LA_FILE_NAMES (TYPE): file names in LA directory
+    MEMORY_BUDGET (int): default memory budget of SpimiIndexer in bytes
+    RUN_DIR (str): directory of the runs written by SpimiIndexer
 """
+import heapq
 import os
 import _pickle as pickle
 import re
 
+from collections import deque
+from itertools import groupby, islice
+from multiprocessing import Pool, cpu_count
+from operator import itemgetter
+
+import numpy as np
 from tqdm import tqdm
 
 import text_manipulation as tm
-import filter_indexes as fi
+import disk_index as di
+import postings as ps
+import segments as sg
 
 FB_DIR = "../data/TREC_VOL_5/fbis/"
 FR_DIR = "../data/TREC_VOL_4/fr94/"
@@ -33,9 +44,15 @@ FR_FILE_NAMES = os.listdir(FR_DIR)[13:-2]
 FT_FILE_NAMES = [fn for fn in os.listdir(FT_DIR) if fn.endswith('.txt')]
 LA_FILE_NAMES = os.listdir(LA_DIR)[:-2]
 
+RUN_DIR = "../data/runs/"
+MEMORY_BUDGET = 1 << 30
+# Estimated memory of a new term in the inverted index, and of a posting
+TERM_BYTES = 300
+POSTING_BYTES = 8
+
 INVERTED_INDEX = {}
-DOC_LEN_INDEX = {}
-DOC_FREQ_INDEX = {}
+DOC_IDS = []
+DOC_LEN_INDEX = ps.new_postings()[0]
 
 def process_dir(data_dir, file_names, extra_space=1):
     """Processes a directory of files containing documents
@@ -43,32 +60,67 @@ def process_dir(data_dir, file_names, extra_space=1):
     Args:
         data_dir (str): data directory containing TREC data
         file_names (list of str): file names to parse in data_dir
-        extra_space (bool, optional): used by tm.get_blocks
+        extra_space (bool, optional): used by tm.read_trec_documents
+    """
+    print('Indexing files...')
+    for file_name in tqdm(file_names):
+        for doc_id, doc_text in tm.read_trec_documents(data_dir + file_name, extra_space):
+            add_to_indexes(doc_id, doc_text)
+    print('Indexing complete.')
+
+def index_files(shard):
+    """Builds a partial index for a shard of files, run by the workers of process_dir_parallel
+
+    Args:
+        shard (str, list of str, bool): data directory, file names and extra_space of the shard
+
+    Returns:
+        (list of str, array, dict, dict): doc_ids, document lengths and inverted index of the shard,
+            numbered from 0 in reading order, and the stems the worker cached for the shard
     """
+    data_dir, file_names, extra_space = shard
     doc_ids = []
-    doc_texts = []
+    doc_lens = ps.new_postings()[0]
+    inverted_index = {}
+    for file_name in file_names:
+        for doc_id, doc_text in tm.read_trec_documents(data_dir + file_name, extra_space):
+            add_document(doc_id, doc_text, doc_ids, doc_lens, inverted_index)
+    return doc_ids, doc_lens, inverted_index, tm.STEM_CACHE.take_new()
 
-    print('Reading files...')
-    documents = []
-    for file_name in tqdm(file_names):
-        file_path = data_dir + file_name
-
-        with open(file_path, 'r', encoding='latin-1') as file:
-            data = ''.join(file.readlines())
-            documents += tm.get_blocks(data, 'DOC')
-
-    print('Reading complete. Processing...')
-    for doc in tqdm(documents):
-        text = tm.get_blocks(doc, 'TEXT', extra_space=0)
-        if text:
-            doc_ids.append(tm.get_blocks(doc, 'DOCNO', extra_space=extra_space)[0])
-            text_lines = text[0].split('\n')
-            text = '\n'.join([line for line in text_lines if not line.startswith('<')])
-            doc_texts.append(text)
-
-    print('Processing complete. Indexing...')
-    for doc_id, doc_text in tqdm(list(zip(doc_ids, doc_texts))):
-        add_to_indexes(doc_id, doc_text)
+def merge_partial_index(partial_index):
+    """Appends a partial index from index_files to the indexes, after all documents indexed so far
+
+    Args:
+        partial_index (list of str, array, dict, dict): Output of index_files
+    """
+    doc_ids, doc_lens, inverted_index, stems = partial_index
+    tm.STEM_CACHE.update(stems)
+    offset = len(DOC_IDS)
+    DOC_IDS.extend(doc_ids)
+    DOC_LEN_INDEX.extend(doc_lens)
+    for term, (doc_nums, freqs) in inverted_index.items():
+        postings = INVERTED_INDEX.get(term)
+        if postings is None:
+            postings = INVERTED_INDEX[term] = ps.new_postings()
+        postings[0].frombytes((np.frombuffer(doc_nums, dtype=np.uint32) + np.uint32(offset)).tobytes())
+        postings[1].extend(freqs)
+
+def process_dir_parallel(data_dir, file_names, extra_space=1, processes=None):
+    """Processes a directory of files containing documents with a pool of workers,
+       each worker indexes one file at a time. The partial indexes are merged in file order,
+       so the indexes are identical to the ones of process_dir
+
+    Args:
+        data_dir (str): data directory containing TREC data
+        file_names (list of str): file names to parse in data_dir
+        extra_space (bool, optional): used by tm.read_trec_documents
+        processes (int, optional): Number of workers, defaults to cpu_count()
+    """
+    print('Indexing files with ' + str(processes or cpu_count()) + ' processes...')
+    shards = [(data_dir, [file_name], extra_space) for file_name in file_names]
+    with Pool(processes) as pool:
+        for partial_index in tqdm(pool.imap(index_files, shards), total=len(shards)):
+            merge_partial_index(partial_index)
     print('Indexing complete.')
 
 def create_topic_dict():
@@ -86,50 +138,284 @@ def create_topic_dict():
 
     pickle.dump(topic_dict, open('../data/TOPIC_DICT_NOSTOP.pkl', 'wb'))
 
-def add_to_indexes(doc_id, doc_text):
-    """Adds a document to the indexes
-    
+def add_document(doc_id, doc_text, doc_ids, doc_lens, inverted_index):
+    """Adds a document to the given indexes, numbered after the documents already in them
+
     Args:
         doc_id (str): Identifier of document
         doc_text (str): Text of document
+        doc_ids (list of str): doc_id of each document
+        doc_lens (array): Length of each document
+        inverted_index (dict): term - postings (doc numbers, term frequencies)
+
+    Returns:
+        int: Number of postings added
     """
     bag_of_words = tm.process_text(doc_text)
-    DOC_LEN_INDEX[doc_id] = len(bag_of_words)
+    doc_num = len(doc_ids)
+    doc_ids.append(doc_id)
+    doc_lens.append(len(bag_of_words))
 
     term_freq_pairs = tm.to_frequency_pairs(bag_of_words)
     for term, freq in term_freq_pairs:
-        if INVERTED_INDEX.get(term):
-            INVERTED_INDEX[term].append((doc_id, freq))
-        else:
-            INVERTED_INDEX[term] = [(doc_id, freq)]
+        postings = inverted_index.get(term)
+        if postings is None:
+            postings = inverted_index[term] = ps.new_postings()
+        ps.append_posting(postings, doc_num, freq)
+    return len(term_freq_pairs)
+
+def add_to_indexes(doc_id, doc_text):
+    """Adds a document to the indexes
+    
+    Args:
+        doc_id (str): Identifier of document
+        doc_text (str): Text of document
+    """
+    add_document(doc_id, doc_text, DOC_IDS, DOC_LEN_INDEX, INVERTED_INDEX)
+
+class SpimiIndexer:
+    """Single-pass in-memory indexer with a memory budget. When the postings in memory reach the budget,
+       they are written to disk as a run sorted on term, and merge streams all runs into the on-disk index.
+       Only the doc_ids and document lengths stay in memory for the whole collection.
+
+    Attributes:
+        doc_ids (list of str): doc_id of each document, indexed by doc number in indexing order
+        doc_lens (array): Length of each document, indexed by doc number in indexing order
+        inverted_index (dict): term - postings (doc numbers, term frequencies) since the last run
+        memory_budget (int): Estimated bytes of postings in memory that triggers writing a run
+        memory_used (int): Estimated bytes of postings in memory
+        run_dir (str): Directory the runs are written to
+        run_files (list of str): Paths of the runs written so far
+    """
+
+    def __init__(self, run_dir=RUN_DIR, memory_budget=MEMORY_BUDGET):
+        """
+        Args:
+            run_dir (str, optional): Directory to write the runs to
+            memory_budget (int, optional): Estimated bytes of postings in memory that triggers writing a run
+        """
+        os.makedirs(run_dir, exist_ok=True)
+        self.run_dir = run_dir
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        self.doc_ids = []
+        self.doc_lens = ps.new_postings()[0]
+        self.inverted_index = {}
+        self.run_files = []
+
+    def add_document(self, doc_id, doc_text):
+        """Adds a document, writing a run when the memory budget is reached
+
+        Args:
+            doc_id (str): Identifier of document
+            doc_text (str): Text of document
+        """
+        num_terms = len(self.inverted_index)
+        num_postings = add_document(doc_id, doc_text, self.doc_ids, self.doc_lens, self.inverted_index)
+        self.account(len(self.inverted_index) - num_terms, num_postings)
+
+    def add_partial_index(self, partial_index):
+        """Adds a partial index from index_files, after all documents indexed so far
 
-def main():
-    process_dir(FB_DIR, FB_FILE_NAMES)
-    process_dir(FR_DIR, FR_FILE_NAMES)
-    process_dir(FT_DIR, FT_FILE_NAMES, extra_space=0)
-    process_dir(LA_DIR, LA_FILE_NAMES)
+        Args:
+            partial_index (list of str, array, dict, dict): Output of index_files
+        """
+        doc_ids, doc_lens, inverted_index, stems = partial_index
+        tm.STEM_CACHE.update(stems)
+        offset = len(self.doc_ids)
+        self.doc_ids.extend(doc_ids)
+        self.doc_lens.extend(doc_lens)
 
-    AVERAGE_DOC_LENGTH = 0
-    DOC_COUNT = 0
-    for doc_id_key in DOC_LEN_INDEX:
-        AVERAGE_DOC_LENGTH += DOC_LEN_INDEX.get(doc_id_key)
-        DOC_COUNT += 1
-    AVERAGE_DOC_LENGTH = AVERAGE_DOC_LENGTH / DOC_COUNT
+        num_terms = len(self.inverted_index)
+        num_postings = 0
+        for term, (doc_nums, freqs) in inverted_index.items():
+            postings = self.inverted_index.get(term)
+            if postings is None:
+                postings = self.inverted_index[term] = ps.new_postings()
+            postings[0].frombytes((np.frombuffer(doc_nums, dtype=np.uint32) + np.uint32(offset)).tobytes())
+            postings[1].extend(freqs)
+            num_postings += len(freqs)
+        self.account(len(self.inverted_index) - num_terms, num_postings)
 
-    for term_key in INVERTED_INDEX:
-        INVERTED_INDEX[term_key] = sorted(INVERTED_INDEX[term_key])
-        DOC_FREQ_INDEX[term_key] = len(INVERTED_INDEX[term_key])
+    def account(self, new_terms, new_postings):
+        """Adds the estimated memory of new terms and postings, and writes a run when over budget
+        """
+        self.memory_used += new_terms * TERM_BYTES + new_postings * POSTING_BYTES
+        if self.memory_used >= self.memory_budget:
+            self.write_run()
+
+    def write_run(self):
+        """Writes the postings in memory to disk, sorted on term, and clears them
+        """
+        if not self.inverted_index:
+            return
+        run_file = os.path.join(self.run_dir, 'run_' + str(len(self.run_files)) + '.pkl')
+        with open(run_file, 'wb') as file:
+            for term in sorted(self.inverted_index):
+                doc_nums, freqs = self.inverted_index[term]
+                pickle.dump((term, doc_nums, freqs), file)
+        self.run_files.append(run_file)
+        self.inverted_index = {}
+        self.memory_used = 0
+
+    def merge(self, index_dir):
+        """Merges all runs into the on-disk index, streaming one term at a time,
+           with documents numbered in sorted doc_id order
+
+        Args:
+            index_dir (str): Directory to write the index to
+        """
+        self.write_run()
+        order, new_nums = ps.sorted_doc_numbers(self.doc_ids)
+        doc_table = [self.doc_ids[i] for i in order]
+        doc_lens = np.frombuffer(self.doc_lens, dtype=np.uint32)[order]
+
+        runs = [read_run(run_file, run_num) for run_num, run_file in enumerate(self.run_files)]
+        with di.IndexWriter(index_dir) as writer:
+            writer.write_docs(doc_table, doc_lens)
+            # Runs hold consecutive documents, so postings of a term are concatenated in run order
+            for term, term_runs in groupby(heapq.merge(*runs), key=itemgetter(0)):
+                doc_nums, freqs = ps.new_postings()
+                for _, _, run_doc_nums, run_freqs in term_runs:
+                    doc_nums.extend(run_doc_nums)
+                    freqs.extend(run_freqs)
+                writer.add_term(term, ps.renumber_postings(doc_nums, freqs, new_nums))
+
+        for run_file in self.run_files:
+            os.remove(run_file)
+        self.run_files = []
+
+def read_run(run_file, run_num):
+    """Streams the postings of a run written by SpimiIndexer
+
+    Args:
+        run_file (str): Path of the run
+        run_num (int): Number of the run, orders equal terms in the merge
+
+    Yields:
+        (str, int, array, array): term, run_num, doc numbers and term frequencies
+    """
+    with open(run_file, 'rb') as file:
+        while True:
+            try:
+                term, doc_nums, freqs = pickle.load(file)
+            except EOFError:
+                return
+            yield term, run_num, doc_nums, freqs
+
+def process_dir_spimi(indexer, data_dir, file_names, extra_space=1, processes=None):
+    """Processes a directory of files containing documents into a SpimiIndexer,
+       reading one file at a time. In parallel, at most 2 partial indexes per worker are in flight,
+       on top of the memory budget of the indexer
+
+    Args:
+        indexer (SpimiIndexer): Indexer to add the documents to
+        data_dir (str): data directory containing TREC data
+        file_names (list of str): file names to parse in data_dir
+        extra_space (bool, optional): used by tm.read_trec_documents
+        processes (int, optional): Number of workers, defaults to cpu_count(), 1 indexes serially
+    """
+    print('Indexing files...')
+    if processes == 1:
+        for file_name in tqdm(file_names):
+            for doc_id, doc_text in tm.read_trec_documents(data_dir + file_name, extra_space):
+                indexer.add_document(doc_id, doc_text)
+    else:
+        shards = [(data_dir, [file_name], extra_space) for file_name in file_names]
+        window = 2 * (processes or cpu_count())
+        with Pool(processes) as pool:
+            for partial_index in tqdm(imap_bounded(pool, index_files, shards, window), total=len(shards)):
+                indexer.add_partial_index(partial_index)
+    print('Indexing complete.')
+
+def imap_bounded(pool, func, items, window):
+    """Like pool.imap, but with at most window results submitted and not yet consumed, so workers
+       that index faster than the results are merged do not hold every partial index in memory
+
+    Args:
+        pool (Pool): Pool of workers
+        func (function): Function applied to each item
+        items (list): Items to apply func to
+        window (int): Maximum number of results in flight
+
+    Yields:
+        Result of func for each item, in the order of items
+    """
+    items = iter(items)
+    in_flight = deque(pool.apply_async(func, (item,)) for item in islice(items, window))
+    while in_flight:
+        result = in_flight.popleft().get()
+        # The next item is submitted before the result is consumed, to keep the workers busy
+        in_flight.extend(pool.apply_async(func, (item,)) for item in islice(items, 1))
+        yield result
+
+def add_files(index_dir, data_dir, file_names, extra_space=1, merge=True):
+    """Indexes a batch of new files as a segment of a segmented index, without reindexing the collection.
+       Documents with the doc_id of an indexed document replace it
+
+    Args:
+        index_dir (str): Directory of the segmented index, created if needed
+        data_dir (str): data directory containing TREC data
+        file_names (list of str): file names to parse in data_dir
+        extra_space (bool, optional): used by tm.read_trec_documents
+        merge (bool, optional): Start merging segments in the background, see segments.maybe_merge
+
+    Returns:
+        Process: The merging process, None without merging
+    """
+    stem_cache_file = os.path.join(index_dir, tm.STEM_CACHE_FILE)
+    tm.STEM_CACHE.load(stem_cache_file)
+    doc_ids, doc_lens, inverted_index, _ = index_files((data_dir, file_names, extra_space))
+    sg.add_segment(index_dir, doc_ids, doc_lens, inverted_index)
+    tm.STEM_CACHE.save(stem_cache_file)
+    return sg.merge_in_background(index_dir) if merge else None
+
+
+def main(processes=None, memory_budget=None):
+    """Builds the indexes of all collections
+
+    Args:
+        processes (int, optional): Number of indexing processes, defaults to cpu_count(), 1 indexes serially
+        memory_budget (int, optional): Estimated bytes of postings to keep in memory,
+            if given the index is built with SpimiIndexer
+    """
+    collections = [
+        (FB_DIR, FB_FILE_NAMES, 1),
+        (FR_DIR, FR_FILE_NAMES, 1),
+        (FT_DIR, FT_FILE_NAMES, 0),
+        (LA_DIR, LA_FILE_NAMES, 1),
+    ]
+    # Reuse the stems of a previous build, the workers inherit them
+    stem_cache_file = os.path.join(di.INDEX_DIR, tm.STEM_CACHE_FILE)
+    tm.STEM_CACHE.load(stem_cache_file)
+
+    if memory_budget:
+        indexer = SpimiIndexer(RUN_DIR, memory_budget)
+        for data_dir, file_names, extra_space in collections:
+            process_dir_spimi(indexer, data_dir, file_names, extra_space=extra_space, processes=processes)
+        print('Merging runs...')
+        indexer.merge(di.INDEX_DIR)
+        create_topic_dict()
+        tm.STEM_CACHE.save(stem_cache_file)
+        print('Saving complete.')
+        return
+
+    for data_dir, file_names, extra_space in collections:
+        if processes == 1:
+            process_dir(data_dir, file_names, extra_space=extra_space)
+        else:
+            process_dir_parallel(data_dir, file_names, extra_space=extra_space, processes=processes)
+
+    # Number documents in sorted doc_id order, so ties in the rankings break the same way
+    doc_table, doc_len_index, inverted_index = ps.sort_doc_numbers(DOC_IDS, DOC_LEN_INDEX, INVERTED_INDEX)
 
     print('Saving indices...')
 
-    pickle.dump(INVERTED_INDEX, open('../data/INVERTED_INDEX_NOSTOP.pkl', 'wb'))
-    pickle.dump(DOC_LEN_INDEX, open('../data/DOC_LEN_INDEX_NOSTOP.pkl', 'wb'))
-    pickle.dump(DOC_FREQ_INDEX, open('../data/DOC_FREQ_INDEX_NOSTOP.pkl', 'wb'))
+    di.write_index(di.INDEX_DIR, doc_table, doc_len_index, inverted_index)
 
     create_topic_dict()
+    tm.STEM_CACHE.save(stem_cache_file)
     print('Saving complete.')
 
-    fi.filter_all()
-
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,499 @@
+"""Binary on-disk index format, opened with mmap so a term lookup only touches that term's bytes
+
+An index is a directory with the files:
+    terms.bin: UTF-8 bytes of all terms, in sorted order
+    lexicon.bin: one LEXICON_DTYPE record per term, in sorted term order
+    postings.bin: block-compressed postings of each term, see postings_codec.py
+    doc_ids.bin, doc_offsets.bin: doc_id strings and their offsets, indexed by doc number
+    doc_lens.bin: length of each document (uint32), indexed by doc number
+    meta.json: format version, build ID, codec, block size and collection statistics (documents, tokens,
+        average document length), so a searcher has them without scanning the index
+
+Attributes:
+    INDEX_DIR (str): Directory of the index built by build_index.py
+    LEXICON_DTYPE (np.dtype): Record describing one term
+    LEXICON_DTYPES (dict): Index format version - lexicon record, for reading indexes of earlier versions
+    VERSION (int): Version of the index format
+"""
+import hashlib
+import json
+import mmap
+import os
+import uuid
+import _pickle as pickle
+
+import numpy as np
+
+import postings as ps
+import postings_codec as pc
+
+INDEX_DIR = '../data/INDEX_NOSTOP/'
+VERSION = 3
+
+TERMS_FILE = 'terms.bin'
+LEXICON_FILE = 'lexicon.bin'
+POSTINGS_FILE = 'postings.bin'
+DOC_IDS_FILE = 'doc_ids.bin'
+DOC_OFFSETS_FILE = 'doc_offsets.bin'
+DOC_LENS_FILE = 'doc_lens.bin'
+META_FILE = 'meta.json'
+
+LEXICON_DTYPE = np.dtype([
+    ('term_offset', '<u8'),
+    ('term_len', '<u4'),
+    ('doc_freq', '<u4'),
+    ('coll_freq', '<u8'),
+    ('max_tf', '<u4'),
+    ('postings_offset', '<u8'),
+    ('postings_len', '<u8'),
+])
+
+LEXICON_DTYPES = {
+    2: np.dtype([
+        ('term_offset', '<u8'),
+        ('term_len', '<u4'),
+        ('doc_freq', '<u4'),
+        ('coll_freq', '<u8'),
+        ('postings_offset', '<u8'),
+        ('postings_len', '<u8'),
+    ]),
+    VERSION: LEXICON_DTYPE,
+}
+
+
+class IndexWriter:
+    """Writes an index to disk, the documents first and then one term at a time in sorted term order
+
+    Attributes:
+        index_dir (str): Directory the index is written to
+        meta (dict): Contents of meta.json
+    """
+
+    def __init__(self, index_dir, codec=pc.DEFAULT_CODEC, block_size=pc.BLOCK_SIZE):
+        """Creates the index directory and opens its files for writing
+
+        Args:
+            index_dir (str): Directory to write the index to
+            codec (str, optional): Postings codec, one of postings_codec.CODECS
+            block_size (int, optional): Number of postings per compressed block
+        """
+        if codec not in pc.CODECS:
+            raise ValueError('Unknown postings codec ' + codec)
+        os.makedirs(index_dir, exist_ok=True)
+        self.index_dir = index_dir
+        self.meta = {'version': VERSION, 'build_id': uuid.uuid4().hex, 'codec': codec, 'block_size': block_size,
+                     'num_terms': 0, 'num_docs': 0, 'num_tokens': 0, 'avg_doc_len': 0.0}
+        self.doc_lens = None
+        self.terms_file = open(os.path.join(index_dir, TERMS_FILE), 'wb')
+        self.lexicon_file = open(os.path.join(index_dir, LEXICON_FILE), 'wb')
+        self.postings_file = open(os.path.join(index_dir, POSTINGS_FILE), 'wb')
+        self.last_term = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_term(self, term, postings):
+        """Appends the postings of a term, terms must be added in sorted order
+
+        Args:
+            term (str): Term
+            postings (array, array): Gap-encoded postings, see postings.py
+        """
+        if self.doc_lens is None:
+            raise ValueError('Documents must be written before the terms')
+        if self.last_term is not None and term <= self.last_term:
+            raise ValueError('Terms must be added in sorted order, got ' + term + ' after ' + self.last_term)
+        self.last_term = term
+
+        term_bytes = term.encode('utf-8')
+        gaps = np.frombuffer(postings[0], dtype=np.uint32)
+        freqs = np.frombuffer(postings[1], dtype=np.uint32)
+        data = pc.encode_term(gaps, freqs, self.doc_lens, self.meta['codec'], self.meta['block_size'])
+
+        record = np.zeros(1, dtype=LEXICON_DTYPE)
+        record['term_offset'] = self.terms_file.tell()
+        record['term_len'] = len(term_bytes)
+        record['doc_freq'] = len(freqs)
+        record['coll_freq'] = freqs.sum(dtype=np.uint64)
+        record['max_tf'] = freqs.max() if len(freqs) else 0
+        record['postings_offset'] = self.postings_file.tell()
+        record['postings_len'] = len(data)
+
+        self.terms_file.write(term_bytes)
+        self.postings_file.write(data)
+        self.lexicon_file.write(record.tobytes())
+        self.meta['num_terms'] += 1
+        self.meta['num_tokens'] += int(record['coll_freq'][0])
+
+    def write_docs(self, doc_table, doc_lens):
+        """Writes the doc table and document lengths
+
+        Args:
+            doc_table (list of str): doc_id of each document, indexed by doc number
+            doc_lens (array): Length of each document, indexed by doc number
+        """
+        doc_id_bytes = [doc_id.encode('utf-8') for doc_id in doc_table]
+        offsets = np.zeros(len(doc_id_bytes) + 1, dtype='<u8')
+        offsets[1:] = np.cumsum([len(b) for b in doc_id_bytes], dtype=np.uint64)
+
+        with open(os.path.join(self.index_dir, DOC_IDS_FILE), 'wb') as file:
+            file.write(b''.join(doc_id_bytes))
+        with open(os.path.join(self.index_dir, DOC_OFFSETS_FILE), 'wb') as file:
+            file.write(offsets.tobytes())
+        with open(os.path.join(self.index_dir, DOC_LENS_FILE), 'wb') as file:
+            file.write(np.frombuffer(doc_lens, dtype=np.uint32).astype('<u4').tobytes())
+        self.meta['num_docs'] = len(doc_table)
+        self.doc_lens = np.frombuffer(doc_lens, dtype=np.uint32)
+        self.meta['avg_doc_len'] = float(self.doc_lens.mean()) if len(self.doc_lens) else 0.0
+
+    def close(self):
+        """Closes the index files and writes meta.json
+        """
+        self.terms_file.close()
+        self.lexicon_file.close()
+        self.postings_file.close()
+        with open(os.path.join(self.index_dir, META_FILE), 'w') as file:
+            json.dump(self.meta, file)
+
+
+def map_file(path):
+    """Memory-maps a file read-only
+
+    Args:
+        path (str): Path of the file
+
+    Returns:
+        mmap or bytes: Mapped file, empty bytes for an empty file (those can not be mapped)
+    """
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return b''
+        return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def legacy_build_id(index_dir):
+    """Build ID of an index written before meta.json stored one, from the sizes and modification times of its files
+    """
+    digest = hashlib.sha1()
+    for name in (META_FILE, LEXICON_FILE, POSTINGS_FILE, DOC_IDS_FILE):
+        stat = os.stat(os.path.join(index_dir, name))
+        digest.update((name + ':' + str(stat.st_size) + ':' + str(stat.st_mtime_ns) + ';').encode('utf-8'))
+    return digest.hexdigest()
+
+
+class DiskIndex:
+    """Read-only index opened with mmap, nothing is read until a term or document is looked up
+
+    Attributes:
+        index_dir (str): Directory of the index
+        meta (dict): Contents of meta.json
+        build_id (str): Identifies this build of the index, changes whenever the index is rebuilt
+        num_docs (int): Number of documents
+        num_tokens (int): Number of terms in the collection, the sum of all collection frequencies
+        avg_doc_len (float): Average document length
+        lexicon (np.ndarray): LEXICON_DTYPE record of each term, in sorted term order
+        doc_lens (np.ndarray): Length of each document, indexed by doc number
+        block_cache (BlockCache): Cache of decoded posting blocks, None to decode on every lookup
+    """
+
+    def __init__(self, index_dir=INDEX_DIR, block_cache=None):
+        """Opens an index written by IndexWriter
+
+        Args:
+            index_dir (str, optional): Directory of the index
+            block_cache (BlockCache, optional): Cache of decoded posting blocks, see block_cache.py
+        """
+        self.index_dir = index_dir
+        self.block_cache = block_cache
+        with open(os.path.join(index_dir, META_FILE)) as file:
+            self.meta = json.load(file)
+        if self.meta['version'] not in LEXICON_DTYPES:
+            raise ValueError('Unsupported index version ' + str(self.meta['version']) + ' in ' + index_dir)
+        self.build_id = self.meta.get('build_id') or legacy_build_id(index_dir)
+        self.num_docs = self.meta['num_docs']
+        self.codec = self.meta['codec']
+        self.block_size = self.meta['block_size']
+
+        self.terms = map_file(os.path.join(index_dir, TERMS_FILE))
+        self.lexicon = np.frombuffer(map_file(os.path.join(index_dir, LEXICON_FILE)), dtype=LEXICON_DTYPES[self.meta['version']])
+        self.postings_data = map_file(os.path.join(index_dir, POSTINGS_FILE))
+        self.doc_ids = map_file(os.path.join(index_dir, DOC_IDS_FILE))
+        self.doc_offsets = np.frombuffer(map_file(os.path.join(index_dir, DOC_OFFSETS_FILE)), dtype='<u8')
+        self.doc_lens = np.frombuffer(map_file(os.path.join(index_dir, DOC_LENS_FILE)), dtype='<u4')
+
+        if 'num_tokens' in self.meta:
+            self.num_tokens = self.meta['num_tokens']
+            self.avg_doc_len = self.meta['avg_doc_len']
+        else:
+            # Indexes of version 2 did not store them
+            self.num_tokens = int(self.lexicon['coll_freq'].sum())
+            self.avg_doc_len = float(self.doc_lens.mean()) if self.num_docs else 0.0
+
+    def term_at(self, i):
+        """Term of the i-th lexicon record, as UTF-8 bytes
+        """
+        offset = int(self.lexicon['term_offset'][i])
+        return self.terms[offset:offset + int(self.lexicon['term_len'][i])]
+
+    def find_term(self, term):
+        """Binary search for a term in the lexicon
+
+        Args:
+            term (str): Term to look up
+
+        Returns:
+            int: Position of the term in the lexicon, None if the term is not in the index
+        """
+        key = term.encode('utf-8')
+        lo, hi = 0, len(self.lexicon)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.term_at(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(self.lexicon) and self.term_at(lo) == key:
+            return lo
+        return None
+
+    def lookup(self, term):
+        """Lexicon record of a term
+
+        Raises:
+            KeyError: If the term is not in the index
+        """
+        i = self.find_term(term)
+        if i is None:
+            raise KeyError(term)
+        return self.lexicon[i]
+
+    def __contains__(self, term):
+        return self.find_term(term) is not None
+
+    def __len__(self):
+        return len(self.lexicon)
+
+    def term_data(self, term):
+        """Compressed postings of a term, as a view on the mapped postings file
+
+        Returns:
+            (memoryview, int): Output of postings_codec.encode_term and doc_freq of the term
+        """
+        record = self.lookup(term)
+        offset = int(record['postings_offset'])
+        data = memoryview(self.postings_data)[offset:offset + int(record['postings_len'])]
+        return data, int(record['doc_freq'])
+
+    def postings(self, term):
+        """Gap-encoded postings of a term, decompressed from the mapped postings file
+
+        Args:
+            term (str): Term
+
+        Returns:
+            (np.ndarray, np.ndarray): Doc gaps and term frequencies, see postings.py
+        """
+        data, doc_freq = self.term_data(term)
+        if self.block_cache is None or doc_freq == 0:
+            return pc.decode_term(data, doc_freq, self.codec, self.block_size)
+
+        self.block_cache.record_query(term)
+        blocks = [self.block_cache.get((term, block)) for block in range(pc.num_blocks(doc_freq, self.block_size))]
+        if all(block is not None for block in blocks):
+            doc_nums = np.concatenate([block[0] for block in blocks])
+            return np.diff(doc_nums, prepend=0).astype(np.uint32), np.concatenate([block[1] for block in blocks])
+
+        # Decoding the whole term is faster than decoding the missing blocks one at a time
+        gaps, freqs = pc.decode_term(data, doc_freq, self.codec, self.block_size)
+        doc_nums = np.cumsum(gaps, dtype=np.int64)
+        for block, cached in enumerate(blocks):
+            if cached is None:
+                start, end = block * self.block_size, (block + 1) * self.block_size
+                self.block_cache.put((term, block), (doc_nums[start:end].copy(), freqs[start:end].copy()))
+        return gaps, freqs
+
+    __getitem__ = postings
+
+    def block_table(self, term):
+        """Per-block metadata of a term (last doc number, max term frequency, min document length)
+
+        Returns:
+            np.ndarray: postings_codec.BLOCK_DTYPE record of each block
+        """
+        data, doc_freq = self.term_data(term)
+        return pc.block_table(data, doc_freq, self.block_size)
+
+    def block(self, term, block):
+        """Decompresses one block of postings of a term
+
+        Returns:
+            (np.ndarray, np.ndarray): Doc numbers and term frequencies in the block
+        """
+        if self.block_cache is not None:
+            cached = self.block_cache.get((term, block))
+            if cached is not None:
+                return cached
+        data, doc_freq = self.term_data(term)
+        decoded = pc.decode_block(data, doc_freq, block, self.codec, self.block_size)
+        if self.block_cache is not None:
+            self.block_cache.put((term, block), decoded)
+        return decoded
+
+    def block_reader(self, term):
+        """Decompresses single blocks of postings of a term on demand, looking the term up once
+
+        Returns:
+            function: Block number - (doc numbers, term frequencies) in the block
+        """
+        data, doc_freq = self.term_data(term)
+        if self.block_cache is not None:
+            self.block_cache.record_query(term)
+        return lambda block: self.decode_block(term, data, doc_freq, block)
+
+    def decode_block(self, term, data, doc_freq, block):
+        """Decompresses one block of postings from the data of a term, through the block cache
+        """
+        decoded = self.block_cache.get((term, block)) if self.block_cache is not None else None
+        if decoded is None:
+            decoded = pc.decode_block(data, doc_freq, block, self.codec, self.block_size)
+            if self.block_cache is not None:
+                self.block_cache.put((term, block), decoded)
+        return decoded
+
+    def block_range(self, term, first, stop):
+        """Decompresses consecutive blocks of postings of a term, looking the term up once
+
+        Args:
+            term (str): Term
+            first (int): Number of the first block
+            stop (int): Number of the block after the last one
+
+        Returns:
+            (np.ndarray, np.ndarray): Doc numbers and term frequencies in the blocks
+        """
+        data, doc_freq = self.term_data(term)
+        if self.block_cache is not None:
+            self.block_cache.record_query(term)
+        doc_nums, freqs = [np.zeros(0, dtype=np.int64)], [np.zeros(0, dtype=np.uint32)]
+        for block in range(first, stop):
+            decoded = self.decode_block(term, data, doc_freq, block)
+            doc_nums.append(decoded[0])
+            freqs.append(decoded[1])
+        return np.concatenate(doc_nums), np.concatenate(freqs)
+
+    def doc_freq(self, term):
+        """Number of documents containing the term
+        """
+        return int(self.lookup(term)['doc_freq'])
+
+    def collection_freq(self, term):
+        """Total number of occurences of the term in the collection
+        """
+        return int(self.lookup(term)['coll_freq'])
+
+    def max_tf(self, term):
+        """Highest frequency of the term in a document
+        """
+        if 'max_tf' in self.lexicon.dtype.names:
+            return int(self.lookup(term)['max_tf'])
+        return int(self.block_table(term)['max_tf'].max())
+
+    def collection_stats(self):
+        """Collection statistics used by the ranking functions
+
+        Returns:
+            dict: num_docs, num_tokens and avg_doc_len
+        """
+        return {'num_docs': self.num_docs, 'num_tokens': self.num_tokens, 'avg_doc_len': self.avg_doc_len}
+
+    def doc_id(self, doc_num):
+        """doc_id string of a document number
+        """
+        start, end = int(self.doc_offsets[doc_num]), int(self.doc_offsets[doc_num + 1])
+        return self.doc_ids[start:end].decode('utf-8')
+
+    def doc_num(self, doc_id):
+        """Binary search for the number of a document, doc numbers follow sorted doc_id order
+
+        Args:
+            doc_id (str): doc_id string
+
+        Returns:
+            int: Number of the document, None if the document is not in the index
+        """
+        key = doc_id.encode('utf-8')
+        lo, hi = 0, self.num_docs
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.doc_ids[int(self.doc_offsets[mid]):int(self.doc_offsets[mid + 1])] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self.num_docs and self.doc_id(lo) == doc_id:
+            return lo
+        return None
+
+    def doc_id_list(self, doc_nums):
+        """doc_id strings of many document numbers
+
+        Args:
+            doc_nums (list of int): Document numbers
+
+        Returns:
+            list of str: doc_id of each document
+        """
+        doc_nums = np.asarray(doc_nums, dtype=np.int64)
+        starts = self.doc_offsets[doc_nums].tolist()
+        ends = self.doc_offsets[doc_nums + 1].tolist()
+        return [self.doc_ids[start:end].decode('utf-8') for start, end in zip(starts, ends)]
+
+    def terms_iter(self):
+        """Iterates over all terms in sorted order
+        """
+        for i in range(len(self.lexicon)):
+            yield self.term_at(i).decode('utf-8')
+
+
+def write_index(index_dir, doc_table, doc_lens, inverted_index, codec=pc.DEFAULT_CODEC, block_size=pc.BLOCK_SIZE):
+    """Writes in-memory indexes to disk
+
+    Args:
+        index_dir (str): Directory to write the index to
+        doc_table (list of str): doc_id of each document, indexed by doc number
+        doc_lens (array): Length of each document, indexed by doc number
+        inverted_index (dict): term - gap-encoded postings
+        codec (str, optional): Postings codec, one of postings_codec.CODECS
+        block_size (int, optional): Number of postings per compressed block
+    """
+    with IndexWriter(index_dir, codec, block_size) as writer:
+        writer.write_docs(doc_table, doc_lens)
+        for term in sorted(inverted_index):
+            writer.add_term(term, inverted_index[term])
+
+
+def main():
+    """Converts previously pickled indexes to the on-disk format
+    """
+    print('Loading indices...')
+    with open('../data/INVERTED_INDEX_NOSTOP.pkl', 'rb') as file:
+        inverted_index = pickle.load(file)
+    with open('../data/DOC_LEN_INDEX_NOSTOP.pkl', 'rb') as file:
+        doc_len_index = pickle.load(file)
+
+    if isinstance(doc_len_index, dict):
+        # String-keyed indexes with postings [(doc_id, freq)]
+        doc_table, doc_len_index, inverted_index = ps.compact_indexes(inverted_index, doc_len_index)
+    else:
+        with open('../data/DOC_TABLE_NOSTOP.pkl', 'rb') as file:
+            doc_table = pickle.load(file)
+
+    print('Writing index...')
+    write_index(INDEX_DIR, doc_table, doc_len_index, inverted_index)
+    print('Index stored in ' + INDEX_DIR)
+
+
+if __name__ == '__main__':
+    main()
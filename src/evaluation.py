@@ -0,0 +1,265 @@
+"""In-process evaluation of rankings, computes the same numbers as trec_eval 9.0
+for map, P, recall and ndcg, without writing runs or results to disk
+
+Runs are dictionaries of topic number - [(doc_id, score)] in any order.
+As in trec_eval, documents are ranked on their score as a 32-bit float, ties broken on doc_id in descending order,
+each ranking is cut off at max_docs documents, and only topics with relevance judgements are evaluated.
+
+Attributes:
+    CUTOFFS (tuple of int): Default cutoffs of P and recall, the same as trec_eval
+    MEASURES (tuple of str): Measures computed by default
+    QRELS_FILE (str): TREC relevance judgements of the topics
+"""
+import numpy as np
+
+QRELS_FILE = '../data/qrels'
+CUTOFFS = (5, 10, 15, 20, 30, 100, 200, 500, 1000)
+MEASURES = ('map', 'P', 'recall', 'ndcg')
+
+# Qrels loaded by load_qrels, by path
+QRELS_CACHE = {}
+
+
+class Qrels:
+    """Relevance judgements indexed by topic and doc_id
+
+    Attributes:
+        judgements (dict): Topic number - {doc_id: relevance level}, negative levels are in the pool but unjudged
+        level_counts (dict): Topic number - number of judged documents of each relevance level (np.ndarray)
+        ideal_dcg (dict): Topic number - DCG of the ideal ranking, the gain of a document is its relevance level
+    """
+
+    def __init__(self, judgements):
+        """Indexes relevance judgements
+
+        Args:
+            judgements (dict): Topic number - {doc_id: relevance level}
+        """
+        self.judgements = judgements
+        self.level_counts = {}
+        self.ideal_dcg = {}
+        for topic, docs in judgements.items():
+            levels = np.array([rel for rel in docs.values() if rel >= 0], dtype=np.int64)
+            self.level_counts[topic] = np.bincount(levels)
+            ideal_gains = np.sort(levels[levels > 0])[::-1]
+            self.ideal_dcg[topic] = dcg(ideal_gains)
+
+    def __contains__(self, topic):
+        return topic in self.judgements
+
+    def __len__(self):
+        return len(self.judgements)
+
+    def num_rel(self, topic, relevance_level=1):
+        """Number of relevant documents of a topic
+
+        Args:
+            topic (str): Topic number
+            relevance_level (int, optional): Lowest relevance level that counts as relevant
+
+        Returns:
+            int: Number of judged documents with at least relevance_level
+        """
+        return int(self.level_counts[topic][relevance_level:].sum())
+
+    def levels(self, topic, doc_ids):
+        """Relevance levels of ranked documents, -1 for documents that are not judged
+
+        Args:
+            topic (str): Topic number
+            doc_ids (list of str): Ranked documents
+
+        Returns:
+            np.ndarray: Relevance level of each document
+        """
+        docs = self.judgements[topic]
+        return np.array([docs.get(doc_id, -1) for doc_id in doc_ids], dtype=np.int64)
+
+
+def read_qrels(path=QRELS_FILE):
+    """Reads a TREC qrels file
+
+    Args:
+        path (str, optional): Path of the file, lines of topic, iteration, doc_id and relevance level
+
+    Returns:
+        Qrels: Indexed relevance judgements
+    """
+    judgements = {}
+    with open(path) as file:
+        for line in file:
+            fields = line.split()
+            if len(fields) < 4:
+                continue
+            judgements.setdefault(fields[0], {})[fields[2]] = int(fields[3])
+    return Qrels(judgements)
+
+
+def load_qrels(path=QRELS_FILE):
+    """Reads a qrels file once, later calls return the same Qrels
+
+    Args:
+        path (str, optional): Path of the file
+
+    Returns:
+        Qrels: Indexed relevance judgements
+    """
+    if path not in QRELS_CACHE:
+        QRELS_CACHE[path] = read_qrels(path)
+    return QRELS_CACHE[path]
+
+
+def read_run(path):
+    """Reads a run in TREC format
+
+    Args:
+        path (str): Path of the run, lines of topic, Q0, doc_id, rank, score and run name
+
+    Returns:
+        dict: Topic number - [(doc_id, score)]
+    """
+    run = {}
+    with open(path) as file:
+        for line in file:
+            fields = line.split()
+            if len(fields) < 5:
+                continue
+            run.setdefault(fields[0], []).append((fields[2], float(fields[4])))
+    return run
+
+
+def rankings_to_run(rankings, index):
+    """Converts rankings of doc numbers, as returned by Searcher, to a run
+
+    Args:
+        rankings (dict): Topic number - [(score, doc number)]
+        index (DiskIndex): Index the doc numbers refer to
+
+    Returns:
+        dict: Topic number - [(doc_id, score)]
+    """
+    run = {}
+    for topic, ranking in rankings.items():
+        doc_ids = index.doc_id_list([doc_num for _, doc_num in ranking])
+        run[topic] = [(doc_id, score) for doc_id, (score, _) in zip(doc_ids, ranking)]
+    return run
+
+
+def dcg(gains):
+    """Discounted cumulative gain, the document at rank i (from 1) is discounted by log2(i + 1)
+
+    Args:
+        gains (np.ndarray): Gain of each ranked document
+
+    Returns:
+        float: DCG
+    """
+    return float(np.sum(gains / np.log2(np.arange(2, len(gains) + 2))))
+
+
+def rank_documents(docs, max_docs=1000):
+    """Orders documents like trec_eval, on decreasing score as a 32-bit float, ties on decreasing doc_id
+
+    Args:
+        docs (list of (str, float)): doc_id and score
+        max_docs (int, optional): Number of documents to keep
+
+    Returns:
+        list of str: Ranked doc_ids
+    """
+    ranked = sorted(((float(np.float32(score)), doc_id) for doc_id, score in docs), reverse=True)
+    return [doc_id for _, doc_id in ranked[:max_docs]]
+
+
+def evaluate_topic(qrels, topic, doc_ids, measures=MEASURES, cutoffs=CUTOFFS, relevance_level=1):
+    """Evaluates the ranking of one topic
+
+    Args:
+        qrels (Qrels): Relevance judgements
+        topic (str): Topic number
+        doc_ids (list of str): Ranked documents, see rank_documents
+        measures (tuple of str, optional): Measures to compute, some of 'map', 'P', 'recall' and 'ndcg'
+        cutoffs (tuple of int, optional): Cutoffs of P and recall
+        relevance_level (int, optional): Lowest relevance level that counts as relevant
+
+    Returns:
+        dict: Measure - value, P and recall as P_<cutoff> and recall_<cutoff>
+    """
+    levels = qrels.levels(topic, doc_ids)
+    relevant = levels >= relevance_level
+    rel_so_far = np.cumsum(relevant)
+    num_rel = qrels.num_rel(topic, relevance_level)
+    num_rel_ret = int(rel_so_far[-1]) if len(rel_so_far) else 0
+    rel_at = lambda cutoff: int(rel_so_far[min(cutoff, len(rel_so_far)) - 1]) if len(rel_so_far) else 0
+
+    values = {'num_ret': len(doc_ids), 'num_rel': num_rel, 'num_rel_ret': num_rel_ret}
+    if 'map' in measures:
+        ranks = np.flatnonzero(relevant) + 1
+        values['map'] = float(np.sum(rel_so_far[relevant] / ranks)) / num_rel if num_rel_ret else 0.0
+    if 'P' in measures:
+        for cutoff in cutoffs:
+            values['P_' + str(cutoff)] = rel_at(cutoff) / cutoff
+    if 'recall' in measures:
+        for cutoff in cutoffs:
+            values['recall_' + str(cutoff)] = rel_at(cutoff) / num_rel if num_rel else 0.0
+    if 'ndcg' in measures:
+        ideal_dcg = qrels.ideal_dcg[topic]
+        values['ndcg'] = dcg(np.maximum(levels, 0)) / ideal_dcg if ideal_dcg > 0 else 0.0
+    return values
+
+
+def evaluate(qrels, run, measures=MEASURES, cutoffs=CUTOFFS, relevance_level=1, max_docs=1000, complete=False, per_topic=False):
+    """Evaluates a run, like trec_eval -m <measures> [-l relevance_level] [-M max_docs] [-c] [-q]
+
+    Args:
+        qrels (Qrels): Relevance judgements
+        run (dict): Topic number - [(doc_id, score)]
+        measures (tuple of str, optional): Measures to compute, some of 'map', 'P', 'recall' and 'ndcg'
+        cutoffs (tuple of int, optional): Cutoffs of P and recall
+        relevance_level (int, optional): Lowest relevance level that counts as relevant
+        max_docs (int, optional): Number of documents evaluated per topic
+        complete (bool, optional): Average over all topics in qrels, topics without results count as zero
+        per_topic (bool, optional): Also return the values of each topic
+
+    Returns:
+        dict: Measure - value averaged over the topics, counts (num_q, num_ret, num_rel, num_rel_ret) are summed.
+            With per_topic, a tuple of this and topic number - measure - value
+    """
+    topic_values = {}
+    for topic in sorted(run):
+        if topic not in qrels:
+            continue
+        doc_ids = rank_documents(run[topic], max_docs)
+        topic_values[topic] = evaluate_topic(qrels, topic, doc_ids, measures, cutoffs, relevance_level)
+
+    num_q = len(qrels) if complete else len(topic_values)
+    values = {'num_q': num_q}
+    for topic_value in topic_values.values():
+        for measure, value in topic_value.items():
+            values[measure] = values.get(measure, 0) + value
+    for measure in values:
+        if not measure.startswith('num_') and num_q:
+            values[measure] /= num_q
+
+    if per_topic:
+        return values, topic_values
+    return values
+
+
+def format_measures(values, measures=None, topic='all'):
+    """Formats measures like the output of trec_eval
+
+    Args:
+        values (dict): Measure - value, see evaluate
+        measures (list of str, optional): Names of the measures to format, in order, defaults to all
+        topic (str, optional): Topic number, or 'all' for averages
+
+    Returns:
+        str: One line per measure
+    """
+    lines = []
+    for measure in measures or values:
+        value = values[measure]
+        value = str(value) if isinstance(value, int) else '%6.4f' % value
+        lines.append('%-22s\t%s\t%s\n' % (measure, topic, value))
+    return ''.join(lines)
@@ -1,15 +1,25 @@
 """Automated retrieval experiments
 """
 import os
+import _pickle as pickle
 import numpy as np
 from re import findall
-from ranking import ql, bm25, rank_evaluate
+from time import perf_counter
+from ranking import ql, bm25, sweep_evaluate, hybrid_evaluate, cascade_evaluate, impact_evaluate
 from rank_fusion import rank_fusion
+import disk_index as di
+import evaluation as ev
+import postings as ps
+import ranking as rk
+import run_files as rn
+import searcher as se
+import text_manipulation as tm
 
 def experiment_ql_jm():
     """Experiments query likelihood retrieval with Jelinek-Mercer smoothing,
-    lambda coefficient increments of 0.025 at a time, 40 experiments
+    lambda coefficient increments of 0.025 at a time, 40 experiments in one sweep
     """
+    grid = []
     for l in np.linspace(0.025, 1, 40):
         argdict = {
             'k': 1000,
@@ -17,13 +27,15 @@ def experiment_ql_jm():
             'smoothing': 'jm',
             'lambda': l
         }
-        rank_evaluate(argdict=argdict)
+        grid.append(argdict)
+    sweep_evaluate(grid)
 
 
 def experiment_ql_dir():
     """Experiments query likelihood retrieval with Dirichlet smoothing,
-    mu prior increments by 100 at a time, 40 experiments
+    mu prior increments by 100 at a time, 40 experiments in one sweep
     """
+    grid = []
     for mu in np.linspace(100, 4000, 40):
         argdict = {
             'k': 1000,
@@ -31,13 +43,15 @@ def experiment_ql_dir():
             'smoothing': 'dir',
             'mu': mu
         }
-        rank_evaluate(argdict=argdict)
+        grid.append(argdict)
+    sweep_evaluate(grid)
 
 
 def experiment_bm():
     """Experiments Okapi BM25 retrieval with k and b parameters,
-    both 21 different values, 20*16 = 320 experiments
+    both 21 different values, 20*16 = 320 experiments in one sweep
     """
+    grid = []
     for b in np.linspace(0.05, 1, 20):
         for k1 in np.linspace(0.125, 2, 16):
             argdict = {
@@ -46,18 +60,131 @@ def experiment_bm():
                 'k1': k1,
                 'b': b
             }
-            rank_evaluate(argdict=argdict)
+            grid.append(argdict)
+    sweep_evaluate(grid)
+
+
+def experiment_hybrid():
+    """Experiments fusion of the best Okapi BM25 and query likelihood rankings,
+    both rankings and their fusion computed in one pass for each fusion method
+    """
+    scorers = [
+        {'k': 1000, 'fun': bm25, 'k1': 1.2, 'b': 0.75},
+        {'k': 1000, 'fun': ql, 'smoothing': 'dir', 'mu': 800},
+    ]
+    for fusion in ['rrf', 'combsum', 'combmnz', 'borda']:
+        hybrid_evaluate(scorers, fusion)
+
+
+def experiment_cascade():
+    """Experiments cascade retrieval, Okapi BM25 candidates reranked with Dirichlet smoothed query likelihood,
+    number of candidates doubled at a time, reports the recall of the candidates for each
+    """
+    for candidates in [1000, 2000, 4000, 8000]:
+        argdict = {
+            'k': 1000,
+            'fun': ql,
+            'smoothing': 'dir',
+            'mu': 800,
+            'candidates': candidates,
+            'first_stage': {'fun': bm25, 'strategy': 'bmw'}
+        }
+        cascade_evaluate(argdict)
+
+
+def experiment_impact():
+    """Experiments score-at-a-time retrieval from the impact index, postings budget quartered at a time,
+    reports effectiveness against the budget and the latency of each
+    """
+    qrels = ev.load_qrels()
+    for budget in [None, 1000000, 250000, 62500, 15625, 3906]:
+        argdict = {
+            'k': 1000,
+            'postings_budget': budget
+        }
+        stats = impact_evaluate(argdict)
+        values = ev.evaluate(qrels, rn.load_run(stats['run_file']), measures=('map', 'P'), cutoffs=(30,))
+        print('Budget {}: MAP {:.4f}, P@30 {:.4f}, {:.0f} postings, p99 latency {:.2f} ms'.format(
+            budget or 'none', values['map'], values['P_30'], stats['postings'], stats['p99_latency']))
+
+
+def benchmark_length_norms(repeats=5):
+    """Times term-at-a-time scoring of all topics with the length normalization of every document
+    computed per query term, and looked up in the tables of ranking.length_norms
+
+    Args:
+        repeats (int, optional): Number of times all topics are scored, the fastest is reported
+    """
+    index = di.DiskIndex(di.INDEX_DIR)
+    stats = index.collection_stats()
+    with open("../data/TOPIC_DICT_NOSTOP.pkl", "rb") as file:
+        topic_dict = pickle.load(file)
+    doc_lens = index.doc_lens.astype(np.float64)
+    queries = []
+    for topic in topic_dict.values():
+        query_terms = [term for term in tm.process_text(topic) if term in index]
+        inv_idx, doc_freq_idx, term_freq_idx = rk.filter_disk_index(index, query_terms)
+        postings = {term: ps.decode_postings(inv_idx[term]) for term in inv_idx}
+        queries.append((query_terms, postings, doc_freq_idx, term_freq_idx))
+
+    for function, argdict in [(bm25, {}), (ql, {'smoothing': 'dir', 'mu': 800})]:
+        argdict = rk.with_stats(argdict, stats)
+        term_scores = rk.TERM_SCORES[function]
+        sparse = rk.has_sparse_term_scores(function, argdict)
+        norms = rk.length_norms(function, argdict, index.doc_lens)
+        timings = []
+        for table in (None, norms):
+            fastest = float('inf')
+            for _ in range(repeats):
+                start = perf_counter()
+                for query_terms, postings, doc_freq_idx, term_freq_idx in queries:
+                    rk.accumulate_term_scores(query_terms, postings, term_scores, sparse, doc_lens,
+                                              doc_freq_idx, term_freq_idx, argdict, table)
+                fastest = min(fastest, perf_counter() - start)
+            timings.append(fastest)
+        print('{} on {} documents, {} topics: {:.3f}s computed, {:.3f}s from tables ({:.2f}x)'.format(
+            function.__name__, index.num_docs, len(queries), timings[0], timings[1], timings[0] / timings[1]))
+
+
+def benchmark_shards(shard_counts=(1, 2, 4, 8), k=1000):
+    """Times the search of every topic, one query at a time, on the index unsharded and split into
+    doc-range shards, and checks that the rankings are identical
+
+    Args:
+        shard_counts (tuple of int, optional): Numbers of shards to time, 1 is the unsharded index
+        k (int, optional): Number of documents to retrieve per topic
+    """
+    with open("../data/TOPIC_DICT_NOSTOP.pkl", "rb") as file:
+        topic_dict = pickle.load(file)
+    baseline = None
+    for shards in shard_counts:
+        with se.Searcher(di.INDEX_DIR, processes=1, cache_size=0, shards=shards) as searcher:
+            # Warms up the page cache and starts the workers of the shards
+            searcher.rank(topic_dict[min(topic_dict)], k)
+            latencies = []
+            rankings = {}
+            for num in sorted(topic_dict):
+                start = perf_counter()
+                rankings[num] = searcher.rank(topic_dict[num], k)
+                latencies.append((perf_counter() - start) * 1000)
+        if baseline is None:
+            baseline = rankings
+        print('{} shards: mean {:.2f}ms, p50 {:.2f}ms, p95 {:.2f}ms, identical rankings: {}'.format(
+            shards, np.mean(latencies), np.percentile(latencies, 50), np.percentile(latencies, 95),
+            rankings == baseline))
 
 
 def run_eval():
-    """Runs trec_eval, stores results
+    """Evaluates all rankings in the output directory, stores MAP and P30 in trec_eval format
     """
     output_dir = '../outputs/'
     result_dir = '../results/'
-    for filename in os.listdir(output_dir):
-        if filename.endswith('.txt'):
-            with open(result_dir + filename, 'w+') as file:
-                os.system('./../trec_eval.9.0/trec_eval -m map -m P.30 ../data/qrels ' + output_dir + filename + ' > ' + result_dir + filename)
+    qrels = ev.load_qrels()
+    for filename in sorted(os.listdir(output_dir)):
+        if filename.endswith('.txt') or filename.endswith(rn.RUN_EXTENSION):
+            values = ev.evaluate(qrels, rn.load_run(output_dir + filename), measures=('map', 'P'), cutoffs=(30,))
+            with open(result_dir + filename.rsplit('.', 1)[0] + '.txt', 'w+') as file:
+                file.write(ev.format_measures(values, ['map', 'P_30']))
 
 
 def get_results_from_dir(result_directory):
@@ -118,19 +245,19 @@ def fusion_on_folder(fuse_folder):
         for i in range(len(filenames)-1):
             for j in range(i+1,len(filenames)):
                 print('\t'+filenames[i] + ' + ' + filenames[j])
-                print('\t'+str(rank_fusion(fuse_folder+folder+'/'+filenames[i],fuse_folder+folder+'/'+filenames[j],'min','temporary_results')[folder]))
+                print('\t'+str(rank_fusion(fuse_folder+folder+'/'+filenames[i],fuse_folder+folder+'/'+filenames[j],'min')[folder]))
         print(' - Interpolated fusion:')
         for i in range(len(filenames)-1):
             for j in range(i+1,len(filenames)):
                 print('\t'+filenames[i] + ' + ' + filenames[j])
 
-                print('\t'+str(rank_fusion(fuse_folder+folder+'/'+filenames[i],fuse_folder+folder+'/'+filenames[j],'interp','temporary_results')[folder]))
+                print('\t'+str(rank_fusion(fuse_folder+folder+'/'+filenames[i],fuse_folder+folder+'/'+filenames[j],'interp')[folder]))
         print(' - Borda count:')
         for i in range(len(filenames)-1):
             for j in range(i+1,len(filenames)):
                 print('\t'+filenames[i] + ' + ' + filenames[j])
 
-                print('\t'+str(rank_fusion(fuse_folder+folder+'/'+filenames[i],fuse_folder+folder+'/'+filenames[j],'borda','temporary_results')[folder]))
+                print('\t'+str(rank_fusion(fuse_folder+folder+'/'+filenames[i],fuse_folder+folder+'/'+filenames[j],'borda')[folder]))
 
         print('-----------------------')
 
@@ -160,6 +287,11 @@ def main():
     experiment_ql_dir()
     experiment_bm()
     run_eval()
+    # experiment_hybrid()
+    # experiment_cascade()
+    # experiment_impact()
+    # benchmark_length_norms()
+    # benchmark_shards()
     # fusion_on_folder('../outputs/best/')
 
 
@@ -1,5 +1,6 @@
-"""Filter all the indexes based on their occurence in the search term
-   This is to create a smaller index to save memory, especially when multiprocessing
+"""Filter indexes based on their occurence in the search terms
+   The on-disk index (disk_index.py) is only read for the terms that are looked up,
+   so filtered copies of the full index are no longer written
 """
 import gc
 import heapq
@@ -41,23 +42,3 @@ def split_stop_stem_topics(topics):
     proc_topics = [tm.process_text(topic) for topic in topics.values()]
     terms = list(set([term for topic_terms in proc_topics for term in topic_terms]))
     return terms
-
-def filter_all():
-    """Filter all the indexes based on their occurence in the search term
-    """
-    print('Loading inverted index...')
-    with open("../data/INVERTED_INDEX_NOSTOP.pkl", "rb") as file:
-        inverted_index = pickle.load(file)
-    with open("../data/TOPIC_DICT_NOSTOP.pkl", "rb") as file:
-        topic_dict = pickle.load(file)
-
-
-    terms = split_stop_stem_topics(topic_dict)
-
-    print('Writing filtered index...')
-
-    filtered_inverted_index = filter_dict(inverted_index, terms)
-    pickle.dump(filtered_inverted_index, open('../data/FILTERED_INVERTED_INDEX_NOSTOP.pkl', 'wb'))
-
-if __name__ == "__main__":
-    filter_all()
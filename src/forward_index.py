@@ -0,0 +1,130 @@
+"""Forward index of an on-disk index: the terms of each document with their frequencies
+
+Built from the postings of an index written by disk_index.py and stored next to it:
+    forward_terms.bin: term number (position in the lexicon) of each posting, grouped by document, ascending
+    forward_freqs.bin: term frequency of each posting, aligned with forward_terms.bin
+    forward_offsets.bin: start of the postings of each document (uint64), num_docs + 1 entries
+Opened with mmap, so looking up a few candidate documents only touches their bytes.
+
+Attributes:
+    FORWARD_FILES (tuple of str): Files of a forward index
+"""
+import os
+
+import numpy as np
+
+import disk_index as di
+
+FORWARD_TERMS_FILE = 'forward_terms.bin'
+FORWARD_FREQS_FILE = 'forward_freqs.bin'
+FORWARD_OFFSETS_FILE = 'forward_offsets.bin'
+FORWARD_FILES = (FORWARD_TERMS_FILE, FORWARD_FREQS_FILE, FORWARD_OFFSETS_FILE)
+
+
+def has_forward_index(index_dir=di.INDEX_DIR):
+    """Whether the forward index of an index has been built
+    """
+    return all(os.path.exists(os.path.join(index_dir, name)) for name in FORWARD_FILES)
+
+
+def write_forward_index(index_dir=di.INDEX_DIR):
+    """Builds the forward index of an on-disk index, in two passes over its postings
+
+    The first pass counts the terms of each document, the second fills the terms of all documents
+    into the memory-mapped output files term by term, so term numbers are ascending within a document.
+
+    Args:
+        index_dir (str, optional): Directory of the index
+    """
+    index = di.DiskIndex(index_dir)
+    counts = np.zeros(index.num_docs, dtype=np.int64)
+    for term in index.terms_iter():
+        counts[np.cumsum(index.postings(term)[0], dtype=np.int64)] += 1
+    offsets = np.zeros(index.num_docs + 1, dtype='<u8')
+    np.cumsum(counts, out=offsets[1:])
+    num_postings = int(offsets[-1])
+
+    paths = [os.path.join(index_dir, name) for name in (FORWARD_TERMS_FILE, FORWARD_FREQS_FILE)]
+    if num_postings == 0:
+        for path in paths:
+            open(path, 'wb').close()
+    else:
+        term_nums, term_freqs = (np.memmap(path, dtype='<u4', mode='w+', shape=(num_postings,)) for path in paths)
+        cursors = offsets[:-1].astype(np.int64)
+        for term_num, term in enumerate(index.terms_iter()):
+            gaps, freqs = index.postings(term)
+            doc_nums = np.cumsum(gaps, dtype=np.int64)
+            positions = cursors[doc_nums]
+            term_nums[positions] = term_num
+            term_freqs[positions] = freqs
+            cursors[doc_nums] += 1
+        term_nums.flush()
+        term_freqs.flush()
+        del term_nums, term_freqs
+    offsets.tofile(os.path.join(index_dir, FORWARD_OFFSETS_FILE))
+
+
+class ForwardIndex:
+    """Read-only forward index opened with mmap
+
+    Attributes:
+        num_docs (int): Number of documents
+        term_nums (np.ndarray): Term number of each posting, grouped by document
+        term_freqs (np.ndarray): Term frequency of each posting
+        offsets (np.ndarray): Start of the postings of each document
+    """
+
+    def __init__(self, index_dir=di.INDEX_DIR):
+        """Opens a forward index written by write_forward_index
+
+        Args:
+            index_dir (str, optional): Directory of the index
+        """
+        self.term_nums = np.frombuffer(di.map_file(os.path.join(index_dir, FORWARD_TERMS_FILE)), dtype='<u4')
+        self.term_freqs = np.frombuffer(di.map_file(os.path.join(index_dir, FORWARD_FREQS_FILE)), dtype='<u4')
+        self.offsets = np.frombuffer(di.map_file(os.path.join(index_dir, FORWARD_OFFSETS_FILE)), dtype='<u8')
+        self.num_docs = len(self.offsets) - 1
+
+    def doc_terms(self, doc_num):
+        """Terms of a document
+
+        Returns:
+            (np.ndarray, np.ndarray): Term numbers (ascending) and their frequencies in the document
+        """
+        start, end = int(self.offsets[doc_num]), int(self.offsets[doc_num + 1])
+        return self.term_nums[start:end], self.term_freqs[start:end]
+
+    def term_freq_matrix(self, doc_nums, term_nums):
+        """Frequencies of some terms in some documents, read in one vectorized gather
+
+        Args:
+            doc_nums (np.ndarray): Doc numbers
+            term_nums (list of int): Term numbers
+
+        Returns:
+            np.ndarray: Frequency (int64) of each term (columns) in each document (rows)
+        """
+        doc_nums = np.asarray(doc_nums, dtype=np.int64)
+        starts = self.offsets[doc_nums].astype(np.int64)
+        lengths = self.offsets[doc_nums + 1].astype(np.int64) - starts
+        rows = np.repeat(np.arange(len(doc_nums)), lengths)
+        positions = np.arange(len(rows)) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+
+        matrix = np.zeros((len(doc_nums), len(term_nums)), dtype=np.int64)
+        doc_term_nums = self.term_nums[positions]
+        for col, term_num in enumerate(term_nums):
+            found = doc_term_nums == term_num
+            matrix[rows[found], col] = self.term_freqs[positions[found]]
+        return matrix
+
+
+def main():
+    """Builds the forward index of the index built by build_index.py
+    """
+    print('Writing forward index...')
+    write_forward_index(di.INDEX_DIR)
+    print('Forward index stored in ' + di.INDEX_DIR)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Fuses any number of rankings into one
+
+Documents are merged through a dictionary of doc_id - position and their scores accumulated in arrays,
+so fusing a topic is linear in the total length of its rankings. Rankings are lists of (doc_id, score), best first,
+as in the runs of run_files.load_run. Methods:
+    rrf: reciprocal rank fusion, sum of 1 / (RRF_K + rank) with ranks from 1
+    combsum: sum of min-max normalized scores
+    combmnz: combsum times the number of rankings that contain the document
+    borda: sum of the number of documents ranked below the document
+    interp: weighted mean of min-max normalized scores
+    min: best rank over the rankings, ties in the order of the rankings
+
+Attributes:
+    FUSION_METHODS (tuple of str): Supported methods
+    RRF_K (int): Rank offset of reciprocal rank fusion
+"""
+import numpy as np
+
+import run_files as rn
+
+RRF_K = 60
+FUSION_METHODS = ('rrf', 'combsum', 'combmnz', 'borda', 'interp', 'min')
+
+
+def min_max_normalize(scores):
+    """Scales scores to [0, 1], all equal scores become 1
+
+    Args:
+        scores (np.ndarray): Scores of a ranking
+
+    Returns:
+        np.ndarray: Normalized scores
+    """
+    if not len(scores):
+        return scores
+    minimum, maximum = scores.min(), scores.max()
+    if maximum == minimum:
+        return np.ones_like(scores)
+    return (scores - minimum) / (maximum - minimum)
+
+
+def fuse_topic(rankings, method='rrf', weights=None, depth=1000, rrf_k=RRF_K):
+    """Fuses the rankings of one topic
+
+    Args:
+        rankings (list of list of (str, float)): doc_id and score of each ranking, best first
+        method (str, optional): One of FUSION_METHODS
+        weights (list of float, optional): Weight of each ranking, defaults to equal weights
+        depth (int, optional): Number of documents in the fused ranking
+        rrf_k (int, optional): Rank offset of reciprocal rank fusion
+
+    Returns:
+        list of (str, float): doc_id and fused score, best first, ties in order of first appearance
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError('Unknown fusion method ' + method + ', expected one of ' + ', '.join(FUSION_METHODS))
+    if weights is None:
+        weights = [1.0 / len(rankings)] * len(rankings) if method == 'interp' else [1.0] * len(rankings)
+
+    doc_pos = {}
+    positions = []
+    for ranking in rankings:
+        positions.append(np.array([doc_pos.setdefault(doc_id, len(doc_pos)) for doc_id, _ in ranking], dtype=np.int64))
+    doc_ids = list(doc_pos)
+
+    if method == 'min':
+        # Interleaving the rankings, rank by rank
+        fused = np.full(len(doc_ids), np.inf)
+        for i, pos in enumerate(positions):
+            np.minimum.at(fused, pos, np.arange(len(pos)) * len(rankings) + i)
+        fused = 0.0 - fused
+    else:
+        fused = np.zeros(len(doc_ids))
+        counts = np.zeros(len(doc_ids))
+        for ranking, pos, weight in zip(rankings, positions, weights):
+            if method == 'rrf':
+                contribution = 1.0 / (rrf_k + np.arange(1, len(pos) + 1))
+            elif method == 'borda':
+                contribution = len(pos) - np.arange(len(pos), dtype=np.float64)
+            else:
+                contribution = min_max_normalize(np.array([score for _, score in ranking], dtype=np.float64))
+            np.add.at(fused, pos, weight * contribution)
+            np.add.at(counts, pos, 1)
+        if method == 'combmnz':
+            fused *= counts
+
+    order = np.argsort(-fused, kind='stable')[:depth]
+    return [(doc_ids[i], float(fused[i])) for i in order]
+
+
+def fuse_runs(runs, method='rrf', weights=None, depth=1000, rrf_k=RRF_K):
+    """Fuses runs for every topic, topics missing from a run are fused from the other runs
+
+    Args:
+        runs (list of dict): Topic number - [(doc_id, score)] in rank order, see run_files.load_run
+        method (str, optional): One of FUSION_METHODS
+        weights (list of float, optional): Weight of each run, see fuse_topic
+        depth (int, optional): Number of documents per topic in the fused run
+        rrf_k (int, optional): Rank offset of reciprocal rank fusion
+
+    Returns:
+        dict: Topic number - [(doc_id, fused score)], best first
+    """
+    topics = sorted(set().union(*runs))
+    return {topic: fuse_topic([run.get(topic, []) for run in runs], method, weights, depth, rrf_k) for topic in topics}
+
+
+def fuse_files(file_names, method='rrf', weights=None, depth=1000, out_file_name=None):
+    """Fuses run files
+
+    Args:
+        file_names (list of str): Run files, TREC text with documents in rank order or binary, see run_files.py
+        method (str, optional): One of FUSION_METHODS
+        weights (list of float, optional): Weight of each run, see fuse_topic
+        depth (int, optional): Number of documents per topic in the fused run
+        out_file_name (str, optional): Where to store the fused run, not stored if None
+
+    Returns:
+        dict: Topic number - [(doc_id, fused score)], best first
+    """
+    fused_run = fuse_runs([rn.load_run(file_name) for file_name in file_names], method, weights, depth)
+    if out_file_name is not None:
+        with open(out_file_name, 'w+') as file:
+            write_run(file, fused_run)
+    return fused_run
+
+
+def write_run(file, run, run_name='STANDARD'):
+    """Writes a run in TREC format
+
+    Args:
+        file (file): Run file
+        run (dict): Topic number - [(doc_id, score)], best first
+        run_name (str, optional): Name in the last column
+    """
+    for topic, ranking in run.items():
+        file.write(''.join(' '.join([topic, 'Q0', doc_id, str(rank), str(score), run_name]) + '\n'
+                           for rank, (doc_id, score) in enumerate(ranking)))
@@ -0,0 +1,185 @@
+"""Impact-ordered index of an on-disk index, for score-at-a-time retrieval with a budget
+
+Built from the postings of an index written by disk_index.py and stored next to it. The Okapi BM25 contribution
+of every (term, document) pair is precomputed and quantized to an 8-bit impact, with one scale for the whole
+collection, so impacts of different terms add up like their scores. The postings of a term are grouped into
+segments of equal impact, highest impact first:
+    impact_docs.bin: doc numbers (uint32) of all postings, by term, by segment, ascending within a segment
+    impact_segments.bin: SEGMENT_DTYPE record of each segment, by term
+    impact_terms.bin: start of the segments of each term (uint64), num_terms + 1 entries, by term number
+        (position in the lexicon)
+    impact_meta.json: build ID of the index, ranking parameters, quantization scale and number of documents
+Postings whose contribution is not positive (terms in more than half of the documents) get impact 0 and are
+left out. Opened with mmap, so a query only touches the segments it processes.
+
+Attributes:
+    IMPACT_BITS (int): Bits of a quantized impact
+    IMPACT_FILES (tuple of str): Files of an impact index
+    SEGMENT_DTYPE (np.dtype): Record describing one segment
+"""
+import json
+import os
+
+import numpy as np
+
+import disk_index as di
+import ranking as rk
+
+IMPACT_BITS = 8
+
+IMPACT_DOCS_FILE = 'impact_docs.bin'
+IMPACT_SEGMENTS_FILE = 'impact_segments.bin'
+IMPACT_TERMS_FILE = 'impact_terms.bin'
+IMPACT_META_FILE = 'impact_meta.json'
+IMPACT_FILES = (IMPACT_DOCS_FILE, IMPACT_SEGMENTS_FILE, IMPACT_TERMS_FILE, IMPACT_META_FILE)
+
+SEGMENT_DTYPE = np.dtype([
+    ('impact', '<u1'),
+    ('count', '<u4'),
+    ('offset', '<u8'),
+])
+
+
+def impact_params(argdict={}):
+    """Okapi BM25 parameters of an impact index, defaults as in ranking.okapi_bm25
+    """
+    return {'k1': argdict.get('k1', 1.2), 'b': argdict.get('b', 0.75)}
+
+
+def has_impact_index(index_dir=di.INDEX_DIR, argdict={}):
+    """Whether an impact index has been built for this build of an index and these BM25 parameters
+    """
+    if not all(os.path.exists(os.path.join(index_dir, name)) for name in IMPACT_FILES):
+        return False
+    with open(os.path.join(index_dir, IMPACT_META_FILE)) as file:
+        meta = json.load(file)
+    return meta['build_id'] == di.DiskIndex(index_dir).build_id and meta['params'] == impact_params(argdict)
+
+
+def term_contributions(index, term, params, norms):
+    """Okapi BM25 contribution of a term to each document containing it
+
+    Returns:
+        (np.ndarray, np.ndarray): Doc numbers and contributions
+    """
+    gaps, freqs = index.postings(term)
+    doc_nums = np.cumsum(gaps, dtype=np.int64)
+    doc_lens = index.doc_lens[doc_nums].astype(np.float64)
+    scores = rk.bm25_term_scores(freqs.astype(np.float64), doc_lens, index.doc_freq(term), index.collection_freq(term),
+                                 params, norms[doc_nums])
+    return doc_nums, scores
+
+
+def write_impact_index(index_dir=di.INDEX_DIR, argdict={}, bits=IMPACT_BITS):
+    """Builds the impact index of an on-disk index, in two passes over its postings
+
+    The first pass finds the highest contribution in the collection, which sets the quantization scale,
+    the second quantizes the contributions and writes the segments term by term.
+
+    Args:
+        index_dir (str, optional): Directory of the index
+        argdict (dict, optional): Okapi BM25 parameters 'k1' and 'b'
+        bits (int, optional): Bits of a quantized impact, at most 8
+    """
+    meta_path = os.path.join(index_dir, IMPACT_META_FILE)
+    if os.path.exists(meta_path):
+        # Written last, so an interrupted build is not taken for a complete one
+        os.remove(meta_path)
+    index = di.DiskIndex(index_dir)
+    params = impact_params(argdict)
+    # Without the statistics in the metadata, see has_impact_index
+    scoring_params = rk.with_stats(params, index.collection_stats())
+    norms = rk.length_norms(rk.bm25, scoring_params, index.doc_lens)
+    levels = (1 << bits) - 1
+
+    max_score = 0.0
+    for term in index.terms_iter():
+        _, scores = term_contributions(index, term, scoring_params, norms)
+        if len(scores):
+            max_score = max(max_score, float(scores.max()))
+    scale = max_score / levels if max_score > 0 else 1.0
+
+    term_starts = np.zeros(len(index) + 1, dtype='<u8')
+    num_postings = 0
+    with open(os.path.join(index_dir, IMPACT_DOCS_FILE), 'wb') as docs_file, \
+            open(os.path.join(index_dir, IMPACT_SEGMENTS_FILE), 'wb') as segments_file:
+        for term_num, term in enumerate(index.terms_iter()):
+            doc_nums, scores = term_contributions(index, term, scoring_params, norms)
+            impacts = np.clip(np.ceil(scores / scale), 0, levels).astype(np.int64)
+            kept = impacts > 0
+            doc_nums, impacts = doc_nums[kept], impacts[kept]
+            order = np.lexsort((doc_nums, -impacts))
+            doc_nums, impacts = doc_nums[order], impacts[order]
+
+            starts = np.flatnonzero(np.diff(impacts, prepend=-1))
+            segments = np.zeros(len(starts), dtype=SEGMENT_DTYPE)
+            segments['impact'] = impacts[starts]
+            segments['count'] = np.diff(starts, append=len(impacts))
+            segments['offset'] = num_postings + starts
+            docs_file.write(doc_nums.astype('<u4').tobytes())
+            segments_file.write(segments.tobytes())
+            num_postings += len(doc_nums)
+            term_starts[term_num + 1] = term_starts[term_num] + len(segments)
+    term_starts.tofile(os.path.join(index_dir, IMPACT_TERMS_FILE))
+
+    meta = {'build_id': index.build_id, 'params': params, 'bits': bits, 'scale': scale, 'num_docs': index.num_docs,
+            'num_postings': num_postings}
+    with open(meta_path, 'w') as file:
+        json.dump(meta, file)
+
+
+class ImpactIndex:
+    """Read-only impact index opened with mmap
+
+    Attributes:
+        meta (dict): Contents of impact_meta.json
+        scale (float): Okapi BM25 score of one unit of impact
+        num_docs (int): Number of documents
+        doc_nums (np.ndarray): Doc numbers of all postings, by term and segment
+        segments (np.ndarray): SEGMENT_DTYPE record of each segment
+        term_starts (np.ndarray): Start of the segments of each term
+    """
+
+    def __init__(self, index_dir=di.INDEX_DIR):
+        """Opens an impact index written by write_impact_index
+
+        Args:
+            index_dir (str, optional): Directory of the index
+        """
+        with open(os.path.join(index_dir, IMPACT_META_FILE)) as file:
+            self.meta = json.load(file)
+        self.scale = self.meta['scale']
+        self.doc_nums = np.frombuffer(di.map_file(os.path.join(index_dir, IMPACT_DOCS_FILE)), dtype='<u4')
+        self.segments = np.frombuffer(di.map_file(os.path.join(index_dir, IMPACT_SEGMENTS_FILE)), dtype=SEGMENT_DTYPE)
+        self.term_starts = np.frombuffer(di.map_file(os.path.join(index_dir, IMPACT_TERMS_FILE)), dtype='<u8')
+        self.num_docs = self.meta['num_docs']
+
+    def term_segments(self, term_num):
+        """Segments of a term, highest impact first
+
+        Returns:
+            np.ndarray: SEGMENT_DTYPE records
+        """
+        return self.segments[int(self.term_starts[term_num]):int(self.term_starts[term_num + 1])]
+
+    def segment_docs(self, segment, count=None):
+        """Doc numbers of a segment, ascending
+
+        Args:
+            segment (np.void): SEGMENT_DTYPE record
+            count (int, optional): Number of doc numbers to read, defaults to the whole segment
+        """
+        offset = int(segment['offset'])
+        return self.doc_nums[offset:offset + int(segment['count'] if count is None else count)]
+
+
+def main():
+    """Builds the impact index of the index built by build_index.py
+    """
+    print('Writing impact index...')
+    write_impact_index(di.INDEX_DIR)
+    print('Impact index stored in ' + di.INDEX_DIR)
+
+
+if __name__ == '__main__':
+    main()
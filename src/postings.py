@@ -0,0 +1,163 @@
+"""Compact array-backed postings and document tables
+
+Documents are numbered densely in sorted order of their doc_id strings,
+so comparing doc numbers gives the same order as comparing the original doc_ids.
+The postings of a term are a pair of arrays: gaps between consecutive doc numbers and term frequencies.
+
+Attributes:
+    TYPECODE (str): array typecode used for doc gaps, term frequencies and document lengths
+"""
+from array import array
+
+import numpy as np
+
+TYPECODE = 'I'
+
+
+def new_postings():
+    """Creates empty postings, to be filled in doc number order with append_posting
+
+    Returns:
+        (array, array): Empty doc numbers and term frequencies
+    """
+    return array(TYPECODE), array(TYPECODE)
+
+
+def append_posting(postings, doc_num, freq):
+    """Appends a (doc number, term frequency) pair to postings
+
+    Args:
+        postings (array, array): Doc numbers and term frequencies
+        doc_num (int): Number of document
+        freq (int): Frequency of the term in the document
+    """
+    postings[0].append(doc_num)
+    postings[1].append(freq)
+
+
+def encode_postings(doc_nums, freqs):
+    """Gap-encodes postings
+
+    Args:
+        doc_nums (sequence of int): Ascending doc numbers
+        freqs (sequence of int): Term frequencies, aligned with doc_nums
+
+    Returns:
+        (array, array): Doc gaps and term frequencies
+    """
+    doc_nums = np.asarray(doc_nums, dtype=np.int64)
+    gaps = np.diff(doc_nums, prepend=0).astype(np.uint32)
+    return array(TYPECODE, gaps.tobytes()), array(TYPECODE, np.asarray(freqs, dtype=np.uint32).tobytes())
+
+
+def decode_postings(postings):
+    """Decodes gap-encoded postings
+
+    Args:
+        postings (array, array): Doc gaps and term frequencies
+
+    Returns:
+        (np.ndarray, np.ndarray): Doc numbers and term frequencies
+    """
+    gaps, freqs = postings
+    doc_nums = np.cumsum(np.frombuffer(gaps, dtype=np.uint32), dtype=np.int64)
+    return doc_nums, np.frombuffer(freqs, dtype=np.uint32).astype(np.int64)
+
+
+def posting_pairs(postings):
+    """Decodes gap-encoded postings into (doc number, term frequency) pairs
+
+    Args:
+        postings (array, array): Doc gaps and term frequencies
+
+    Returns:
+        list of (int, int): Postings as used by document-at-a-time retrieval
+    """
+    doc_nums, freqs = decode_postings(postings)
+    return list(zip(doc_nums.tolist(), freqs.tolist()))
+
+
+def doc_freq(postings):
+    """Number of documents in postings
+    """
+    return len(postings[1])
+
+
+def collection_freq(postings):
+    """Total frequency of the term over all documents in postings
+    """
+    return int(np.frombuffer(postings[1], dtype=np.uint32).sum(dtype=np.int64))
+
+
+def sorted_doc_numbers(doc_ids):
+    """Numbers documents in sorted doc_id order
+
+    Args:
+        doc_ids (list of str): doc_id of each document, indexed by doc number in indexing order
+
+    Returns:
+        (list of int, np.ndarray): Old doc numbers in sorted order, and the new doc number of each old one
+    """
+    order = sorted(range(len(doc_ids)), key=doc_ids.__getitem__)
+    new_nums = np.empty(len(order), dtype=np.int64)
+    new_nums[order] = np.arange(len(order))
+    return order, new_nums
+
+
+def renumber_postings(doc_nums, freqs, new_nums):
+    """Renumbers postings and gap-encodes them in the new doc number order
+
+    Args:
+        doc_nums (array): Old doc numbers
+        freqs (array): Term frequencies, aligned with doc_nums
+        new_nums (np.ndarray): New doc number of each old one, see sorted_doc_numbers
+
+    Returns:
+        (array, array): Doc gaps and term frequencies
+    """
+    doc_nums = new_nums[np.frombuffer(doc_nums, dtype=np.uint32)]
+    posting_order = np.argsort(doc_nums, kind='stable')
+    return encode_postings(doc_nums[posting_order], np.frombuffer(freqs, dtype=np.uint32)[posting_order])
+
+
+def sort_doc_numbers(doc_ids, doc_lens, inverted_index):
+    """Renumbers documents numbered in indexing order to sorted doc_id order, and gap-encodes the postings
+
+    Args:
+        doc_ids (list of str): doc_id of each document, indexed by doc number
+        doc_lens (array): Length of each document, indexed by doc number
+        inverted_index (dict): term - (doc numbers, term frequencies) in indexing order
+
+    Returns:
+        (list of str, array, dict): Sorted doc table, document lengths and gap-encoded inverted index
+    """
+    order, new_nums = sorted_doc_numbers(doc_ids)
+    doc_table = [doc_ids[i] for i in order]
+    doc_lens = array(TYPECODE, np.frombuffer(doc_lens, dtype=np.uint32)[order].tobytes())
+
+    for term, (doc_nums, freqs) in inverted_index.items():
+        inverted_index[term] = renumber_postings(doc_nums, freqs, new_nums)
+
+    return doc_table, doc_lens, inverted_index
+
+
+def compact_indexes(inverted_index, doc_len_index):
+    """Converts string-keyed indexes to the compact representation
+
+    Args:
+        inverted_index (dict): term - [(doc_id, freq)]
+        doc_len_index (dict): doc_id - doc_len
+
+    Returns:
+        (list of str, array, dict): Sorted doc table, document lengths and gap-encoded inverted index
+    """
+    doc_table = sorted(doc_len_index)
+    doc_nums = {doc_id: i for i, doc_id in enumerate(doc_table)}
+    doc_lens = array(TYPECODE, [doc_len_index[doc_id] for doc_id in doc_table])
+
+    compact_index = {}
+    for term, postings in inverted_index.items():
+        pairs = sorted((doc_nums[doc_id], freq) for doc_id, freq in postings)
+        compact_index[term] = encode_postings([p[0] for p in pairs], [p[1] for p in pairs])
+
+    return doc_table, doc_lens, compact_index
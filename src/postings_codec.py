@@ -0,0 +1,281 @@
+"""Block compression of postings for the on-disk index
+
+The postings of a term are split in blocks of BLOCK_SIZE postings. Doc gaps and term frequencies
+(stored minus one, as they are at least one) are compressed per block with one of the CODECS:
+    vbyte: 7 bits per byte, the high bit marks the last byte of a value
+    bitpack: PForDelta-style, all values packed with one bit width per block,
+        the values that do not fit are stored separately as exceptions
+
+The data of a term is laid out as
+    [block table: BLOCK_DTYPE per block][doc gaps of all blocks][term frequencies of all blocks]
+so a single block can be decoded through the offsets in the block table,
+and vbyte postings can be decoded as one stream.
+All decoders are vectorized with NumPy.
+
+Attributes:
+    BLOCK_DTYPE (np.dtype): Metadata of one block, offsets are the end of the block in its section
+    BLOCK_SIZE (int): Number of postings per block
+    CODECS (dict): name - (encode function, decode function)
+    DEFAULT_CODEC (str): Codec used by build_index.py
+"""
+import numpy as np
+
+BLOCK_SIZE = 128
+DEFAULT_CODEC = 'bitpack'
+
+BLOCK_DTYPE = np.dtype([
+    ('last_doc', '<u4'),
+    ('max_tf', '<u4'),
+    ('min_doc_len', '<u4'),
+    ('doc_end', '<u4'),
+    ('freq_end', '<u4'),
+])
+
+BITPACK_HEADER_DTYPE = np.dtype([('width', 'u1'), ('num_exceptions', '<u2')])
+
+
+def vbyte_encode(values):
+    """Variable-byte encodes values
+
+    Args:
+        values (sequence of int): Non-negative values smaller than 2**32
+
+    Returns:
+        bytes: Encoded values
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    num_bytes = np.ones(len(values), dtype=np.int64)
+    for i in range(1, 5):
+        num_bytes += values >= (1 << (7 * i))
+    starts = np.cumsum(num_bytes) - num_bytes
+    value_of_byte = np.repeat(np.arange(len(values)), num_bytes)
+    shifts = (np.arange(len(value_of_byte)) - starts[value_of_byte]) * 7
+    encoded = ((values[value_of_byte] >> shifts.astype(np.uint64)) & 0x7f).astype(np.uint8)
+    encoded[starts + num_bytes - 1] |= 0x80
+    return encoded.tobytes()
+
+
+def vbyte_decode(data, count=None):
+    """Decodes variable-byte encoded values
+
+    Args:
+        data (bytes-like): Encoded values
+        count (int, optional): Number of values, only used as a check
+
+    Returns:
+        np.ndarray: Decoded values (uint32)
+    """
+    encoded = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(encoded & 0x80)
+    if count is not None and len(ends) != count:
+        raise ValueError('Expected ' + str(count) + ' vbyte values, found ' + str(len(ends)))
+    if len(ends) == 0:
+        return np.zeros(0, dtype=np.uint32)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+    value_of_byte = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = (np.arange(len(encoded)) - starts[value_of_byte]) * 7
+    parts = (encoded & 0x7f).astype(np.uint64) << shifts.astype(np.uint64)
+    return np.add.reduceat(parts, starts).astype(np.uint32)
+
+
+def bit_lengths(values):
+    """Number of bits needed for each value
+    """
+    values = np.asarray(values, dtype=np.uint64)
+    lengths = np.zeros(len(values), dtype=np.int64)
+    remaining = values.copy()
+    while remaining.any():
+        lengths += remaining > 0
+        remaining >>= np.uint64(1)
+    return lengths
+
+
+def bitpack_encode(values):
+    """PForDelta-style encodes one block of values, choosing the bit width that gives the smallest block
+
+    Args:
+        values (sequence of int): Non-negative values smaller than 2**32
+
+    Returns:
+        bytes: Header (bit width, number of exceptions), packed values, exception positions and values
+    """
+    values = np.asarray(values, dtype=np.uint32)
+    lengths = bit_lengths(values)
+    # Exceptions cost a position and a full value each
+    counts = np.bincount(lengths, minlength=33)
+    exceptions = len(values) - np.cumsum(counts)
+    widths = np.arange(33)
+    costs = (len(values) * widths + 7) // 8 + exceptions * 6
+    width = int(np.argmin(costs))
+
+    exception_pos = np.flatnonzero(lengths > width)
+    header = np.zeros(1, dtype=BITPACK_HEADER_DTYPE)
+    header['width'] = width
+    header['num_exceptions'] = len(exception_pos)
+
+    low = values.astype(np.uint64) & np.uint64((1 << width) - 1)
+    bits = ((low[:, None] >> np.arange(width, dtype=np.uint64)) & np.uint64(1)).astype(np.uint8)
+    packed = np.packbits(bits.ravel(), bitorder='little')
+
+    return b''.join([
+        header.tobytes(),
+        packed.tobytes(),
+        exception_pos.astype('<u2').tobytes(),
+        values[exception_pos].astype('<u4').tobytes(),
+    ])
+
+
+def bitpack_decode(data, count):
+    """Decodes one block encoded with bitpack_encode
+
+    Args:
+        data (bytes-like): Encoded block
+        count (int): Number of values in the block
+
+    Returns:
+        np.ndarray: Decoded values (uint32)
+    """
+    data = np.frombuffer(data, dtype=np.uint8)
+    header = np.frombuffer(data, dtype=BITPACK_HEADER_DTYPE, count=1)[0]
+    width = int(header['width'])
+    num_exceptions = int(header['num_exceptions'])
+
+    offset = BITPACK_HEADER_DTYPE.itemsize
+    packed_len = (count * width + 7) // 8
+    bits = np.unpackbits(data[offset:offset + packed_len], count=count * width, bitorder='little')
+    values = bits.reshape(count, width).astype(np.uint32) @ (np.uint32(1) << np.arange(width, dtype=np.uint32))
+    values = values.astype(np.uint32)
+
+    offset += packed_len
+    if num_exceptions:
+        exception_pos = np.frombuffer(data, dtype='<u2', count=num_exceptions, offset=offset)
+        offset += 2 * num_exceptions
+        values[exception_pos] = np.frombuffer(data, dtype='<u4', count=num_exceptions, offset=offset)
+    return values
+
+
+CODECS = {
+    'vbyte': (vbyte_encode, vbyte_decode),
+    'bitpack': (bitpack_encode, bitpack_decode),
+}
+
+
+def num_blocks(doc_freq, block_size=BLOCK_SIZE):
+    """Number of blocks for a term with doc_freq postings
+    """
+    return (doc_freq + block_size - 1) // block_size
+
+
+def encode_term(gaps, freqs, doc_lens, codec=DEFAULT_CODEC, block_size=BLOCK_SIZE):
+    """Compresses the postings of a term
+
+    Args:
+        gaps (sequence of int): Doc gaps, see postings.py
+        freqs (sequence of int): Term frequencies
+        doc_lens (np.ndarray): Length of each document, indexed by doc number
+        codec (str, optional): Name of the codec in CODECS
+        block_size (int, optional): Number of postings per block
+
+    Returns:
+        bytes: Block table, compressed doc gaps and compressed term frequencies
+    """
+    encode = CODECS[codec][0]
+    gaps = np.frombuffer(gaps, dtype=np.uint32)
+    freqs = np.frombuffer(freqs, dtype=np.uint32)
+    doc_nums = np.cumsum(gaps, dtype=np.int64)
+
+    table = np.zeros(num_blocks(len(gaps), block_size), dtype=BLOCK_DTYPE)
+    doc_parts = []
+    freq_parts = []
+    doc_end = 0
+    freq_end = 0
+    for block, start in enumerate(range(0, len(gaps), block_size)):
+        end = min(start + block_size, len(gaps))
+        doc_parts.append(encode(gaps[start:end]))
+        freq_parts.append(encode(freqs[start:end] - 1))
+        doc_end += len(doc_parts[-1])
+        freq_end += len(freq_parts[-1])
+        table[block] = (doc_nums[end - 1], freqs[start:end].max(), doc_lens[doc_nums[start:end]].min(), doc_end, freq_end)
+
+    return table.tobytes() + b''.join(doc_parts) + b''.join(freq_parts)
+
+
+def block_table(data, doc_freq, block_size=BLOCK_SIZE):
+    """Reads the block table of a compressed term
+
+    Args:
+        data (bytes-like): Output of encode_term
+        doc_freq (int): Number of postings of the term
+        block_size (int, optional): Number of postings per block
+
+    Returns:
+        np.ndarray: BLOCK_DTYPE record of each block
+    """
+    return np.frombuffer(data, dtype=BLOCK_DTYPE, count=num_blocks(doc_freq, block_size))
+
+
+def decode_term(data, doc_freq, codec=DEFAULT_CODEC, block_size=BLOCK_SIZE):
+    """Decompresses all postings of a term
+
+    Args:
+        data (bytes-like): Output of encode_term
+        doc_freq (int): Number of postings of the term
+        codec (str, optional): Name of the codec in CODECS
+        block_size (int, optional): Number of postings per block
+
+    Returns:
+        (np.ndarray, np.ndarray): Doc gaps and term frequencies (uint32), see postings.py
+    """
+    table = block_table(data, doc_freq, block_size)
+    doc_start = table.nbytes
+    freq_start = doc_start + (int(table['doc_end'][-1]) if len(table) else 0)
+    data = memoryview(data)
+
+    if codec == 'vbyte':
+        # The blocks of a section form one vbyte stream
+        gaps = vbyte_decode(data[doc_start:freq_start], doc_freq)
+        freqs = vbyte_decode(data[freq_start:freq_start + int(table['freq_end'][-1])], doc_freq) if len(table) else gaps
+        return gaps, freqs + 1
+
+    decode = CODECS[codec][1]
+    gaps = np.empty(doc_freq, dtype=np.uint32)
+    freqs = np.empty(doc_freq, dtype=np.uint32)
+    doc_begin = 0
+    freq_begin = 0
+    for block, start in enumerate(range(0, doc_freq, block_size)):
+        count = min(block_size, doc_freq - start)
+        doc_end, freq_end = int(table['doc_end'][block]), int(table['freq_end'][block])
+        gaps[start:start + count] = decode(data[doc_start + doc_begin:doc_start + doc_end], count)
+        freqs[start:start + count] = decode(data[freq_start + freq_begin:freq_start + freq_end], count)
+        doc_begin, freq_begin = doc_end, freq_end
+    return gaps, freqs + 1
+
+
+def decode_block(data, doc_freq, block, codec=DEFAULT_CODEC, block_size=BLOCK_SIZE):
+    """Decompresses one block of postings of a term
+
+    Args:
+        data (bytes-like): Output of encode_term
+        doc_freq (int): Number of postings of the term
+        block (int): Number of the block
+        codec (str, optional): Name of the codec in CODECS
+        block_size (int, optional): Number of postings per block
+
+    Returns:
+        (np.ndarray, np.ndarray): Doc numbers (int64) and term frequencies (uint32) in the block
+    """
+    decode = CODECS[codec][1]
+    table = block_table(data, doc_freq, block_size)
+    doc_start = table.nbytes
+    freq_start = doc_start + int(table['doc_end'][-1])
+    doc_begin = int(table['doc_end'][block - 1]) if block else 0
+    freq_begin = int(table['freq_end'][block - 1]) if block else 0
+    count = min(block_size, doc_freq - block * block_size)
+    data = memoryview(data)
+
+    gaps = decode(data[doc_start + doc_begin:doc_start + int(table['doc_end'][block])], count)
+    freqs = decode(data[freq_start + freq_begin:freq_start + int(table['freq_end'][block])], count)
+    previous_last = int(table['last_doc'][block - 1]) if block else 0
+    return previous_last + np.cumsum(gaps, dtype=np.int64), freqs + 1
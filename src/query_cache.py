@@ -0,0 +1,185 @@
+"""Cache of rankings, in front of the searcher
+
+Rankings are keyed on the analyzed query terms, the ranking function, its parameters and k,
+so queries that analyze to the same terms share an entry. The cache keeps the most recently used entries
+in memory (LRU), and optionally writes every entry to a directory as well, to survive restarts.
+The directory belongs to one build of the index: when the build ID of the index changes, its entries are removed.
+
+Attributes:
+    BUILD_ID_FILE (str): File in the cache directory holding the build ID of the index of its entries
+    QUERY_CACHE_SIZE (int): Default number of rankings kept in memory
+"""
+import hashlib
+import os
+import _pickle as pickle
+
+from collections import OrderedDict
+
+import numpy as np
+
+QUERY_CACHE_SIZE = 256
+BUILD_ID_FILE = 'build_id'
+
+
+def canonical(value):
+    """Hashable, order-independent form of a parameter value
+
+    Functions become their qualified name, dicts sorted tuples of items, NumPy scalars Python numbers.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, canonical(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(canonical(item) for item in value)
+    if callable(value):
+        return value.__module__ + '.' + value.__qualname__
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def cache_key(query_terms, ranking_function, argdict, k):
+    """Key of a ranking in the cache
+
+    Args:
+        query_terms (list of str): Analyzed query terms, see text_manipulation.process_text
+        ranking_function (function): Ranking function
+        argdict (dict): Parameters for the ranking function
+        k (int): Number of documents retrieved
+
+    Returns:
+        tuple: Key
+    """
+    return tuple(query_terms), canonical(ranking_function), canonical(argdict), k
+
+
+class QueryCache:
+    """LRU cache of rankings with an optional on-disk tier
+
+    Attributes:
+        max_entries (int): Number of rankings kept in memory
+        cache_dir (str): Directory of the on-disk tier, None without one
+        build_id (str): Build ID of the index the rankings were retrieved from
+        entries (OrderedDict): key - ranking, least recently used first
+        hits (int): Number of lookups answered from memory
+        disk_hits (int): Number of lookups answered from the on-disk tier
+        misses (int): Number of lookups not in the cache
+    """
+
+    def __init__(self, max_entries=QUERY_CACHE_SIZE, cache_dir=None, build_id=None):
+        """Creates an empty in-memory cache, and opens the on-disk tier
+
+        Args:
+            max_entries (int, optional): Number of rankings kept in memory
+            cache_dir (str, optional): Directory of the on-disk tier, no on-disk tier if None
+            build_id (str, optional): Build ID of the index, see DiskIndex.build_id,
+                entries on disk of another build are removed
+        """
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.build_id = build_id
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if cache_dir is not None:
+            self.open_dir()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return key in self.entries or (self.cache_dir is not None and os.path.exists(self.entry_path(key)))
+
+    def open_dir(self):
+        """Creates the cache directory, removing the entries of another build of the index
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        build_id_path = os.path.join(self.cache_dir, BUILD_ID_FILE)
+        if os.path.exists(build_id_path):
+            with open(build_id_path) as file:
+                if file.read() == str(self.build_id):
+                    return
+        self.clear_dir()
+        with open(build_id_path, 'w') as file:
+            file.write(str(self.build_id))
+
+    def entry_path(self, key):
+        """Path of the file of an entry in the cache directory
+        """
+        return os.path.join(self.cache_dir, hashlib.sha1(repr(key).encode('utf-8')).hexdigest() + '.pkl')
+
+    def get(self, key):
+        """Looks up a ranking, from memory first and then from the cache directory
+
+        Args:
+            key (tuple): Key, see cache_key
+
+        Returns:
+            list of (float, int): Ranking, None if not cached
+        """
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return list(self.entries[key])
+        if self.cache_dir is not None:
+            path = self.entry_path(key)
+            if os.path.exists(path):
+                with open(path, 'rb') as file:
+                    stored_key, ranking = pickle.load(file)
+                # Guards against hash collisions
+                if stored_key == key:
+                    self.disk_hits += 1
+                    self.put(key, ranking, write=False)
+                    return list(ranking)
+        self.misses += 1
+        return None
+
+    def put(self, key, ranking, write=True):
+        """Stores a ranking, evicting the least recently used ones beyond max_entries
+
+        Args:
+            key (tuple): Key, see cache_key
+            ranking (list of (float, int)): Ranking
+            write (bool, optional): Also write it to the cache directory, if there is one
+        """
+        if self.max_entries > 0:
+            self.entries[key] = list(ranking)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        if write and self.cache_dir is not None:
+            path = self.entry_path(key)
+            # Written under another name first, so readers never see a partial entry
+            temp_path = path + '.' + str(os.getpid())
+            with open(temp_path, 'wb') as file:
+                pickle.dump((key, list(ranking)), file)
+            os.replace(temp_path, path)
+
+    def clear_dir(self):
+        """Removes all entries from the cache directory
+        """
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pkl'):
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def clear(self):
+        """Removes all entries, from memory and from the cache directory
+        """
+        self.entries.clear()
+        if self.cache_dir is not None:
+            self.clear_dir()
+
+    def stats(self):
+        """Hit and miss counters
+
+        Returns:
+            dict: hits, disk_hits, misses, hit_rate and the number of entries in memory
+        """
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            'entries': len(self.entries),
+        }
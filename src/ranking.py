@@ -1,27 +1,74 @@
 """Ranking of documents given a query, using indexes created in build_index.py
 
+The ranking functions read the collection statistics of the searched index from argdict['stats'] (see with_stats),
+so indexes with different statistics can be searched in the same process.
+
 Attributes:
-    AVGDL (float): Average document length
-    NUM_DOCS (int): Number of documents in collection
-    NUM_TOKENS (int): Number of terms in collection
+    BLOCK_SIZE (int): Number of postings per block in Block-Max WAND, for indexes without a stored block table
+    CASCADE_CANDIDATES (int): Default number of candidates of the first stage of retrieve_top_k_cascade
+    NORM_TABLES (OrderedDict): LRU of per-document tables of the doc length indexes, see doc_table
+    NORM_TABLES_SIZE (int): Number of per-document tables kept
+    PRUNING_EPSILON (float): Relative slack on the pruning threshold, absorbs rounding in score bounds
+    RETRIEVAL_STRATEGIES (dict): name - retrieval function, selected with argdict['strategy']
+    SWEEP_CELLS (int): Number of scores held in memory at once by retrieve_top_k_sweep
+    TERM_BOUNDS (dict): ranking function - term upper bound function, used for dynamic pruning
+    TERM_SCORES (dict): ranking function - vectorized term score function,
+        used by retrieve_top_k_taat, retrieve_top_k_sweep and retrieve_top_k_hybrid
 """
 
-from multiprocessing import Process, Manager, Pool, cpu_count
+import os
 import subprocess
 import copy
 import heapq
+import weakref
 
+from collections import OrderedDict
+from collections.abc import Mapping
+from bisect import bisect_left, bisect_right
 from math import log
-from tqdm import tqdm
+from time import perf_counter
+
+import numpy as np
 
 import _pickle as pickle
 import text_manipulation as tm
-import filter_indexes as fi
+import disk_index as di
+import postings as ps
+import run_files as rn
+import fusion as fu
 
-# Hardcoded for convenience
-NUM_DOCS = 524000
-AVGDL = 426.2197061068702
-NUM_TOKENS = 223339126
+BLOCK_SIZE = 64
+PRUNING_EPSILON = 1e-9
+SWEEP_CELLS = 1 << 24
+CASCADE_CANDIDATES = 2000
+NORM_TABLES_SIZE = 16
+NORM_TABLES = OrderedDict()
+
+
+def with_stats(argdict, stats):
+    """Parameters for the ranking function with the collection statistics of the searched index
+
+    Args:
+        argdict (dict): Parameters for the ranking function
+        stats (dict): num_docs, num_tokens and avg_doc_len, see DiskIndex.collection_stats
+
+    Returns:
+        dict: Copy of argdict with the statistics in 'stats'
+    """
+    return dict(argdict, stats=stats)
+
+
+def index_terms(query, inv_idx):
+    """Analyzed terms of a query that are in the index, see filter_disk_index
+
+    Args:
+        query (str): Query text
+        inv_idx (dict): Inverted index of corpus, term - gap-encoded postings
+
+    Returns:
+        list of str: Terms of the query in query order, the ones without postings left out
+    """
+    return [term for term in tm.process_text(query) if term in inv_idx]
 
 
 def retrieve_top_k(k, query, ranking_function, inv_idx, doc_freq_idx, doc_len_idx, term_freq_idx, results, key, argdict={}):
@@ -31,9 +78,9 @@ def retrieve_top_k(k, query, ranking_function, inv_idx, doc_freq_idx, doc_len_id
         k (int): Number of documents to retrieve
         query (str): Topic to retrieve documents for
         ranking_function (function): Function to be passed for ranking documents
-        inv_idx (dict): Inverted index of corpus
+        inv_idx (dict): Inverted index of corpus, term - gap-encoded postings
         doc_freq_idx (dict): term - doc_freq
-        doc_len_idx (dict): doc_id - doc_len
+        doc_len_idx (array): doc number - doc_len
         term_freq_idx (TYPE): Description
         results (TYPE): Description
         key (TYPE): Description
@@ -41,14 +88,14 @@ def retrieve_top_k(k, query, ranking_function, inv_idx, doc_freq_idx, doc_len_id
     
     """
 
-    doc_ids = sorted(doc_len_idx.keys())
-    query_terms = tm.process_text(query)
+    doc_ids = range(len(doc_len_idx))
+    query_terms = index_terms(query, inv_idx)
     top_ranked = []
 
-    term_postings = [sorted(inv_idx[t]) for t in query_terms]
+    term_postings = [ps.posting_pairs(inv_idx[t]) for t in query_terms]
     posting_iters = [iter(t_p) for t_p in term_postings]
 
-    next_postings = [next(p) for p in posting_iters]
+    next_postings = [next(p, (None, None)) for p in posting_iters]
     total_term_freqs = [term_freq_idx[term] for term in query_terms]
     doc_freqs = [doc_freq_idx[term] for term in query_terms]
     for doc_id in doc_ids:
@@ -90,10 +137,11 @@ def query_likelihood(term_freqs, doc_freqs, doc_len, total_term_freqs, argdict={
     smoothing = argdict.get('smoothing', 'dir')
     lambda_coeff = argdict.get('lambda', 0.8)
     mu = argdict.get('mu', 2000)
+    num_tokens = argdict['stats']['num_tokens']
 
     doc_score = 0
     for term_freq, doc_freq, total_term_freq in zip(term_freqs, doc_freqs, total_term_freqs):
-        p_w_c = (total_term_freq+1) / NUM_TOKENS
+        p_w_c = (total_term_freq+1) / num_tokens
         if smoothing == 'jm':
             doc_score += log(1 + ((1 - lambda_coeff)*(term_freq)/((doc_len+1)) / (lambda_coeff*p_w_c)))
         elif smoothing == 'dir':
@@ -124,12 +172,13 @@ def okapi_bm25(term_freqs, doc_freqs, doc_len, total_term_freqs, argdict={}):
     """
     k1 = argdict.get("k1", 1.2)
     b  = argdict.get("b", 0.75)
+    stats = argdict['stats']
 
     doc_score = 0
     for term_freq, doc_freq in zip(term_freqs, doc_freqs):
-        idf = log((NUM_DOCS - doc_freq + 0.5) / (doc_freq + 0.5))
+        idf = log((stats['num_docs'] - doc_freq + 0.5) / (doc_freq + 0.5))
         top = term_freq * (k1 + 1)
-        bot = term_freq + k1 * (1 - b + b * (doc_len/ AVGDL))
+        bot = term_freq + k1 * (1 - b + b * (doc_len/ stats['avg_doc_len']))
 
         term_score = idf * (top / bot)
 
@@ -138,6 +187,58 @@ def okapi_bm25(term_freqs, doc_freqs, doc_len, total_term_freqs, argdict={}):
     return doc_score
 
 
+def ql_term_bound(max_tf, doc_freq, min_doc_len, total_term_freq, argdict={}):
+    """Upper bound on the query likelihood contribution of one query term,
+    for documents containing the term at most max_tf times, with at least min_doc_len terms
+
+    Args:
+        max_tf (int): Highest frequency of the term in the bounded documents
+        doc_freq (int): Binary term occurence count in documents in corpus
+        min_doc_len (int): Shortest length of the bounded documents
+        total_term_freq (int): Total frequency of the term in corpus
+        argdict (dict, optional): Parameters for the ranking function
+
+    Returns:
+        float: Non-negative upper bound on the term score
+    """
+    smoothing = argdict.get('smoothing', 'dir')
+    lambda_coeff = argdict.get('lambda', 0.8)
+    mu = argdict.get('mu', 2000)
+
+    p_w_c = (total_term_freq+1) / argdict['stats']['num_tokens']
+    if smoothing == 'jm':
+        bound = log(1 + ((1 - lambda_coeff)*min(max_tf/(min_doc_len+1), 1) / (lambda_coeff*p_w_c)))
+    else:
+        bound = log(1 + (max_tf/(mu * p_w_c))) + log(mu/(mu + min_doc_len))
+
+    return max(bound, 0)
+
+
+def bm25_term_bound(max_tf, doc_freq, min_doc_len, total_term_freq, argdict={}):
+    """Upper bound on the Okapi BM25 contribution of one query term,
+    for documents containing the term at most max_tf times, with at least min_doc_len terms
+
+    Args:
+        max_tf (int): Highest frequency of the term in the bounded documents
+        doc_freq (int): Binary term occurence count in documents in corpus
+        min_doc_len (int): Shortest length of the bounded documents
+        total_term_freq (int): Total frequency of the term in corpus
+        argdict (dict, optional): Parameters for the ranking function
+
+    Returns:
+        float: Non-negative upper bound on the term score
+    """
+    k1 = argdict.get("k1", 1.2)
+    b  = argdict.get("b", 0.75)
+    stats = argdict['stats']
+
+    idf = log((stats['num_docs'] - doc_freq + 0.5) / (doc_freq + 0.5))
+    top = max_tf * (k1 + 1)
+    bot = max_tf + k1 * (1 - b + b * (min_doc_len / stats['avg_doc_len']))
+
+    return max(idf * (top / bot), 0)
+
+
 def chunks(l, n):
     """Used in multiprocessing
     """
@@ -177,73 +278,1178 @@ def bm25(tfs, dfs, dl, total_term_freqs, argdict={}):
     return okapi_bm25(tfs, dfs, dl, total_term_freqs, argdict)
 
 
-def rank_evaluate(argdict={}):
-    """Main function, used when this file is called
-    
+TERM_BOUNDS = {
+    okapi_bm25: bm25_term_bound,
+    bm25: bm25_term_bound,
+    query_likelihood: ql_term_bound,
+    ql: ql_term_bound,
+}
+
+
+def get_term_bound(ranking_function, argdict={}):
+    """Finds the term upper bound function belonging to a ranking function
+
     Args:
+        ranking_function (function): Function to be passed for ranking documents
         argdict (dict, optional): Parameters for the ranking function
+
+    Returns:
+        function: Term bound function, None if the ranking function can not be pruned
     """
+    term_bound = TERM_BOUNDS.get(ranking_function)
+    if term_bound is ql_term_bound and argdict.get('smoothing', 'dir') not in ('dir', 'jm'):
+        # Naïve QL penalises missing terms, so unmatched documents are not bounded
+        return None
+    return term_bound
+
+
+class PostingCursor:
+    """Cursor over the postings of one query term, with score upper bounds per block,
+    decoding one block of postings at a time
+
+    Attributes:
+        term (str): Query term
+        read_block (function): Block number - (doc numbers, term frequencies) of the block
+        block_lasts (list of int): Last doc number of each block
+        block_bounds (list of float): Score upper bound of each block
+        upper_bound (float): Score upper bound over all postings
+        block (int): Block of the cursor, the number of blocks once exhausted
+        doc_ids (list of int): Ascending doc numbers of the postings of the block
+        term_freqs (list of int): Term frequencies, aligned with doc_ids
+        pos (int): Position of the cursor in the block
+        probe (tuple of (int, list of int)): Block and doc numbers last decoded by contains
+    """
+    __slots__ = ['term', 'read_block', 'block_lasts', 'block_bounds', 'upper_bound', 'block', 'doc_ids',
+                 'term_freqs', 'pos', 'probe']
+
+    def __init__(self, term, table, read_block, bound_args, weight=1):
+        """Creates a cursor on the first block, computing the block upper bounds from the block metadata
+
+        Args:
+            term (str): Query term
+            table (np.ndarray): 'last_doc', 'max_tf' and 'min_doc_len' of each block,
+                see postings_codec.BLOCK_DTYPE and posting_blocks
+            read_block (function): Block number - (doc numbers, term frequencies) of the block
+            bound_args (tuple of (function, int, int, dict)): Term bound function, doc_freq,
+                total_term_freq and ranking parameters
+            weight (int, optional): Number of occurences of the term in the query
+        """
+        term_bound, doc_freq, total_term_freq, argdict = bound_args
+        self.term = term
+        self.read_block = read_block
+        self.block_lasts = table['last_doc'].tolist()
+        self.block_bounds = [weight * term_bound(max_tf, doc_freq, min_doc_len, total_term_freq, argdict)
+                             for max_tf, min_doc_len in zip(table['max_tf'].tolist(), table['min_doc_len'].tolist())]
+        # A shard can hold none of the postings of a term, see shards.py
+        self.upper_bound = max(self.block_bounds, default=0.0)
+        self.probe = (None, None)
+        self.load(0)
+
+    def load(self, block):
+        """Moves the cursor to the first posting of a block
+        """
+        self.block = block
+        self.pos = 0
+        if block < len(self.block_lasts):
+            doc_nums, freqs = self.read_block(block)
+            self.doc_ids = doc_nums.tolist()
+            self.term_freqs = freqs.tolist()
+        else:
+            self.doc_ids = self.term_freqs = []
+
+    def exhausted(self):
+        return self.block >= len(self.block_lasts)
+
+    def doc(self):
+        return self.doc_ids[self.pos]
+
+    def freq(self):
+        return self.term_freqs[self.pos]
+
+    def next(self):
+        """Moves the cursor to the next posting
+        """
+        self.pos += 1
+        if self.pos == len(self.doc_ids):
+            self.load(self.block + 1)
+
+    def next_geq(self, doc_id):
+        """Moves the cursor to the first posting with identifier at least doc_id, skipping the blocks before it
+        """
+        if self.exhausted():
+            return
+        if doc_id > self.block_lasts[self.block]:
+            self.load(bisect_left(self.block_lasts, doc_id, self.block + 1))
+        self.pos = bisect_left(self.doc_ids, doc_id, self.pos)
+
+    def next_gt(self, doc_id):
+        """Moves the cursor to the first posting with identifier greater than doc_id, skipping the blocks before it
+        """
+        if self.exhausted():
+            return
+        if doc_id >= self.block_lasts[self.block]:
+            self.load(bisect_right(self.block_lasts, doc_id, self.block + 1))
+        self.pos = bisect_right(self.doc_ids, doc_id, self.pos)
+
+    def block_bound(self, doc_id):
+        """Finds the block that would contain doc_id, without moving the cursor
+
+        Returns:
+            (doc_id, float): Last identifier and score upper bound of the block,
+                (None, 0) if all postings come before doc_id
+        """
+        block = bisect_left(self.block_lasts, doc_id, self.block)
+        if block == len(self.block_lasts):
+            return None, 0
+        return self.block_lasts[block], self.block_bounds[block]
+
+    def contains(self, doc_id):
+        """Whether the term occurs in a document, decoding only the block that would hold it,
+        without moving the cursor
+        """
+        block = bisect_left(self.block_lasts, doc_id)
+        if block == len(self.block_lasts):
+            return False
+        if block == self.block:
+            doc_ids = self.doc_ids
+        elif block == self.probe[0]:
+            doc_ids = self.probe[1]
+        else:
+            doc_ids = self.read_block(block)[0].tolist()
+            self.probe = (block, doc_ids)
+        return doc_ids[bisect_left(doc_ids, doc_id)] == doc_id
+
+
+def posting_blocks(postings, doc_len_idx, block_size=BLOCK_SIZE):
+    """Splits decoded postings into blocks with the metadata of postings_codec.block_table,
+    for indexes without a stored block table
+
+    Args:
+        postings (array, array): Gap-encoded postings of a term
+        doc_len_idx (array): doc number - doc_len
+        block_size (int, optional): Number of postings per block
+
+    Returns:
+        (dict, function): 'last_doc', 'max_tf' and 'min_doc_len' of each block,
+            and block number - (doc numbers, term frequencies) of the block
+    """
+    doc_nums, freqs = ps.decode_postings(postings)
+    starts = np.arange(0, len(doc_nums), block_size)
+    table = {'last_doc': doc_nums[np.minimum(starts + block_size, len(doc_nums)) - 1],
+             'max_tf': np.maximum.reduceat(freqs, starts) if len(starts) else starts,
+             'min_doc_len': np.minimum.reduceat(np.frombuffer(doc_len_idx, dtype=np.uint32)[doc_nums], starts)
+             if len(starts) else starts}
+    read_block = lambda block: (doc_nums[block * block_size:(block + 1) * block_size],
+                                freqs[block * block_size:(block + 1) * block_size])
+    return table, read_block
+
+
+def term_cursor(term, inv_idx, doc_len_idx, bound_args, weight=1):
+    """Creates the cursor of a query term, reading the stored block table and single blocks of an on-disk index
+    (see IndexPostings), or splitting the decoded postings into blocks for other indexes
+
+    Args:
+        term (str): Query term
+        inv_idx (dict): Inverted index of corpus
+        doc_len_idx (array): doc number - doc_len
+        bound_args (tuple of (function, int, int, dict)): see PostingCursor
+        weight (int, optional): Number of occurences of the term in the query
+
+    Returns:
+        PostingCursor: Cursor on the first posting of the term
+    """
+    index = getattr(inv_idx, 'index', None)
+    if isinstance(index, di.DiskIndex):
+        return PostingCursor(term, index.block_table(term), index.block_reader(term), bound_args, weight)
+    table, read_block = posting_blocks(inv_idx[term], doc_len_idx)
+    return PostingCursor(term, table, read_block, bound_args, weight)
+
+
+def length_order(doc_len_idx):
+    """Documents ordered by length, and by descending doc number for equal lengths, see doc_table
+
+    Args:
+        doc_len_idx (array): doc number - doc_len
+
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray): Doc numbers in order, start of each run of equal lengths in the order
+            and the length of each run
+    """
+    def compute():
+        doc_lens = np.frombuffer(doc_len_idx, dtype=np.uint32)
+        order = np.lexsort((-np.arange(len(doc_lens)), doc_lens))
+        sorted_lens = doc_lens[order]
+        starts = np.flatnonzero(np.diff(sorted_lens.astype(np.int64), prepend=-1))
+        return order, starts, sorted_lens[starts]
+
+    return doc_table(doc_len_idx, ('length order',), compute)
+
+
+def unmatched_docs(doc_len_idx, unmatched_score):
+    """Yields documents in descending order of score and doc number, the order in which they enter the top k,
+    for a score that only depends on the document length and does not increase with it
+
+    Args:
+        doc_len_idx (array): doc number - doc_len
+        unmatched_score (function): Document length - score
+
+    Yields:
+        (float, int): Score and doc number
+    """
+    order, starts, lens = length_order(doc_len_idx)
+    bounds = starts.tolist() + [len(order)]
+    lens = lens.tolist()
+    group = 0
+    while group < len(lens):
+        doc_score = unmatched_score(lens[group])
+        # Lengths with the same score are merged on doc number
+        end = group + 1
+        while end < len(lens) and unmatched_score(lens[end]) == doc_score:
+            end += 1
+        if end == group + 1:
+            tier = order[bounds[group]:bounds[end]]
+        elif group == 0 and end == len(lens):
+            tier = range(len(order) - 1, -1, -1)
+        else:
+            tier = heapq.merge(*(order[bounds[g]:bounds[g + 1]] for g in range(group, end)), reverse=True)
+        for doc_id in tier:
+            yield doc_score, int(doc_id)
+        group = end
+
+
+def push_top_k(top_ranked, k, doc_score, doc_id):
+    """Offers a scored document to a min-heap holding the top k documents
+    """
+    if len(top_ranked) < k:
+        heapq.heappush(top_ranked, (doc_score, doc_id))
+    else:
+        heapq.heappushpop(top_ranked, (doc_score, doc_id))
+
+
+def pruning_threshold(top_ranked, k):
+    """Lowest score a document needs to be considered for the top k,
+    lowered by PRUNING_EPSILON so rounding in the bounds never discards a document
+
+    Returns:
+        float: Threshold, None while fewer than k documents have been ranked
+    """
+    if len(top_ranked) < k:
+        return None
+    theta = top_ranked[0][0]
+    return theta - PRUNING_EPSILON * max(1, abs(theta))
+
+
+def retrieve_top_k_pruned(k, query, ranking_function, inv_idx, doc_freq_idx, doc_len_idx, term_freq_idx, results, key, argdict={}, block_max=False):
+    """Retrieves ordered top k documents for a query using (Block-Max) WAND dynamic pruning,
+    gives exactly the same result as retrieve_top_k
+
+    Documents are only scored when the upper bounds of their terms can reach the lowest score in the top k,
+    the cursors skip whole blocks of postings without decoding them.
+    Documents without any query term all get the same score for equal lengths,
+    so they are only visited (shortest first) while that score can still enter the top k.
+
+    Args:
+        k (int): Number of documents to retrieve
+        query (str): Topic to retrieve documents for
+        ranking_function (function): Function to be passed for ranking documents
+        inv_idx (dict): Inverted index of corpus
+        doc_freq_idx (dict): term - doc_freq
+        doc_len_idx (array): doc number - doc_len
+        term_freq_idx (dict): term - total term frequency
+        results (dict): Shared dictionary to store the ranking in
+        key (str): Key of the ranking in results
+        argdict (dict, optional): Parameters for the ranking function
+        block_max (bool, optional): Whether to also skip blocks of postings using their upper bounds
+    """
+    term_bound = get_term_bound(ranking_function, argdict)
+    if term_bound is None:
+        retrieve_top_k(k, query, ranking_function, inv_idx, doc_freq_idx, doc_len_idx, term_freq_idx, results, key, argdict)
+        return
+
+    query_terms = index_terms(query, inv_idx)
+    top_ranked = []
+
+    total_term_freqs = [term_freq_idx[term] for term in query_terms]
+    doc_freqs = [doc_freq_idx[term] for term in query_terms]
+    cursors = []
+    for term in sorted(set(query_terms)):
+        bound_args = (term_bound, doc_freq_idx[term], term_freq_idx[term], argdict)
+        cursors.append(term_cursor(term, inv_idx, doc_len_idx, bound_args, weight=query_terms.count(term)))
+
+    active = [c for c in cursors if not c.exhausted()]
+    while active:
+        active.sort(key=PostingCursor.doc)
+        theta = pruning_threshold(top_ranked, k)
+
+        # Pivot: first cursor where the summed upper bounds can reach the threshold
+        pivot = None
+        bound_sum = 0
+        for i, cursor in enumerate(active):
+            bound_sum += cursor.upper_bound
+            if theta is None or bound_sum >= theta:
+                pivot = i
+                break
+        if pivot is None:
+            break
+        pivot_doc = active[pivot].doc()
+        while pivot + 1 < len(active) and active[pivot + 1].doc() == pivot_doc:
+            pivot += 1
+
+        if block_max and theta is not None:
+            block_bounds = [c.block_bound(pivot_doc) for c in active[:pivot + 1]]
+            if sum(bound for _, bound in block_bounds) < theta:
+                # No document up to the end of the shortest block can reach the threshold
+                skip_to = min(last for last, _ in block_bounds if last is not None)
+                if pivot + 1 < len(active) and active[pivot + 1].doc() <= skip_to:
+                    for cursor in active[:pivot + 1]:
+                        cursor.next_geq(active[pivot + 1].doc())
+                else:
+                    for cursor in active[:pivot + 1]:
+                        cursor.next_gt(skip_to)
+                active = [c for c in active if not c.exhausted()]
+                continue
+
+        if active[0].doc() == pivot_doc:
+            doc_term_freqs = {cursor.term: cursor.freq() for cursor in active[:pivot + 1]}
+            term_freqs = [doc_term_freqs.get(term, 0) for term in query_terms]
+            doc_score = ranking_function(term_freqs, doc_freqs, doc_len_idx[pivot_doc], total_term_freqs, argdict=argdict)
+            push_top_k(top_ranked, k, doc_score, pivot_doc)
+            for cursor in active[:pivot + 1]:
+                cursor.next()
+        else:
+            for cursor in active[:pivot]:
+                cursor.next_geq(pivot_doc)
+        active = [c for c in active if not c.exhausted()]
+
+    # Documents without query terms, their score does not increase with length
+    unmatched_score = lambda doc_len: ranking_function([0] * len(query_terms), doc_freqs, doc_len, total_term_freqs, argdict=argdict)
+    for doc_score, doc_id in unmatched_docs(doc_len_idx, unmatched_score):
+        if len(top_ranked) == k and (doc_score, doc_id) < top_ranked[0]:
+            break
+        if not any(cursor.contains(doc_id) for cursor in cursors):
+            push_top_k(top_ranked, k, doc_score, doc_id)
+
+    results[key] = list(reversed(sorted(top_ranked)))
+
+
+def retrieve_top_k_wand(k, query, ranking_function, inv_idx, doc_freq_idx, doc_len_idx, term_freq_idx, results, key, argdict={}):
+    """Retrieves ordered top k documents for a query using WAND, see retrieve_top_k_pruned
+    """
+    retrieve_top_k_pruned(k, query, ranking_function, inv_idx, doc_freq_idx, doc_len_idx, term_freq_idx, results, key, argdict)
+
+
+def retrieve_top_k_bmw(k, query, ranking_function, inv_idx, doc_freq_idx, doc_len_idx, term_freq_idx, results, key, argdict={}):
+    """Retrieves ordered top k documents for a query using Block-Max WAND, see retrieve_top_k_pruned
+    """
+    retrieve_top_k_pruned(k, query, ranking_function, inv_idx, doc_freq_idx, doc_len_idx, term_freq_idx, results, key, argdict, block_max=True)
+
+
+def ql_term_scores(term_freqs, doc_lens, doc_freq, total_term_freq, argdict={}, norms=None):
+    """Query likelihood contributions of one query term to many documents, vectorized version of query_likelihood
+
+    Args:
+        term_freqs (np.ndarray): Frequency of the term in each document
+        doc_lens (np.ndarray): Length of each document, aligned with term_freqs
+        doc_freq (int): Binary term occurence count in documents in corpus
+        total_term_freq (int): Total frequency of the term in corpus
+        argdict (dict, optional): Parameters for the ranking function
+        norms (np.ndarray, optional): Length normalization of each document, aligned with term_freqs,
+            see length_norms, replaces the computation from doc_lens
+
+    Returns:
+        np.ndarray: Term score of each document
+    """
+    smoothing = argdict.get('smoothing', 'dir')
+    lambda_coeff = argdict.get('lambda', 0.8)
+    mu = argdict.get('mu', 2000)
+
+    p_w_c = (total_term_freq+1) / argdict['stats']['num_tokens']
+    if smoothing == 'jm':
+        return np.log(1 + ((1 - lambda_coeff)*(term_freqs)/((doc_lens+1)) / (lambda_coeff*p_w_c)))
+    elif smoothing == 'dir':
+        if norms is None:
+            norms = np.log(mu/(mu + doc_lens))
+        return np.log(1 + (term_freqs/(mu * p_w_c))) + norms
+    # Naïve QL, with zero-frequency problem
+    with np.errstate(divide='ignore'):
+        return np.where(term_freqs == 0, -999.0, np.log(doc_lens/np.maximum(term_freqs, 1)))
+
+
+def bm25_term_scores(term_freqs, doc_lens, doc_freq, total_term_freq, argdict={}, norms=None):
+    """Okapi BM25 contributions of one query term to many documents, vectorized version of okapi_bm25
+
+    Args:
+        term_freqs (np.ndarray): Frequency of the term in each document
+        doc_lens (np.ndarray): Length of each document, aligned with term_freqs
+        doc_freq (int): Binary term occurence count in documents in corpus
+        total_term_freq (int): Total frequency of the term in corpus
+        argdict (dict, optional): Parameters for the ranking function
+        norms (np.ndarray, optional): Length normalization of each document, aligned with term_freqs,
+            see length_norms, replaces the computation from doc_lens
+
+    Returns:
+        np.ndarray: Term score of each document
+    """
+    k1 = argdict.get("k1", 1.2)
+    b  = argdict.get("b", 0.75)
+    stats = argdict['stats']
+
+    idf = log((stats['num_docs'] - doc_freq + 0.5) / (doc_freq + 0.5))
+    top = term_freqs * (k1 + 1)
+    if norms is None:
+        norms = k1 * (1 - b + b * (doc_lens / stats['avg_doc_len']))
+    bot = term_freqs + norms
+
+    # Empty documents with b = 1 give 0 / 0 for a zero frequency
+    with np.errstate(invalid='ignore'):
+        return idf * np.where(top == 0, 0.0, top / bot)
+
+
+TERM_SCORES = {
+    okapi_bm25: bm25_term_scores,
+    bm25: bm25_term_scores,
+    query_likelihood: ql_term_scores,
+    ql: ql_term_scores,
+}
+
+
+def doc_table(doc_len_idx, params, compute):
+    """Per-document table of a doc length index, computed on first use and kept in the LRU NORM_TABLES
+
+    The tables are keyed on the doc length index object itself, which lives as long as its index is open,
+    so indexes with the same number of documents in another order never share a table.
+
+    Args:
+        doc_len_idx (array): doc number - doc_len, kept by the Searcher for the lifetime of the index
+        params (tuple): What the table holds, with the parameters it is computed from
+        compute (function): Computes the table
+
+    Returns:
+        Table, as returned by compute
+    """
+    key = (id(doc_len_idx),) + params
+    entry = NORM_TABLES.get(key)
+    # The id of a collected doc length index can be reused by a new one
+    if entry is not None and entry[0]() is doc_len_idx:
+        NORM_TABLES.move_to_end(key)
+        return entry[1]
+    table = compute()
+    NORM_TABLES[key] = (weakref.ref(doc_len_idx), table)
+    while len(NORM_TABLES) > NORM_TABLES_SIZE:
+        NORM_TABLES.popitem(last=False)
+    return table
+
+
+def float_doc_lens(doc_len_idx):
+    """Length of each document as float64, see doc_table
+
+    Args:
+        doc_len_idx (array): doc number - doc_len
+
+    Returns:
+        np.ndarray: Length of each document, indexed by doc number
+    """
+    return doc_table(doc_len_idx, ('lens',), lambda: np.frombuffer(doc_len_idx, dtype=np.uint32).astype(np.float64))
+
+
+def length_norms(ranking_function, argdict, doc_len_idx):
+    """Length normalization of every document for a ranking function and its parameters, see doc_table
+
+    The tables hold the part of a term score that only depends on the document, computed exactly as
+    the term score functions do: k1 * (1 - b + b * doc_len / avg_doc_len) for BM25, log(mu / (mu + doc_len))
+    for Dirichlet smoothed query likelihood. Scoring a posting then only looks up its document.
+
+    Args:
+        ranking_function (function): Ranking function
+        argdict (dict): Parameters for the ranking function
+        doc_len_idx (array): doc number - doc_len
+
+    Returns:
+        np.ndarray: Length normalization of each document, None if the ranking function has none
+            or its parameters are arrays (see stack_grid)
+    """
+    if ranking_function in (okapi_bm25, bm25):
+        params = ('bm25', argdict.get('k1', 1.2), argdict.get('b', 0.75), argdict['stats']['avg_doc_len'])
+    elif ranking_function in (query_likelihood, ql) and argdict.get('smoothing', 'dir') == 'dir':
+        params = ('dir', argdict.get('mu', 2000))
+    else:
+        return None
+    if any(isinstance(param, np.ndarray) for param in params):
+        return None
+
+    def compute():
+        doc_lens = float_doc_lens(doc_len_idx)
+        if params[0] == 'bm25':
+            k1, b, avg_doc_len = params[1:]
+            return k1 * (1 - b + b * (doc_lens / avg_doc_len))
+        mu = params[1]
+        return np.log(mu/(mu + doc_lens))
+
+    return doc_table(doc_len_idx, params, compute)
+
+
+def has_sparse_term_scores(ranking_function, argdict={}):
+    """Whether documents without a query term get a term score of zero,
+    so only the postings of the term have to be scored
+
+    Args:
+        ranking_function (function): Function to be passed for ranking documents
+        argdict (dict, optional): Parameters for the ranking function
+
+    Returns:
+        bool: Whether the term scores are zero outside the postings
+    """
+    if ranking_function in (okapi_bm25, bm25):
+        return True
+    return ranking_function in (query_likelihood, ql) and argdict.get('smoothing', 'dir') == 'jm'
 
-    print('Loading indices...')
-    with open("../data/FILTERED_INVERTED_INDEX_NOSTOP.pkl", "rb") as file:
-        inverted_index = pickle.load(file)
-    with open("../data/DOC_LEN_INDEX_NOSTOP.pkl", "rb") as file:
-        doc_len_index = pickle.load(file)
-    with open("../data/DOC_FREQ_INDEX_NOSTOP.pkl", "rb") as file:
-        doc_freq_index = pickle.load(file)
-    with open("../data/TOPIC_DICT_NOSTOP.pkl", "rb") as file:
-        topic_dict = pickle.load(file)
-    with open("../data/TERM_FREQ_NOSTOP.pkl", "rb") as file:
-        term_freq_idx = pickle.load(file)
-
-    print('Finished loading indices...')
-
-    # k = argdict.get('k', 1000)
-    # argdict['fun'] = bm25
-    # function = argdict.get('fun', bm25)
-
-    with Manager() as manager:
-        results = manager.dict({})
-
-        processes = []
-        for key in sorted(list(topic_dict.keys())):
-            topic = topic_dict[key]
-            terms = tm.process_text(topic)
-
-            filt_inv_index = fi.filter_dict(inverted_index, terms)
-            filt_doc_freq_index = fi.filter_dict(doc_freq_index, terms)
-            p = Process(target=retrieve_top_k, args=[k, topic, function, filt_inv_index, filt_doc_freq_index, doc_len_index, term_freq_idx, results, key, argdict])
-            processes.append(p)
-        print('Build processes')
-        for i in tqdm(chunks(processes,cpu_count())):
-            for j in i:
-                j.start()
-            for j in i:
-                j.join()  
-        results = dict(results)
-    
 
-    trec_eval_out = []
-    for num in sorted(results):
-        start_str = num + ' Q0 '
-        end_str = ' STANDARD'
+def select_top_k(scores, k, doc_nums):
+    """Selects the k highest scoring of the given documents with argpartition,
+    ties broken on the highest doc number like the heap of retrieve_top_k
 
-        for i, result in enumerate(results[num]):
-            trec_eval_line = start_str + ' '.join([result[1], str(i), str(result[0])]) + end_str
-            trec_eval_out.append(trec_eval_line)
+    Args:
+        scores (np.ndarray): Score of each document, indexed by doc number
+        k (int): Number of documents to select
+        doc_nums (np.ndarray): Doc numbers to select from
+
+    Returns:
+        list of (float, int): Score and doc number of the top k documents, best first
+    """
+    doc_scores = scores[doc_nums]
+    if k < len(doc_nums):
+        kth_score = doc_scores[np.argpartition(doc_scores, len(doc_nums) - k)[len(doc_nums) - k]]
+        selected = doc_scores >= kth_score
+        doc_nums, doc_scores = doc_nums[selected], doc_scores[selected]
+    order = np.lexsort((doc_nums, doc_scores))[::-1][:k]
+    return list(zip(doc_scores[order].tolist(), doc_nums[order].tolist()))
+
+
+def top_k_docs(scores, k, matched_docs=None):
+    """Selects the k highest scoring documents, see select_top_k
+
+    Args:
+        scores (np.ndarray): Score of each document, indexed by doc number
+        k (int): Number of documents to select
+        matched_docs (np.ndarray, optional): Doc numbers of the only documents that can have a non-zero score,
+            the other documents are only considered if zero can enter the top k
+
+    Returns:
+        list of (float, int): Score and doc number of the top k documents, best first
+    """
+    if matched_docs is not None:
+        # Selecting from fewer, mostly distinct scores is much faster than from all documents
+        top_ranked = select_top_k(scores, k, matched_docs)
+        if len(top_ranked) == k and top_ranked[-1][0] > 0:
+            return top_ranked
+    return select_top_k(scores, k, np.arange(len(scores)))
+
+
+def retrieve_top_k_taat(k, query, ranking_function, inv_idx, doc_freq_idx, doc_len_idx, term_freq_idx, results, key, argdict={}):
+    """Retrieves ordered top k documents for a query term-at-a-time with NumPy,
+    gives the same result as retrieve_top_k up to floating point rounding
+
+    The term scores of all documents are added to a dense accumulator one query term at a time,
+    each as a single vectorized operation, documents without the term get the score of a zero frequency.
+
+    Args:
+        k (int): Number of documents to retrieve
+        query (str): Topic to retrieve documents for
+        ranking_function (function): Function to be passed for ranking documents
+        inv_idx (dict): Inverted index of corpus
+        doc_freq_idx (dict): term - doc_freq
+        doc_len_idx (array): doc number - doc_len
+        term_freq_idx (dict): term - total term frequency
+        results (dict): Shared dictionary to store the ranking in
+        key (str): Key of the ranking in results
+        argdict (dict, optional): Parameters for the ranking function
+    """
+    term_scores = TERM_SCORES.get(ranking_function)
+    query_terms = index_terms(query, inv_idx)
+    if term_scores is None or not query_terms:
+        retrieve_top_k(k, query, ranking_function, inv_idx, doc_freq_idx, doc_len_idx, term_freq_idx, results, key, argdict)
+        return
+
+    sparse = has_sparse_term_scores(ranking_function, argdict)
+    doc_lens = float_doc_lens(doc_len_idx)
+    postings = {term: ps.decode_postings(inv_idx[term]) for term in set(query_terms)}
+    norms = length_norms(ranking_function, argdict, doc_len_idx)
+    scores = accumulate_term_scores(query_terms, postings, term_scores, sparse, doc_lens, doc_freq_idx, term_freq_idx, argdict, norms)
+
+    matched_docs = np.unique(np.concatenate([doc_nums for doc_nums, _ in postings.values()])) if sparse else None
+    results[key] = top_k_docs(scores, k, matched_docs)
+
+
+def accumulate_term_scores(query_terms, postings, term_scores, sparse, doc_lens, doc_freq_idx, term_freq_idx, argdict={}, norms=None):
+    """Adds the term scores of all query terms to a dense accumulator, one vectorized operation per term,
+    the length normalization of the documents is looked up in norms
+
+    Args:
+        query_terms (list of str): Processed query terms, repeated terms are scored again
+        postings (dict): term - decoded postings (doc numbers, term frequencies)
+        term_scores (function): Vectorized term score function, one of TERM_SCORES
+        sparse (bool): Whether only the postings have to be scored, see has_sparse_term_scores
+        doc_lens (np.ndarray): Length of each document (float64), indexed by doc number
+        doc_freq_idx (dict): term - doc_freq
+        term_freq_idx (dict): term - total term frequency
+        argdict (dict, optional): Parameters for the ranking function
+        norms (np.ndarray, optional): Length normalization of each document, see length_norms
+
+    Returns:
+        np.ndarray: Score of each document, indexed by doc number
+    """
+    # Broadcasts against the documents, so the score of a zero frequency is only computed once
+    zero_freqs = np.zeros(1)
+    scores = np.zeros(len(doc_lens))
+    for term in query_terms:
+        doc_nums, freqs = postings[term]
+        doc_freq, total_term_freq = doc_freq_idx[term], term_freq_idx[term]
+        posting_norms = None if norms is None else norms[doc_nums]
+        posting_scores = term_scores(freqs.astype(np.float64), doc_lens[doc_nums], doc_freq, total_term_freq, argdict, posting_norms)
+        if sparse:
+            scores[doc_nums] += posting_scores
+            continue
+        doc_scores = term_scores(zero_freqs, doc_lens, doc_freq, total_term_freq, argdict, norms)
+        doc_scores[doc_nums] = posting_scores
+        scores += doc_scores
+    return scores
+
+
+def retrieve_top_k_hybrid(k, query, inv_idx, doc_freq_idx, doc_len_idx, term_freq_idx, scorers, fusion='rrf', weights=None):
+    """Retrieves ordered top k documents for a query with several ranking functions in one pass,
+    and fuses their rankings
+
+    The postings are decoded once and shared by all ranking functions, each is scored term-at-a-time
+    like retrieve_top_k_taat. The rankings are fused per topic with fusion.fuse_topic, scores are min-max
+    normalized per ranking, so the fused ranking is the same as fusing the separate runs with fusion.fuse_runs.
+
+    Args:
+        k (int): Number of documents to retrieve, for each ranking function and for the fused ranking
+        query (str): Topic to retrieve documents for
+        inv_idx (dict): Inverted index of corpus
+        doc_freq_idx (dict): term - doc_freq
+        doc_len_idx (array): doc number - doc_len
+        term_freq_idx (dict): term - total term frequency
+        scorers (list of dict): Parameters of each ranking function, 'fun' is one of TERM_SCORES
+        fusion (str, optional): Fusion method, one of fusion.FUSION_METHODS
+        weights (list of float, optional): Weight of each ranking function in the fusion
+
+    Returns:
+        (list of list of (float, int), list of (float, int)): Ranking of each ranking function and fused ranking,
+            see retrieve_top_k
+    """
+    query_terms = index_terms(query, inv_idx)
+    doc_lens = float_doc_lens(doc_len_idx)
+    postings = {term: ps.decode_postings(inv_idx[term]) for term in set(query_terms)}
+    matched_docs = np.unique(np.concatenate([doc_nums for doc_nums, _ in postings.values()] or [[]])).astype(np.int64)
+
+    rankings = []
+    for argdict in scorers:
+        ranking_function = argdict.get('fun', bm25)
+        term_scores = TERM_SCORES.get(ranking_function)
+        if term_scores is None:
+            raise ValueError('No vectorized term scores for ' + ranking_function.__name__)
+        sparse = has_sparse_term_scores(ranking_function, argdict)
+        norms = length_norms(ranking_function, argdict, doc_len_idx)
+        scores = accumulate_term_scores(query_terms, postings, term_scores, sparse, doc_lens, doc_freq_idx, term_freq_idx, argdict, norms)
+        rankings.append(top_k_docs(scores, k, matched_docs if sparse else None))
+
+    fused = fu.fuse_topic([[(doc_num, score) for score, doc_num in ranking] for ranking in rankings], fusion, weights, k)
+    return rankings, [(score, doc_num) for doc_num, score in fused]
+
+
+RETRIEVAL_STRATEGIES = {
+    'exhaustive': retrieve_top_k,
+    'wand': retrieve_top_k_wand,
+    'bmw': retrieve_top_k_bmw,
+    'taat': retrieve_top_k_taat,
+}
+
+
+def retrieve_top_k_cascade(k, query, inv_idx, doc_freq_idx, doc_len_idx, term_freq_idx, forward_index, term_nums, argdict={}):
+    """Retrieves ordered top k documents for a query in two stages: a cheap ranking function retrieves
+    candidates, which are reranked with a more expensive one using the forward index
+
+    The second stage scores the candidates with the same term scores as retrieve_top_k_taat, so with all documents
+    as candidates it gives the same ranking. The index stores no term positions, so there are no proximity features.
+
+    Args:
+        k (int): Number of documents to retrieve
+        query (str): Topic to retrieve documents for
+        inv_idx (dict): Inverted index of corpus
+        doc_freq_idx (dict): term - doc_freq
+        doc_len_idx (array): doc number - doc_len
+        term_freq_idx (dict): term - total term frequency
+        forward_index (ForwardIndex): Terms of each document, see forward_index.py
+        term_nums (dict): term - term number in the forward index
+        argdict (dict, optional): Parameters of the second stage ranking function ('fun', one of TERM_SCORES),
+            'candidates' (number of candidates, at least k), 'first_stage' (argdict of the first stage,
+            with its 'fun' and 'strategy'), and optionally 'fusion' and 'weights' to fuse the rankings of both stages
+
+    Returns:
+        (list of (float, int), list of (float, int)): Ranking, see retrieve_top_k, and the candidates of the first stage
+    """
+    # The first stage searches the same index
+    first_stage = with_stats(argdict.get('first_stage', {'fun': bm25, 'strategy': 'taat'}), argdict['stats'])
+    num_candidates = max(k, argdict.get('candidates', CASCADE_CANDIDATES))
+    retrieve = RETRIEVAL_STRATEGIES[first_stage.get('strategy', 'exhaustive')]
+    results = {}
+    retrieve(num_candidates, query, first_stage.get('fun', bm25), inv_idx, doc_freq_idx, doc_len_idx, term_freq_idx,
+             results, query, first_stage)
+    candidates = results[query]
+
+    ranking_function = argdict.get('fun', ql)
+    term_scores = TERM_SCORES.get(ranking_function)
+    if term_scores is None:
+        raise ValueError('No vectorized term scores for ' + ranking_function.__name__)
+    query_terms = index_terms(query, inv_idx)
+    doc_nums = np.array([doc_num for _, doc_num in candidates], dtype=np.int64)
+    doc_lens = float_doc_lens(doc_len_idx)[doc_nums]
+    norms = length_norms(ranking_function, argdict, doc_len_idx)
+    if norms is not None:
+        norms = norms[doc_nums]
+    unique_terms = sorted(set(query_terms))
+    term_freqs = forward_index.term_freq_matrix(doc_nums, [term_nums[term] for term in unique_terms]).astype(np.float64)
+    scores = np.zeros(len(doc_nums))
+    for term in query_terms:
+        scores += term_scores(term_freqs[:, unique_terms.index(term)], doc_lens, doc_freq_idx[term], term_freq_idx[term],
+                              argdict, norms)
+
+    order = np.lexsort((doc_nums, scores))[::-1]
+    ranking = list(zip(scores[order].tolist(), doc_nums[order].tolist()))
+    if argdict.get('fusion'):
+        fused = fu.fuse_topic([[(doc_num, score) for score, doc_num in candidates], [(doc_num, score) for score, doc_num in ranking]],
+                              argdict['fusion'], argdict.get('weights'), k)
+        ranking = [(score, doc_num) for doc_num, score in fused]
+    return ranking[:k], candidates
+
+
+def candidate_recall(candidates, ranking):
+    """Fraction of the documents of a ranking that are among the candidates, the recall of a first stage
+
+    Args:
+        candidates (list of (float, int)): Ranking of the first stage
+        ranking (list of (float, int)): Ranking over all documents, e.g. of retrieve_top_k_taat
+
+    Returns:
+        float: Recall, 1 for an empty ranking
+    """
+    if not ranking:
+        return 1.0
+    candidate_docs = set(doc_num for _, doc_num in candidates)
+    return sum(doc_num in candidate_docs for _, doc_num in ranking) / len(ranking)
+
+
+def retrieve_top_k_impact(k, query, impact_index, term_nums, argdict={}):
+    """Retrieves ordered top k documents for a query score-at-a-time from an impact index, within a budget
+
+    The segments of all query terms are processed in decreasing order of impact (times the number of times the
+    term is in the query), adding the impact to an accumulator of each document in the segment. The documents with
+    the most impact are found first, so when the budget runs out the top k found so far is returned.
+    Without a budget the ranking is Okapi BM25 with quantized scores, see impact_index.py.
+
+    Args:
+        k (int): Number of documents to retrieve
+        query (str): Topic to retrieve documents for
+        impact_index (ImpactIndex): Impact-ordered postings, see impact_index.py
+        term_nums (dict): term - term number in the impact index, terms not in the index are left out
+        argdict (dict, optional): 'postings_budget' (number of postings to process) and 'time_budget'
+            (milliseconds, checked after every segment), no limit if left out
+
+    Returns:
+        (list of (float, int), int): Ranking, see retrieve_top_k, with scores in Okapi BM25 units,
+            and the number of postings processed
+    """
+    start = perf_counter()
+    postings_budget = argdict.get('postings_budget')
+    time_budget = argdict.get('time_budget')
+    query_terms = [term for term in tm.process_text(query) if term in term_nums]
+
+    segments = []
+    for term in sorted(set(query_terms)):
+        weight = query_terms.count(term)
+        segments.extend((int(segment['impact']) * weight, segment) for segment in impact_index.term_segments(term_nums[term]))
+    # Stable, so segments of equal impact keep the order of their terms
+    segments.sort(key=lambda segment: -segment[0])
+
+    scores = np.zeros(impact_index.num_docs, dtype=np.int64)
+    processed = []
+    num_processed = 0
+    for impact, segment in segments:
+        count = int(segment['count'])
+        if postings_budget is not None:
+            count = min(count, postings_budget - num_processed)
+            if count <= 0:
+                break
+        doc_nums = impact_index.segment_docs(segment, count)
+        # Doc numbers are distinct within a segment
+        scores[doc_nums] += impact
+        processed.append(doc_nums)
+        num_processed += count
+        if time_budget is not None and (perf_counter() - start) * 1000 >= time_budget:
+            break
+
+    matched_docs = np.unique(np.concatenate(processed)) if processed else np.zeros(0, dtype=np.int64)
+    ranking = [(score * impact_index.scale, doc_num) for score, doc_num in top_k_docs(scores, k, matched_docs)]
+    return ranking, num_processed
+
+
+def stack_grid(grid):
+    """Combines the parameters of a grid of ranking parameters into one argdict,
+    parameters that differ become column arrays that broadcast against arrays of documents
+
+    Args:
+        grid (list of dict): Parameters for the ranking function of each grid point
+
+    Returns:
+        dict: Parameters, arrays of shape (len(grid), 1) for the ones that differ
+
+    Raises:
+        ValueError: If a parameter is not set for all grid points, or a non-numeric parameter differs
+    """
+    argdict = {}
+    for key in set().union(*grid):
+        values = [point[key] for point in grid if key in point]
+        if len(values) != len(grid):
+            raise ValueError('Parameter ' + key + ' must be set for all grid points or for none')
+        if all(value == values[0] for value in values):
+            argdict[key] = values[0]
+        elif all(isinstance(value, (int, float)) for value in values):
+            argdict[key] = np.array(values, dtype=np.float64)[:, None]
+        else:
+            raise ValueError('Parameter ' + key + ' can not differ between grid points')
+    return argdict
+
+
+def retrieve_top_k_sweep(k, query, ranking_function, inv_idx, doc_freq_idx, doc_len_idx, term_freq_idx, grid):
+    """Retrieves ordered top k documents for a query for every point of a parameter grid,
+    decoding the postings once and scoring all grid points together as a (grid points x documents) matrix,
+    gives the same rankings as retrieve_top_k_taat for each grid point
+
+    Args:
+        k (int): Number of documents to retrieve
+        query (str): Topic to retrieve documents for
+        ranking_function (function): Function to be passed for ranking documents, one of TERM_SCORES
+        inv_idx (dict): Inverted index of corpus
+        doc_freq_idx (dict): term - doc_freq
+        doc_len_idx (array): doc number - doc_len
+        term_freq_idx (dict): term - total term frequency
+        grid (list of dict): Parameters for the ranking function of each grid point, see stack_grid
+
+    Returns:
+        list of list of (float, int): Ranking of each grid point, see retrieve_top_k
+    """
+    term_scores = TERM_SCORES.get(ranking_function)
+    if term_scores is None:
+        raise ValueError('No vectorized term scores for ' + ranking_function.__name__)
+    query_terms = index_terms(query, inv_idx)
+    doc_lens = float_doc_lens(doc_len_idx)
+    zero_freqs = np.zeros(len(doc_lens))
+    postings = {term: ps.decode_postings(inv_idx[term]) for term in set(query_terms)}
+
+    sparse = has_sparse_term_scores(ranking_function, grid[0] if grid else {})
+    matched_docs = np.unique(np.concatenate([doc_nums for doc_nums, _ in postings.values()] or [[]])).astype(np.int64) if sparse else None
+
+    rankings = []
+    chunk_size = max(1, SWEEP_CELLS // max(1, len(doc_lens)))
+    for start in range(0, len(grid), chunk_size):
+        points = grid[start:start + chunk_size]
+        argdict = stack_grid(points)
+        scores = np.zeros((len(points), len(doc_lens)))
+        for term in query_terms:
+            doc_nums, freqs = postings[term]
+            doc_freq, total_term_freq = doc_freq_idx[term], term_freq_idx[term]
+            posting_scores = term_scores(freqs.astype(np.float64), doc_lens[doc_nums], doc_freq, total_term_freq, argdict)
+            if sparse:
+                scores[:, doc_nums] += posting_scores
+                continue
+            doc_scores = np.empty_like(scores)
+            doc_scores[:] = term_scores(zero_freqs, doc_lens, doc_freq, total_term_freq, argdict)
+            doc_scores[:, doc_nums] = posting_scores
+            scores += doc_scores
+        rankings.extend(top_k_docs(point_scores, k, matched_docs) for point_scores in scores)
+    return rankings
+
+
+class IndexPostings(Mapping):
+    """Postings of the query terms of an on-disk index, each decoded on first access,
+    so the pruning strategies can read single blocks through the index instead, see term_cursor
+
+    Attributes:
+        index (DiskIndex): Index the postings are read from
+        terms (set of str): Terms of the mapping
+        decoded (dict): term - postings decoded so far
+    """
+
+    def __init__(self, index, terms):
+        """
+        Args:
+            index (DiskIndex): Index opened with disk_index.py, or a view with the same methods
+            terms (set of str): Terms in the index
+        """
+        self.index = index
+        self.terms = terms
+        self.decoded = {}
+
+    def __getitem__(self, term):
+        if term not in self.terms:
+            raise KeyError(term)
+        postings = self.decoded.get(term)
+        if postings is None:
+            postings = self.decoded[term] = self.index.postings(term)
+        return postings
+
+    def __contains__(self, term):
+        return term in self.terms
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def __len__(self):
+        return len(self.terms)
+
+
+def filter_disk_index(index, terms):
+    """Reads the indexes of the given terms from an on-disk index
+
+    Args:
+        index (DiskIndex): Index opened with disk_index.py
+        terms (list of str): Terms to read, terms not in the index are left out
+
+    Returns:
+        (IndexPostings, dict, dict): term - postings, term - doc_freq, term - total term frequency
+    """
+    terms = set(term for term in terms if term in index)
+    inv_idx = IndexPostings(index, terms)
+    doc_freq_idx = {term: index.doc_freq(term) for term in terms}
+    term_freq_idx = {term: index.collection_freq(term) for term in terms}
+    return inv_idx, doc_freq_idx, term_freq_idx
+
+
+def run_file_name(function, argdict={}, binary=False):
+    """Name of the run file of a ranking function and its parameters
+
+    Args:
+        function (function): Ranking function
+        argdict (dict, optional): Parameters for the ranking function
+        binary (bool, optional): Name of a binary run, see run_files.py
 
+    Returns:
+        str: Path of the run file
+    """
     out_file_name = '../outputs/output'
-    out_file_name += '_' + argdict.get('fun').__name__
+    out_file_name += '_' + function.__name__
     for key in ['smoothing', 'lambda', 'mu', 'b', 'k1']:
         if argdict.get(key, None):
             out_file_name += '_' + key + '_' +  str(argdict.get(key))
-    out_file_name += '.txt'
-    with open(out_file_name, 'w+') as file:
-        for line in trec_eval_out:
-            print(line, file=file)
+    out_file_name += rn.RUN_EXTENSION if binary else '.txt'
+    return out_file_name
+
+
+def hybrid_run_file_name(scorers, fusion, binary=False):
+    """Name of the run file of the fused ranking of retrieve_top_k_hybrid
+
+    Args:
+        scorers (list of dict): Parameters of each ranking function
+        fusion (str): Fusion method
+        binary (bool, optional): Name of a binary run, see run_files.py
+
+    Returns:
+        str: Path of the run file
+    """
+    names = [os.path.splitext(run_file_name(argdict.get('fun', bm25), argdict))[0].split('output_', 1)[1] for argdict in scorers]
+    return '../outputs/output_' + fusion + '_' + '_'.join(names) + (rn.RUN_EXTENSION if binary else '.txt')
+
+
+def open_run_file(out_file_name, index, binary=False):
+    """Opens a run file for writing
+
+    Args:
+        out_file_name (str): Path of the run file
+        index (DiskIndex): Index the rankings are searched on
+        binary (bool, optional): Write a binary run instead of TREC text, see run_files.py
+
+    Returns:
+        file or RunWriter: Run file
+    """
+    if binary:
+        return rn.RunWriter(out_file_name, index)
+    return open(out_file_name, 'w+')
+
+
+def evaluate_topics(out_file_names, search, searcher=None, binary=False):
+    """Searches all topics and writes the rankings to run files, the steps shared by the evaluate functions
+
+    Args:
+        out_file_names (list of str): Paths of the run files
+        search (function): (Searcher, topic number - query text, run files) - results of the search
+        searcher (Searcher, optional): Searcher to reuse between calls, by default one is opened and closed
+        binary (bool, optional): Write binary runs instead of TREC text, see run_files.py
+
+    Returns:
+        Results of search
+    """
+    from searcher import Searcher
+
+    print('Loading indices...')
+    own_searcher = searcher is None
+    if own_searcher:
+        searcher = Searcher(di.INDEX_DIR)
+    try:
+        with open("../data/TOPIC_DICT_NOSTOP.pkl", "rb") as file:
+            topic_dict = pickle.load(file)
+
+        print('Finished loading indices...')
+
+        out_files = [open_run_file(out_file_name, searcher.index, binary) for out_file_name in out_file_names]
+        try:
+            return search(searcher, topic_dict, out_files)
+        finally:
+            for file in out_files:
+                file.close()
+    finally:
+        if own_searcher:
+            searcher.close()
+
+
+def rank_evaluate(argdict={}, searcher=None, binary=False):
+    """Main function, used when this file is called
+    
+    Args:
+        argdict (dict, optional): Parameters for the ranking function
+        searcher (Searcher, optional): Searcher to reuse between calls, by default one is opened and closed
+        binary (bool, optional): Write a binary run instead of TREC text, see run_files.py
+    """
+    k = argdict.get('k', 1000)
+    function = argdict.get('fun', bm25)
+
+    out_file_name = run_file_name(function, argdict, binary)
+    evaluate_topics([out_file_name], lambda searcher, topic_dict, out_files:
+                    searcher.search_batch(topic_dict, k, function, argdict, out_file=out_files[0]), searcher, binary)
     print('Ranking complete. Result stored in ' + out_file_name)
 
 
+def sweep_evaluate(grid, searcher=None, binary=False):
+    """Ranks all topics for every point of a parameter grid in one pass over the postings,
+    writing one run file per grid point like rank_evaluate
+
+    Args:
+        grid (list of dict): Parameters for the ranking function of each grid point,
+            all with the same 'k', 'fun' and 'smoothing'
+        searcher (Searcher, optional): Searcher to reuse between calls, by default one is opened and closed
+        binary (bool, optional): Write binary runs instead of TREC text, see run_files.py
+    """
+    k = grid[0].get('k', 1000)
+    function = grid[0].get('fun', bm25)
+
+    out_file_names = [run_file_name(function, argdict, binary) for argdict in grid]
+    evaluate_topics(out_file_names, lambda searcher, topic_dict, out_files:
+                    searcher.sweep_batch(topic_dict, k, function, grid, out_files), searcher, binary)
+    print('Sweep complete. Results stored in ' + str(len(out_file_names)) + ' run files')
+
+
+def hybrid_evaluate(scorers, fusion='rrf', weights=None, searcher=None, binary=False):
+    """Ranks all topics with several ranking functions in one pass over the postings and fuses the rankings,
+    writing a run file per ranking function like rank_evaluate and one for the fused rankings
+
+    Args:
+        scorers (list of dict): Parameters of each ranking function, all with the same 'k'
+        fusion (str, optional): Fusion method, one of fusion.FUSION_METHODS
+        weights (list of float, optional): Weight of each ranking function in the fusion
+        searcher (Searcher, optional): Searcher to reuse between calls, by default one is opened and closed
+        binary (bool, optional): Write binary runs instead of TREC text, see run_files.py
+    """
+    k = scorers[0].get('k', 1000)
+
+    out_file_names = [run_file_name(argdict.get('fun', bm25), argdict, binary) for argdict in scorers]
+    out_file_names.append(hybrid_run_file_name(scorers, fusion, binary))
+    evaluate_topics(out_file_names, lambda searcher, topic_dict, out_files:
+                    searcher.hybrid_batch(topic_dict, k, scorers, fusion, weights, out_files), searcher, binary)
+    print('Hybrid ranking complete. Fused rankings stored in ' + out_file_names[-1])
+
+
+def cascade_evaluate(argdict={}, searcher=None, binary=False, recall=True):
+    """Ranks all topics with two-stage cascade retrieval, see retrieve_top_k_cascade, and writes a run file
+    like rank_evaluate
+
+    Args:
+        argdict (dict, optional): Parameters of the cascade, see retrieve_top_k_cascade
+        searcher (Searcher, optional): Searcher to reuse between calls, by default one is opened and closed
+        binary (bool, optional): Write a binary run instead of TREC text, see run_files.py
+        recall (bool, optional): Also retrieve the top k of the second stage ranking function over all documents,
+            and report the recall of the first stage candidates against it
+
+    Returns:
+        float: Mean recall of the first stage over the topics, None without recall
+    """
+    k = argdict.get('k', 1000)
+    function = argdict.get('fun', ql)
+
+    out_file_name = run_file_name(function, argdict, binary)
+    out_file_name = out_file_name.replace('output_', 'output_cascade_' + str(max(k, argdict.get('candidates', CASCADE_CANDIDATES))) + '_', 1)
+    results = evaluate_topics([out_file_name], lambda searcher, topic_dict, out_files:
+                              searcher.cascade_batch(topic_dict, k, argdict, out_file=out_files[0], recall=recall),
+                              searcher, binary)
+    print('Cascade ranking complete. Result stored in ' + out_file_name)
+
+    if not recall:
+        return None
+    mean_recall = sum(topic_recall for _, topic_recall in results.values()) / max(1, len(results))
+    print('Recall of the first stage: ' + str(mean_recall))
+    return mean_recall
+
+
+def impact_run_file_name(argdict={}, binary=False):
+    """Name of the run file of score-at-a-time retrieval from the impact index, with the budget in the name
+
+    Args:
+        argdict (dict, optional): Budget and parameters of the impact index, see retrieve_top_k_impact
+        binary (bool, optional): Name of a binary run, see run_files.py
+
+    Returns:
+        str: Path of the run file
+    """
+    budget = ''
+    if argdict.get('postings_budget') is not None:
+        budget += 'postings_' + str(argdict['postings_budget']) + '_'
+    if argdict.get('time_budget') is not None:
+        budget += 'ms_' + str(argdict['time_budget']) + '_'
+    return run_file_name(bm25, argdict, binary).replace('output_', 'output_impact_' + (budget or 'full_'), 1)
+
+
+def impact_evaluate(argdict={}, searcher=None, binary=False):
+    """Ranks all topics score-at-a-time from the impact index within a budget, see retrieve_top_k_impact,
+    and writes a run file like rank_evaluate
+
+    Args:
+        argdict (dict, optional): Budget ('postings_budget', 'time_budget') and Okapi BM25 parameters of the impact index
+        searcher (Searcher, optional): Searcher to reuse between calls, by default one is opened and closed
+        binary (bool, optional): Write a binary run instead of TREC text, see run_files.py
+
+    Returns:
+        dict: Path of the run file, mean number of postings processed, and mean, median, 95th and 99th percentile
+            of the latency in milliseconds
+    """
+    k = argdict.get('k', 1000)
+
+    out_file_name = impact_run_file_name(argdict, binary)
+    results = evaluate_topics([out_file_name], lambda searcher, topic_dict, out_files:
+                              searcher.impact_batch(topic_dict, k, argdict, out_file=out_files[0]), searcher, binary)
+    print('Impact ranking complete. Result stored in ' + out_file_name)
+
+    latencies = np.array([latency for _, _, latency in results.values()])
+    stats = {
+        'run_file': out_file_name,
+        'postings': float(np.mean([num_processed for _, num_processed, _ in results.values()])) if results else 0.0,
+        'mean_latency': float(latencies.mean()) if results else 0.0,
+    }
+    for name, percentile in [('p50_latency', 50), ('p95_latency', 95), ('p99_latency', 99)]:
+        stats[name] = float(np.percentile(latencies, percentile)) if results else 0.0
+    print('Postings processed: {postings:.0f}, latency mean {mean_latency:.2f} ms, p50 {p50_latency:.2f} ms, '
+          'p95 {p95_latency:.2f} ms, p99 {p99_latency:.2f} ms'.format(**stats))
+    return stats
+
+
 def main():
     """Executes a simple retrieval when this file is called
     """
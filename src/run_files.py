@@ -0,0 +1,290 @@
+"""Compact binary run files, written and read topic by topic
+
+A binary run is laid out as
+    [header: HEADER_DTYPE][topic blocks][topic table: TOPIC_DTYPE per topic]
+A topic block holds the doc numbers (uint32) of its ranking, best first, followed by their scores (float32),
+so a topic is read as two arrays straight from the mapped file, without parsing.
+The topic table is written when the file is closed and its offset patched into the header,
+so rankings can be appended as they are finished. Doc numbers refer to the index the run was searched on,
+the header records its build ID and number of documents as a check.
+trec_eval reads scores as 32-bit floats, so float32 scores rank the same as the text format.
+
+Attributes:
+    HEADER_DTYPE (np.dtype): Header of a binary run
+    MAGIC (bytes): First bytes of a binary run
+    RUN_EXTENSION (str): File extension of binary runs
+    TOPIC_DTYPE (np.dtype): Record describing the block of one topic
+    VERSION (int): Version of the binary run format
+"""
+import os
+
+import numpy as np
+
+import disk_index as di
+import evaluation as ev
+
+MAGIC = b'RUNB'
+VERSION = 2
+RUN_EXTENSION = '.run'
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('version', '<u4'),
+    ('num_docs', '<u4'),
+    ('num_topics', '<u4'),
+    ('table_offset', '<u8'),
+    ('build_id', 'S40'),
+])
+
+TOPIC_DTYPE = np.dtype([
+    ('topic', 'S16'),
+    ('offset', '<u8'),
+    ('count', '<u4'),
+])
+
+
+def fixed_bytes(value, dtype, field):
+    """Encodes a string for a fixed-size bytes field, which numpy would silently truncate
+
+    Args:
+        value (str): String to store
+        dtype (np.dtype): Record type
+        field (str): Name of the field in dtype
+
+    Returns:
+        bytes: UTF-8 encoded value
+
+    Raises:
+        ValueError: If the encoded value does not fit in the field
+    """
+    encoded = value.encode('utf-8')
+    if len(encoded) > dtype[field].itemsize:
+        raise ValueError(field + ' ' + repr(value) + ' is longer than ' + str(dtype[field].itemsize) + ' bytes')
+    return encoded
+
+
+class RunWriter:
+    """Writes a binary run one topic at a time
+
+    Attributes:
+        file (file): Run file being written
+        path (str): Path of the run file
+        num_docs (int): Number of documents of the index
+        build_id (bytes): Build ID of the index
+        topics (list of tuple): TOPIC_DTYPE record of each written topic
+    """
+
+    def __init__(self, path, index):
+        """Creates a binary run
+
+        Args:
+            path (str): Path of the run file
+            index (DiskIndex): Index the doc numbers refer to
+
+        Raises:
+            ValueError: If the build ID of the index does not fit in the header
+        """
+        self.build_id = fixed_bytes(index.build_id, HEADER_DTYPE, 'build_id')
+        self.path = path
+        self.file = open(path, 'wb')
+        self.num_docs = index.num_docs
+        self.topics = []
+        self.file.write(np.zeros(1, dtype=HEADER_DTYPE).tobytes())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Closes the run, or removes it if the with block raised, so a run cut short
+           never gets a valid header. The exception is not suppressed
+        """
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            os.remove(self.path)
+
+    def add_topic(self, topic, doc_nums, scores):
+        """Appends the ranking of a topic
+
+        Args:
+            topic (str): Topic number, at most 16 bytes
+            doc_nums (sequence of int): Doc numbers, best first
+            scores (sequence of float): Scores, aligned with doc_nums
+
+        Raises:
+            ValueError: If the topic number is longer than 16 bytes
+        """
+        topic = fixed_bytes(topic, TOPIC_DTYPE, 'topic')
+        doc_nums = np.asarray(doc_nums, dtype='<u4')
+        self.topics.append((topic, self.file.tell(), len(doc_nums)))
+        self.file.write(doc_nums.tobytes())
+        self.file.write(np.asarray(scores, dtype='<f4').tobytes())
+
+    def add_ranking(self, topic, ranking):
+        """Appends a ranking as returned by Searcher.search
+
+        Args:
+            topic (str): Topic number
+            ranking (list of (float, int)): Score and doc number, best first
+        """
+        self.add_topic(topic, [doc_num for _, doc_num in ranking], [score for score, _ in ranking])
+
+    def flush(self):
+        """Flushes the written topic blocks
+        """
+        self.file.flush()
+
+    def close(self):
+        """Writes the topic table and the header
+        """
+        table_offset = self.file.tell()
+        self.file.write(np.array(self.topics, dtype=TOPIC_DTYPE).tobytes())
+        header = np.array([(MAGIC, VERSION, self.num_docs, len(self.topics), table_offset, self.build_id)],
+                          dtype=HEADER_DTYPE)
+        self.file.seek(0)
+        self.file.write(header.tobytes())
+        self.file.close()
+
+
+class RunReader:
+    """Reads a binary run opened with mmap, topic blocks are only read when accessed
+
+    Attributes:
+        header (np.void): HEADER_DTYPE record
+        num_docs (int): Number of documents of the index the doc numbers refer to
+        build_id (str): Build ID of the index the doc numbers refer to
+        table (np.ndarray): TOPIC_DTYPE record of each topic, in written order
+        positions (dict): Topic number - position in table
+    """
+
+    def __init__(self, path):
+        """Opens a binary run written by RunWriter
+
+        Args:
+            path (str): Path of the run file
+        """
+        self.data = di.map_file(path)
+        self.header = np.frombuffer(self.data, dtype=HEADER_DTYPE, count=1)[0]
+        if self.header['magic'] != MAGIC or self.header['version'] != VERSION:
+            raise ValueError('Not a binary run of version ' + str(VERSION) + ': ' + path)
+        self.num_docs = int(self.header['num_docs'])
+        self.build_id = self.header['build_id'].decode('utf-8')
+        self.table = np.frombuffer(self.data, dtype=TOPIC_DTYPE, count=int(self.header['num_topics']),
+                                   offset=int(self.header['table_offset']))
+        self.positions = {topic.decode('utf-8'): i for i, topic in enumerate(self.table['topic'])}
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, topic):
+        return topic in self.positions
+
+    def topics(self):
+        """Topic numbers in written order
+        """
+        return list(self.positions)
+
+    def __getitem__(self, topic):
+        """Ranking of a topic, as read-only views on the mapped file
+
+        Returns:
+            (np.ndarray, np.ndarray): Doc numbers (uint32) and scores (float32), best first
+        """
+        record = self.table[self.positions[topic]]
+        offset, count = int(record['offset']), int(record['count'])
+        doc_nums = np.frombuffer(self.data, dtype='<u4', count=count, offset=offset)
+        scores = np.frombuffer(self.data, dtype='<f4', count=count, offset=offset + 4 * count)
+        return doc_nums, scores
+
+    def __iter__(self):
+        """Streams (topic number, doc numbers, scores) in written order
+        """
+        for topic in self.positions:
+            yield (topic,) + self[topic]
+
+
+def is_binary_run(path):
+    """Whether a file is a binary run
+    """
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def check_index(reader, index):
+    """Checks that the doc numbers of a binary run refer to an index
+
+    Raises:
+        ValueError: If the run was searched on another build of the index, or the number of documents differs
+    """
+    if reader.build_id != index.build_id:
+        raise ValueError('Run was searched on index build ' + reader.build_id + ', not ' + index.build_id)
+    if reader.num_docs != index.num_docs:
+        raise ValueError('Run was searched on an index of ' + str(reader.num_docs) +
+                         ' documents, not ' + str(index.num_docs))
+
+
+def load_run(path, index=None):
+    """Reads a binary or TREC text run into an evaluation-style run
+
+    Args:
+        path (str): Path of the run file
+        index (DiskIndex, optional): Index the doc numbers of a binary run refer to, defaults to di.INDEX_DIR
+
+    Returns:
+        dict: Topic number - [(doc_id, score)], best first
+    """
+    if not is_binary_run(path):
+        return ev.read_run(path)
+    reader = RunReader(path)
+    if index is None:
+        index = di.DiskIndex(di.INDEX_DIR)
+    check_index(reader, index)
+    run = {}
+    for topic, doc_nums, scores in reader:
+        run[topic] = list(zip(index.doc_id_list(doc_nums), scores.tolist()))
+    return run
+
+
+def binary_to_trec(run_path, trec_path, index=None, run_name='STANDARD'):
+    """Converts a binary run to the TREC text format read by trec_eval
+
+    Args:
+        run_path (str): Binary run
+        trec_path (str): Text run to write
+        index (DiskIndex, optional): Index the doc numbers refer to, defaults to di.INDEX_DIR
+        run_name (str, optional): Name in the last column
+    """
+    reader = RunReader(run_path)
+    if index is None:
+        index = di.DiskIndex(di.INDEX_DIR)
+    check_index(reader, index)
+    with open(trec_path, 'w') as file:
+        for topic, doc_nums, scores in reader:
+            doc_ids = index.doc_id_list(doc_nums)
+            file.write(''.join(' '.join([topic, 'Q0', doc_id, str(rank), repr(score), run_name]) + '\n'
+                               for rank, (doc_id, score) in enumerate(zip(doc_ids, scores.tolist()))))
+
+
+def trec_to_binary(trec_path, run_path, index=None):
+    """Converts a TREC text run to a binary run, topics and documents keep their order in the file
+
+    Args:
+        trec_path (str): Text run
+        run_path (str): Binary run to write
+        index (DiskIndex, optional): Index to number the documents with, defaults to di.INDEX_DIR
+
+    Raises:
+        KeyError: If a document is not in the index
+    """
+    if index is None:
+        index = di.DiskIndex(di.INDEX_DIR)
+    with RunWriter(run_path, index) as writer:
+        for topic, ranking in ev.read_run(trec_path).items():
+            doc_nums = []
+            for doc_id, _ in ranking:
+                doc_num = index.doc_num(doc_id)
+                if doc_num is None:
+                    raise KeyError(doc_id)
+                doc_nums.append(doc_num)
+            writer.add_topic(topic, doc_nums, [score for _, score in ranking])
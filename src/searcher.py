@@ -0,0 +1,533 @@
+"""Long-lived searcher that loads the on-disk index once and serves any number of queries
+
+Topic sets are searched by a persistent pool of worker processes.
+Each worker opens the index with mmap itself and scores straight from the mapped pages,
+so postings and document lengths are shared through the page cache instead of being copied into every worker,
+and adding a worker costs little more than its interpreter.
+Rankings are written to the run file, TREC text or binary (see run_files.py), in topic order as soon as they are finished.
+Rankings of repeated queries are answered from a query cache (see query_cache.py) without searching.
+A segmented index (see segments.py) is searched like one index of the live documents of its segments.
+With several shards, every query is searched by the worker processes of doc-range shards (see shards.py) in parallel.
+
+Attributes:
+    SEARCHER (Searcher): Searcher of a worker process, set by init_worker
+"""
+import os
+
+from multiprocessing import Pool, cpu_count
+from time import perf_counter
+
+from tqdm import tqdm
+
+import text_manipulation as tm
+import disk_index as di
+import postings as ps
+import ranking as rk
+import run_files as rn
+import forward_index as fw
+import impact_index as im
+import query_cache as qc
+import segments as sg
+import shards as sh
+import block_cache as bc
+
+SEARCHER = None
+
+
+class Searcher:
+    """Searches the on-disk index, with a pool of worker processes for topic sets
+
+    Attributes:
+        index (DiskIndex or SegmentedIndex): Index opened with mmap, or the segments of a segmented index
+        index_dir (str): Directory of the index
+        doc_len_index (memoryview): doc number - doc_len, read-only view on the mapped doc_lens.bin
+        processes (int): Number of worker processes for search_batch
+        pool (Pool): Worker pool, started by the first call to search_batch
+        block_cache_bytes (int): Byte budget of the cache of decoded posting blocks, see block_cache.py
+        forward_index (ForwardIndex): Forward index for cascade retrieval, opened (and built) on first use
+        impact_index (ImpactIndex): Impact index for score-at-a-time retrieval, opened (and built) on first use
+        cache (QueryCache): Rankings of search and search_batch, None without a cache
+        shards (int): Number of doc-range shards searching each query in parallel, 1 searches unsharded
+        shard_pool (ShardPool): Workers of the shards, started by the first sharded search
+    """
+
+    def __init__(self, index_dir=di.INDEX_DIR, processes=None, cache_size=qc.QUERY_CACHE_SIZE, cache_dir=None,
+                 block_cache_bytes=bc.BLOCK_CACHE_BYTES, manifest=None, shards=1):
+        """Opens the index, loads its stem cache and sets the collection statistics of the ranking functions
+
+        Args:
+            index_dir (str, optional): Directory of the index
+            processes (int, optional): Number of worker processes for search_batch, defaults to cpu_count(),
+                1 searches in this process
+            cache_size (int, optional): Number of rankings kept in memory by the query cache, 0 for none
+            cache_dir (str, optional): Directory of the on-disk tier of the query cache, none if None
+            block_cache_bytes (int, optional): Byte budget of the cache of decoded posting blocks, of this process
+                and of each worker, 0 for none
+            manifest (dict, optional): Manifest of a segmented index to search, defaults to the current one,
+                see segments.py
+            shards (int, optional): Number of doc-range shards searching each query in parallel, see shards.py,
+                1 searches unsharded
+        """
+        self.index_dir = index_dir
+        self.block_cache_bytes = block_cache_bytes
+        self.index = sg.open_index(index_dir, block_cache_bytes, manifest)
+        # Passed to the ranking functions with their parameters, see ranking.with_stats
+        self.stats = self.index.collection_stats()
+        if not len(tm.STEM_CACHE):
+            # Forked workers inherit the stem cache of the parent
+            tm.STEM_CACHE.load(os.path.join(index_dir, tm.STEM_CACHE_FILE))
+        # A view on the mapped file instead of a copy, so all workers share the same pages
+        self.doc_len_index = memoryview(self.index.doc_lens).cast('B').cast(ps.TYPECODE)
+        self.processes = processes or cpu_count()
+        self.pool = None
+        self.forward_index = None
+        self.impact_index = None
+        self.shards = shards
+        self.shard_pool = None
+        self.cache = None
+        if cache_size or cache_dir is not None:
+            self.cache = qc.QueryCache(cache_size, cache_dir, self.index.build_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def search(self, query, k=1000, scorer=rk.bm25, params={}):
+        """Retrieves the ordered top k documents for a query
+
+        Args:
+            query (str): Query text
+            k (int, optional): Number of documents to retrieve
+            scorer (function): Ranking function, e.g. ranking.bm25
+            params (dict, optional): Parameters for the ranking function,
+                params['strategy'] selects one of ranking.RETRIEVAL_STRATEGIES
+
+        Returns:
+            list of (float, int): Score and doc number of the top k documents, best first
+        """
+        if self.cache is None:
+            return self.rank(query, k, scorer, params)
+        key = qc.cache_key(tm.process_text(query), scorer, params, k)
+        ranking = self.cache.get(key)
+        if ranking is None:
+            ranking = self.rank(query, k, scorer, params)
+            self.cache.put(key, ranking)
+        return ranking
+
+    def rank(self, query, k=1000, scorer=rk.bm25, params={}):
+        """Retrieves the ordered top k documents for a query, bypassing the query cache, see search
+        """
+        if self.shards > 1:
+            return self.get_shards().search(query, k, scorer, params)
+        retrieve = rk.RETRIEVAL_STRATEGIES[params.get('strategy', 'exhaustive')]
+        inv_idx, doc_freq_idx, term_freq_idx = rk.filter_disk_index(self.index, tm.process_text(query))
+        results = {}
+        retrieve(k, query, scorer, inv_idx, doc_freq_idx, self.doc_len_index, term_freq_idx, results, query,
+                 rk.with_stats(params, self.stats))
+        return results[query]
+
+    def search_batch(self, topics, k=1000, scorer=rk.bm25, params={}, out_file=None):
+        """Searches a set of topics with the worker pool
+
+        Args:
+            topics (dict): Topic number - query text
+            k (int, optional): Number of documents to retrieve per topic
+            scorer (function): Ranking function, e.g. ranking.bm25
+            params (dict, optional): Parameters for the ranking function, see search
+            out_file (file or RunWriter, optional): Run file the rankings are written to as soon as they are finished
+
+        Returns:
+            dict: Topic number - ranking, see search
+        """
+        # Only the topics that are not cached are searched by the workers
+        keys = {}
+        cached = {}
+        if self.cache is not None:
+            for num in topics:
+                keys[num] = qc.cache_key(tm.process_text(topics[num]), scorer, params, k)
+                ranking = self.cache.get(keys[num])
+                if ranking is not None:
+                    cached[num] = ranking
+
+        tasks = [(num, topics[num], k, scorer, params) for num in sorted(topics) if num not in cached]
+        if self.shards > 1:
+            rankings = self.get_shards().search_many(tasks)
+        elif self.processes == 1:
+            rankings = (search_topic(task, self) for task in tasks)
+        else:
+            rankings = self.get_pool().imap(search_topic, tasks)
+
+        results = {}
+        for num in tqdm(sorted(topics)):
+            if num in cached:
+                ranking = cached[num]
+            else:
+                _, ranking = next(rankings)
+                if self.cache is not None:
+                    self.cache.put(keys[num], ranking)
+            results[num] = ranking
+            if out_file is not None:
+                write_ranking(out_file, num, ranking, self.index)
+                out_file.flush()
+        return results
+
+    def search_sweep(self, query, k, scorer, grid):
+        """Retrieves the ordered top k documents for a query for every point of a parameter grid,
+        see ranking.retrieve_top_k_sweep
+
+        Args:
+            query (str): Query text
+            k (int): Number of documents to retrieve
+            scorer (function): Ranking function, one of ranking.TERM_SCORES
+            grid (list of dict): Parameters for the ranking function of each grid point
+
+        Returns:
+            list of list of (float, int): Ranking of each grid point, see search
+        """
+        inv_idx, doc_freq_idx, term_freq_idx = rk.filter_disk_index(self.index, tm.process_text(query))
+        grid = [rk.with_stats(point, self.stats) for point in grid]
+        return rk.retrieve_top_k_sweep(k, query, scorer, inv_idx, doc_freq_idx, self.doc_len_index, term_freq_idx, grid)
+
+    def sweep_batch(self, topics, k, scorer, grid, out_files=None):
+        """Searches a set of topics for every point of a parameter grid with the worker pool
+
+        Args:
+            topics (dict): Topic number - query text
+            k (int): Number of documents to retrieve per topic
+            scorer (function): Ranking function, one of ranking.TERM_SCORES
+            grid (list of dict): Parameters for the ranking function of each grid point
+            out_files (list of file or RunWriter, optional): Run file of each grid point
+
+        Returns:
+            dict: Topic number - ranking of each grid point
+        """
+        tasks = [(num, topics[num], k, scorer, grid) for num in sorted(topics)]
+        if self.processes == 1:
+            rankings = (sweep_topic(task, self) for task in tasks)
+        else:
+            rankings = self.get_pool().imap(sweep_topic, tasks)
+
+        results = {}
+        for num, point_rankings in tqdm(rankings, total=len(tasks)):
+            results[num] = point_rankings
+            for file, ranking in zip(out_files or [], point_rankings):
+                write_ranking(file, num, ranking, self.index)
+        return results
+
+    def search_hybrid(self, query, k, scorers, fusion='rrf', weights=None):
+        """Retrieves the ordered top k documents for a query with several ranking functions in one pass,
+        and their fused ranking, see ranking.retrieve_top_k_hybrid
+
+        Args:
+            query (str): Query text
+            k (int): Number of documents to retrieve
+            scorers (list of dict): Parameters of each ranking function, 'fun' is one of ranking.TERM_SCORES
+            fusion (str, optional): Fusion method, one of fusion.FUSION_METHODS
+            weights (list of float, optional): Weight of each ranking function in the fusion
+
+        Returns:
+            (list of list of (float, int), list of (float, int)): Ranking of each ranking function and fused ranking
+        """
+        inv_idx, doc_freq_idx, term_freq_idx = rk.filter_disk_index(self.index, tm.process_text(query))
+        scorers = [rk.with_stats(argdict, self.stats) for argdict in scorers]
+        return rk.retrieve_top_k_hybrid(k, query, inv_idx, doc_freq_idx, self.doc_len_index, term_freq_idx,
+                                        scorers, fusion, weights)
+
+    def hybrid_batch(self, topics, k, scorers, fusion='rrf', weights=None, out_files=None):
+        """Searches a set of topics with several ranking functions and fuses the rankings, with the worker pool
+
+        Args:
+            topics (dict): Topic number - query text
+            k (int): Number of documents to retrieve per topic
+            scorers (list of dict): Parameters of each ranking function
+            fusion (str, optional): Fusion method, one of fusion.FUSION_METHODS
+            weights (list of float, optional): Weight of each ranking function in the fusion
+            out_files (list of file or RunWriter, optional): Run file of each ranking function, then of the fused rankings
+
+        Returns:
+            dict: Topic number - (ranking of each ranking function, fused ranking)
+        """
+        tasks = [(num, topics[num], k, scorers, fusion, weights) for num in sorted(topics)]
+        if self.processes == 1:
+            rankings = (hybrid_topic(task, self) for task in tasks)
+        else:
+            rankings = self.get_pool().imap(hybrid_topic, tasks)
+
+        results = {}
+        for num, (scorer_rankings, fused) in tqdm(rankings, total=len(tasks)):
+            results[num] = scorer_rankings, fused
+            for file, ranking in zip(out_files or [], scorer_rankings + [fused]):
+                write_ranking(file, num, ranking, self.index)
+        return results
+
+    def search_cascade(self, query, k, argdict, recall=False):
+        """Retrieves the ordered top k documents for a query with two-stage cascade retrieval,
+        see ranking.retrieve_top_k_cascade
+
+        Args:
+            query (str): Query text
+            k (int): Number of documents to retrieve
+            argdict (dict): Parameters of the cascade
+            recall (bool, optional): Also compute the recall of the first stage against the second stage
+                ranking function over all documents
+
+        Returns:
+            (list of (float, int), float): Ranking and recall of the first stage, None without recall
+        """
+        forward_index = self.get_forward_index()
+        query_terms = tm.process_text(query)
+        inv_idx, doc_freq_idx, term_freq_idx = rk.filter_disk_index(self.index, query_terms)
+        term_nums = {term: self.index.find_term(term) for term in inv_idx}
+        argdict = rk.with_stats(argdict, self.stats)
+        ranking, candidates = rk.retrieve_top_k_cascade(k, query, inv_idx, doc_freq_idx, self.doc_len_index,
+                                                        term_freq_idx, forward_index, term_nums, argdict)
+        if not recall:
+            return ranking, None
+        results = {}
+        rk.retrieve_top_k_taat(k, query, argdict.get('fun', rk.ql), inv_idx, doc_freq_idx, self.doc_len_index,
+                               term_freq_idx, results, query, argdict)
+        return ranking, rk.candidate_recall(candidates, results[query])
+
+    def cascade_batch(self, topics, k, argdict, out_file=None, recall=False):
+        """Searches a set of topics with two-stage cascade retrieval, with the worker pool
+
+        Args:
+            topics (dict): Topic number - query text
+            k (int): Number of documents to retrieve per topic
+            argdict (dict): Parameters of the cascade, see ranking.retrieve_top_k_cascade
+            out_file (file or RunWriter, optional): Run file the rankings are written to as soon as they are finished
+            recall (bool, optional): Also compute the recall of the first stage, see search_cascade
+
+        Returns:
+            dict: Topic number - (ranking, recall of the first stage)
+        """
+        # Built once here, before the workers open it
+        self.get_forward_index()
+        tasks = [(num, topics[num], k, argdict, recall) for num in sorted(topics)]
+        if self.processes == 1:
+            rankings = (cascade_topic(task, self) for task in tasks)
+        else:
+            rankings = self.get_pool().imap(cascade_topic, tasks)
+
+        results = {}
+        for num, (ranking, topic_recall) in tqdm(rankings, total=len(tasks)):
+            results[num] = ranking, topic_recall
+            if out_file is not None:
+                write_ranking(out_file, num, ranking, self.index)
+                out_file.flush()
+        return results
+
+    def search_impact(self, query, k, argdict={}):
+        """Retrieves the ordered top k documents for a query score-at-a-time from the impact index, within a budget,
+        see ranking.retrieve_top_k_impact
+
+        Args:
+            query (str): Query text
+            k (int): Number of documents to retrieve
+            argdict (dict, optional): Budget ('postings_budget', 'time_budget') and Okapi BM25 parameters
+                of the impact index ('k1', 'b')
+
+        Returns:
+            (list of (float, int), int, float): Ranking, number of postings processed and latency in milliseconds
+        """
+        start = perf_counter()
+        impact_index = self.get_impact_index(argdict)
+        term_nums = {}
+        for term in set(tm.process_text(query)):
+            term_num = self.index.find_term(term)
+            if term_num is not None:
+                term_nums[term] = term_num
+        ranking, num_processed = rk.retrieve_top_k_impact(k, query, impact_index, term_nums, argdict)
+        return ranking, num_processed, (perf_counter() - start) * 1000
+
+    def impact_batch(self, topics, k, argdict={}, out_file=None):
+        """Searches a set of topics score-at-a-time from the impact index, with the worker pool
+
+        Args:
+            topics (dict): Topic number - query text
+            k (int): Number of documents to retrieve per topic
+            argdict (dict, optional): Budget and parameters of the impact index, see search_impact
+            out_file (file or RunWriter, optional): Run file the rankings are written to as soon as they are finished
+
+        Returns:
+            dict: Topic number - (ranking, number of postings processed, latency in milliseconds)
+        """
+        # Built once here, before the workers open it
+        self.get_impact_index(argdict)
+        tasks = [(num, topics[num], k, argdict) for num in sorted(topics)]
+        if self.processes == 1:
+            rankings = (impact_topic(task, self) for task in tasks)
+        else:
+            rankings = self.get_pool().imap(impact_topic, tasks)
+
+        results = {}
+        for num, (ranking, num_processed, latency) in tqdm(rankings, total=len(tasks)):
+            results[num] = ranking, num_processed, latency
+            if out_file is not None:
+                write_ranking(out_file, num, ranking, self.index)
+                out_file.flush()
+        return results
+
+    def get_forward_index(self):
+        """Forward index, opened on first use and built if the index does not have one yet
+
+        Raises:
+            ValueError: For a segmented index, whose doc numbers change with every commit
+        """
+        if isinstance(self.index, sg.SegmentedIndex):
+            raise ValueError('Cascade retrieval needs a single index, not a segmented one: ' + self.index_dir)
+        if self.forward_index is None:
+            if not fw.has_forward_index(self.index_dir):
+                fw.write_forward_index(self.index_dir)
+            self.forward_index = fw.ForwardIndex(self.index_dir)
+        return self.forward_index
+
+    def get_impact_index(self, argdict={}):
+        """Impact index, opened on first use and built if the index does not have one for these Okapi BM25
+        parameters yet
+
+        Raises:
+            ValueError: For a segmented index, whose doc numbers change with every commit
+        """
+        if isinstance(self.index, sg.SegmentedIndex):
+            raise ValueError('Impact retrieval needs a single index, not a segmented one: ' + self.index_dir)
+        params = im.impact_params(argdict)
+        if self.impact_index is None or self.impact_index.meta['params'] != params:
+            if not im.has_impact_index(self.index_dir, params):
+                im.write_impact_index(self.index_dir, params)
+            self.impact_index = im.ImpactIndex(self.index_dir)
+        return self.impact_index
+
+    def get_pool(self):
+        """Worker pool, started on first use
+        """
+        if self.pool is None:
+            self.pool = Pool(self.processes, initializer=init_worker, initargs=(self.index_dir, self.block_cache_bytes, getattr(self.index, 'manifest', None)))
+        return self.pool
+
+    def get_shards(self):
+        """Workers of the doc-range shards, started on first use
+
+        Raises:
+            ValueError: For a segmented index, whose segments are not doc ranges of one index
+        """
+        if isinstance(self.index, sg.SegmentedIndex):
+            raise ValueError('Sharded retrieval needs a single index, not a segmented one: ' + self.index_dir)
+        if self.shard_pool is None:
+            self.shard_pool = sh.ShardPool(self.index_dir, self.shards, self.block_cache_bytes)
+        return self.shard_pool
+
+    def close(self):
+        """Stops the worker pool and the workers of the shards
+        """
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+        if self.shard_pool is not None:
+            self.shard_pool.close()
+            self.shard_pool = None
+
+
+def init_worker(index_dir, block_cache_bytes=bc.BLOCK_CACHE_BYTES, manifest=None):
+    """Opens the index in a worker process of Searcher.search_batch
+
+    Args:
+        index_dir (str): Directory of the index
+        block_cache_bytes (int, optional): Byte budget of the cache of decoded posting blocks of the worker
+        manifest (dict, optional): Manifest of a segmented index, the workers search the same segments as the Searcher
+    """
+    global SEARCHER
+    # Rankings are cached by the Searcher that hands out the topics
+    SEARCHER = Searcher(index_dir, processes=1, cache_size=0, block_cache_bytes=block_cache_bytes, manifest=manifest)
+
+
+def search_topic(task, searcher=None):
+    """Searches one topic, run by the workers of Searcher.search_batch
+
+    Args:
+        task (str, str, int, function, dict): Topic number, query text, k, ranking function and its parameters
+        searcher (Searcher, optional): Searcher to use, defaults to the one of the worker
+
+    Returns:
+        (str, list of (float, int)): Topic number and ranking
+    """
+    num, query, k, scorer, params = task
+    return num, (searcher or SEARCHER).rank(query, k, scorer, params)
+
+
+def sweep_topic(task, searcher=None):
+    """Searches one topic for every point of a parameter grid, run by the workers of Searcher.sweep_batch
+
+    Args:
+        task (str, str, int, function, list of dict): Topic number, query text, k, ranking function and parameter grid
+        searcher (Searcher, optional): Searcher to use, defaults to the one of the worker
+
+    Returns:
+        (str, list of list of (float, int)): Topic number and ranking of each grid point
+    """
+    num, query, k, scorer, grid = task
+    return num, (searcher or SEARCHER).search_sweep(query, k, scorer, grid)
+
+
+def hybrid_topic(task, searcher=None):
+    """Searches one topic with several ranking functions, run by the workers of Searcher.hybrid_batch
+
+    Args:
+        task (str, str, int, list of dict, str, list of float): Topic number, query text, k,
+            parameters of each ranking function, fusion method and weights
+        searcher (Searcher, optional): Searcher to use, defaults to the one of the worker
+
+    Returns:
+        (str, (list of list of (float, int), list of (float, int))): Topic number, rankings and fused ranking
+    """
+    num, query, k, scorers, fusion, weights = task
+    return num, (searcher or SEARCHER).search_hybrid(query, k, scorers, fusion, weights)
+
+
+def cascade_topic(task, searcher=None):
+    """Searches one topic with cascade retrieval, run by the workers of Searcher.cascade_batch
+
+    Args:
+        task (str, str, int, dict, bool): Topic number, query text, k, parameters of the cascade and whether to
+            compute the recall of the first stage
+        searcher (Searcher, optional): Searcher to use, defaults to the one of the worker
+
+    Returns:
+        (str, (list of (float, int), float)): Topic number, ranking and recall of the first stage
+    """
+    num, query, k, argdict, recall = task
+    return num, (searcher or SEARCHER).search_cascade(query, k, argdict, recall)
+
+
+def impact_topic(task, searcher=None):
+    """Searches one topic score-at-a-time, run by the workers of Searcher.impact_batch
+
+    Args:
+        task (str, str, int, dict): Topic number, query text, k and budget
+        searcher (Searcher, optional): Searcher to use, defaults to the one of the worker
+
+    Returns:
+        (str, (list of (float, int), int, float)): Topic number, ranking, number of postings processed and latency
+    """
+    num, query, k, argdict = task
+    return num, (searcher or SEARCHER).search_impact(query, k, argdict)
+
+
+def write_ranking(file, num, ranking, index):
+    """Writes a ranking in TREC run format, or appends it to a binary run
+
+    Args:
+        file (file or RunWriter): Run file
+        num (str): Topic number
+        ranking (list of (float, int)): Score and doc number, best first
+        index (DiskIndex): Index the doc numbers refer to
+    """
+    if isinstance(file, rn.RunWriter):
+        file.add_ranking(num, ranking)
+        return
+    doc_ids = index.doc_id_list([doc_num for _, doc_num in ranking])
+    file.write(''.join(' '.join([num, 'Q0', doc_id, str(i), str(score), 'STANDARD\n'])
+                       for i, ((score, _), doc_id) in enumerate(zip(ranking, doc_ids))))
@@ -0,0 +1,551 @@
+"""Segmented index: new documents are added in batches as small immutable segments, which are searched together
+
+A segmented index is a directory with the files:
+    segments.json: the manifest, listing the segments in search order with their tombstones,
+        replaced atomically on every change, so readers always see a complete set of segments
+    seg_<id>/: one segment, an index written by disk_index.py with its documents in sorted doc_id order
+    seg_<id>/tombstones_<generation>.bin: doc numbers (uint32, ascending) of the deleted documents of the segment
+Segments are never modified after they are written. Deleting a document writes a new tombstone file,
+and adding a document with the doc_id of a live one deletes the old one, so documents can be updated.
+Tombstoned documents are dropped when their segment is merged.
+
+SegmentedIndex presents the live documents of all segments as one index, numbered segment by segment,
+so the retrieval strategies and the Searcher use it like a DiskIndex. Document and collection frequencies
+are computed from the live postings of a term, and the collection statistics from the live documents,
+so documents score the same as in one index of the live documents.
+
+Segments are compacted with a tiered merge policy: a segment is in tier t if it has MIN_SEGMENT_DOCS * MERGE_FACTOR**t
+or more live documents (and fewer than MERGE_FACTOR times that), MERGE_FACTOR segments of a tier are merged
+into one segment of the next tier, and a segment with MAX_DELETED_RATIO of its documents deleted is rewritten alone.
+Merges run outside the write lock, in a background process if wanted, and only the swap of the manifest is locked.
+One process at a time runs the merge policy, other processes skip merging while it holds the merge lock.
+Files a commit stops using are removed by the next commit, so a searcher opened on the previous manifest
+can still start its workers.
+
+Attributes:
+    LOCK_FILE (str): File locked by writers of the manifest
+    MERGE_LOCK_FILE (str): File locked by the process running maybe_merge
+    MANIFEST_FILE (str): Manifest of a segmented index
+    MAX_DELETED_RATIO (float): Fraction of deleted documents at which a segment is rewritten
+    MERGE_FACTOR (int): Number of segments of a tier merged into one segment of the next tier
+    MIN_SEGMENT_DOCS (int): Number of live documents of the lowest tier, smaller segments count as this size
+    TERM_MEMO_SIZE (int): Number of terms whose live postings a SegmentedIndex keeps
+"""
+import fcntl
+import heapq
+import json
+import os
+import shutil
+import uuid
+
+from collections import OrderedDict
+from itertools import groupby, repeat
+from multiprocessing import Process
+from operator import itemgetter
+
+import numpy as np
+
+import block_cache as bc
+import disk_index as di
+import postings as ps
+
+MANIFEST_FILE = 'segments.json'
+LOCK_FILE = 'write.lock'
+MERGE_LOCK_FILE = 'merge.lock'
+SEGMENT_PREFIX = 'seg_'
+MERGE_FACTOR = 10
+MIN_SEGMENT_DOCS = 1000
+MAX_DELETED_RATIO = 0.3
+TERM_MEMO_SIZE = 64
+
+
+class WriteLock:
+    """Exclusive lock on the manifest of a segmented index, across processes
+    """
+
+    def __init__(self, index_dir):
+        """
+        Args:
+            index_dir (str): Directory of the segmented index
+        """
+        os.makedirs(index_dir, exist_ok=True)
+        self.file = open(os.path.join(index_dir, LOCK_FILE), 'w')
+
+    def __enter__(self):
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+def is_segmented(index_dir):
+    """Whether a directory holds a segmented index
+    """
+    return os.path.exists(os.path.join(index_dir, MANIFEST_FILE))
+
+
+def read_manifest(index_dir):
+    """Reads the manifest of a segmented index
+
+    Returns:
+        dict: build_id, generation, segments (name, num_docs, num_deleted and tombstones of each segment,
+            in search order) and retired (files to remove with the next commit), empty for a new index
+    """
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return {'build_id': uuid.uuid4().hex, 'generation': 0, 'segments': [], 'retired': []}
+    with open(path) as file:
+        return json.load(file)
+
+
+def commit_manifest(index_dir, manifest, retired=()):
+    """Replaces the manifest of a segmented index, to be called with the WriteLock held
+
+    Args:
+        index_dir (str): Directory of the segmented index
+        manifest (dict): New manifest, as changed from read_manifest
+        retired (list of str): Paths, relative to index_dir, that the new manifest no longer uses
+    """
+    previously_retired = manifest.get('retired', [])
+    manifest['generation'] += 1
+    manifest['build_id'] = uuid.uuid4().hex
+    manifest['retired'] = list(retired)
+    path = os.path.join(index_dir, MANIFEST_FILE)
+    # Written under another name first, so readers never see a partial manifest
+    temp_path = path + '.' + str(os.getpid())
+    with open(temp_path, 'w') as file:
+        json.dump(manifest, file)
+    os.replace(temp_path, path)
+
+    for name in previously_retired:
+        retired_path = os.path.join(index_dir, name)
+        if os.path.isdir(retired_path):
+            shutil.rmtree(retired_path, ignore_errors=True)
+        elif os.path.exists(retired_path):
+            os.remove(retired_path)
+
+
+def read_tombstones(index_dir, segment):
+    """Doc numbers of the deleted documents of a segment
+
+    Args:
+        index_dir (str): Directory of the segmented index
+        segment (dict): Record of the segment in the manifest
+
+    Returns:
+        np.ndarray: Ascending doc numbers (int64) in the segment
+    """
+    if segment['tombstones'] is None:
+        return np.zeros(0, dtype=np.int64)
+    return np.fromfile(os.path.join(index_dir, segment['name'], segment['tombstones']), dtype='<u4').astype(np.int64)
+
+
+def add_tombstones(index_dir, manifest, doc_ids, retired, exclude=()):
+    """Deletes documents from the segments of a manifest, writing new tombstone files
+
+    Every doc_id is looked up in every segment, which is opened for it, so the cost (paid under the write lock)
+    grows linearly with the number of segments. The tiered merge policy keeps that number logarithmic
+    in the number of documents.
+
+    Args:
+        index_dir (str): Directory of the segmented index
+        manifest (dict): Manifest, its segment records are updated
+        doc_ids (list of str): doc_id of each document to delete, unknown ones are ignored
+        retired (list of str): Tombstone files that are replaced are appended to it
+        exclude (tuple of str, optional): Names of segments to leave alone
+
+    Returns:
+        int: Number of documents deleted
+    """
+    num_deleted = 0
+    for segment in manifest['segments']:
+        if segment['name'] in exclude:
+            continue
+        index = di.DiskIndex(os.path.join(index_dir, segment['name']))
+        doc_nums = [doc_num for doc_num in map(index.doc_num, doc_ids) if doc_num is not None]
+        tombstones = read_tombstones(index_dir, segment)
+        new_tombstones = np.union1d(tombstones, np.array(doc_nums, dtype=np.int64))
+        if len(new_tombstones) == len(tombstones):
+            continue
+        name = 'tombstones_' + str(manifest['generation'] + 1) + '.bin'
+        new_tombstones.astype('<u4').tofile(os.path.join(index_dir, segment['name'], name))
+        if segment['tombstones'] is not None:
+            retired.append(os.path.join(segment['name'], segment['tombstones']))
+        num_deleted += len(new_tombstones) - len(tombstones)
+        segment['tombstones'] = name
+        segment['num_deleted'] = len(new_tombstones)
+    return num_deleted
+
+
+def add_segment(index_dir, doc_ids, doc_lens, inverted_index):
+    """Writes a batch of documents as a new segment, documents with the doc_id of a live document replace it
+
+    Args:
+        index_dir (str): Directory of the segmented index, created if needed
+        doc_ids (list of str): doc_id of each document, indexed by doc number in indexing order
+        doc_lens (array): Length of each document, indexed by doc number in indexing order
+        inverted_index (dict): term - (doc numbers, term frequencies) in indexing order, see build_index.add_document
+
+    Returns:
+        str: Name of the segment
+    """
+    doc_table, doc_lens, inverted_index = ps.sort_doc_numbers(doc_ids, doc_lens, inverted_index)
+    name = SEGMENT_PREFIX + uuid.uuid4().hex
+    di.write_index(os.path.join(index_dir, name), doc_table, doc_lens, inverted_index)
+
+    with WriteLock(index_dir):
+        manifest = read_manifest(index_dir)
+        retired = []
+        add_tombstones(index_dir, manifest, doc_table, retired)
+        manifest['segments'].append({'name': name, 'num_docs': len(doc_table), 'num_deleted': 0, 'tombstones': None})
+        commit_manifest(index_dir, manifest, retired)
+    return name
+
+
+def delete_documents(index_dir, doc_ids):
+    """Deletes documents from a segmented index with tombstones
+
+    Args:
+        index_dir (str): Directory of the segmented index
+        doc_ids (list of str): doc_id of each document to delete, unknown ones are ignored
+
+    Returns:
+        int: Number of documents deleted
+    """
+    with WriteLock(index_dir):
+        manifest = read_manifest(index_dir)
+        retired = []
+        num_deleted = add_tombstones(index_dir, manifest, doc_ids, retired)
+        if num_deleted:
+            commit_manifest(index_dir, manifest, retired)
+    return num_deleted
+
+
+def segment_tier(segment):
+    """Tier of a segment in the merge policy, from its number of live documents
+    """
+    live_docs = max(segment['num_docs'] - segment['num_deleted'], MIN_SEGMENT_DOCS)
+    tier = 0
+    while live_docs >= MIN_SEGMENT_DOCS * MERGE_FACTOR ** (tier + 1):
+        tier += 1
+    return tier
+
+
+def find_merges(manifest):
+    """Segments to merge according to the tiered merge policy
+
+    Args:
+        manifest (dict): Manifest of the segmented index
+
+    Returns:
+        list of list of str: Names of the segments of each merge, every segment is in at most one merge
+    """
+    tiers = {}
+    for segment in manifest['segments']:
+        tiers.setdefault(segment_tier(segment), []).append(segment)
+
+    merges = []
+    for tier in sorted(tiers):
+        segments = sorted(tiers[tier], key=lambda segment: segment['num_docs'] - segment['num_deleted'])
+        for start in range(0, len(segments) - MERGE_FACTOR + 1, MERGE_FACTOR):
+            merges.append([segment['name'] for segment in segments[start:start + MERGE_FACTOR]])
+
+    merged = set(name for names in merges for name in names)
+    for segment in manifest['segments']:
+        if segment['name'] not in merged and segment['num_deleted'] >= MAX_DELETED_RATIO * segment['num_docs']:
+            merges.append([segment['name']])
+    return merges
+
+
+def merge_segments(index_dir, names):
+    """Merges segments into one, leaving out their deleted documents
+
+    The merged segment is written without holding the lock. Documents deleted from the segments meanwhile
+    are deleted from the merged segment when it replaces them in the manifest.
+
+    Args:
+        index_dir (str): Directory of the segmented index
+        names (list of str): Names of the segments to merge
+
+    Returns:
+        str: Name of the merged segment, None if it has no documents or a segment is not (or no longer)
+            in the manifest
+    """
+    manifest = read_manifest(index_dir)
+    segments = [segment for segment in manifest['segments'] if segment['name'] in names]
+    if len(segments) < len(set(names)):
+        return None
+    indexes = [di.DiskIndex(os.path.join(index_dir, segment['name'])) for segment in segments]
+    tombstones = [read_tombstones(index_dir, segment) for segment in segments]
+
+    # Position of each live document in the concatenated doc table of the segments, -1 for deleted ones
+    doc_ids = []
+    doc_lens = []
+    positions = []
+    for index, deleted in zip(indexes, tombstones):
+        live = np.ones(index.num_docs, dtype=bool)
+        live[deleted] = False
+        live_docs = np.flatnonzero(live)
+        doc_positions = np.full(index.num_docs, -1, dtype=np.int64)
+        doc_positions[live_docs] = len(doc_ids) + np.arange(len(live_docs))
+        positions.append(doc_positions)
+        doc_ids.extend(index.doc_id_list(live_docs))
+        doc_lens.append(index.doc_lens[live_docs])
+
+    name = None
+    if doc_ids:
+        name = SEGMENT_PREFIX + uuid.uuid4().hex
+        order, new_nums = ps.sorted_doc_numbers(doc_ids)
+        doc_table = [doc_ids[i] for i in order]
+        with di.IndexWriter(os.path.join(index_dir, name), indexes[0].codec, indexes[0].block_size) as writer:
+            writer.write_docs(doc_table, np.concatenate(doc_lens)[order])
+            terms = heapq.merge(*[zip(index.terms_iter(), repeat(i)) for i, index in enumerate(indexes)])
+            for term, term_segments in groupby(terms, key=itemgetter(0)):
+                doc_nums, freqs = [], []
+                for _, i in term_segments:
+                    gaps, term_freqs = indexes[i].postings(term)
+                    term_positions = positions[i][np.cumsum(gaps, dtype=np.int64)]
+                    live = term_positions >= 0
+                    doc_nums.append(term_positions[live])
+                    freqs.append(term_freqs[live])
+                doc_nums = np.concatenate(doc_nums).astype(np.uint32)
+                if len(doc_nums):
+                    writer.add_term(term, ps.renumber_postings(doc_nums, np.concatenate(freqs).astype(np.uint32), new_nums))
+
+    with WriteLock(index_dir):
+        manifest = read_manifest(index_dir)
+        current = {segment['name']: segment for segment in manifest['segments']}
+        if not all(segment['name'] in current for segment in segments):
+            if name is not None:
+                shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+            return None
+
+        retired = [segment['name'] for segment in segments]
+        deleted_ids = []
+        for segment, index, deleted in zip(segments, indexes, tombstones):
+            newly_deleted = np.setdiff1d(read_tombstones(index_dir, current[segment['name']]), deleted)
+            deleted_ids.extend(index.doc_id_list(newly_deleted))
+        first = [segment['name'] for segment in manifest['segments']].index(segments[0]['name'])
+        merged_segments = [segment for segment in manifest['segments'] if segment['name'] not in names]
+        if name is not None:
+            merged_segments.insert(first, {'name': name, 'num_docs': len(doc_ids), 'num_deleted': 0, 'tombstones': None})
+        manifest['segments'] = merged_segments
+        if name is not None and deleted_ids:
+            add_tombstones(index_dir, manifest, deleted_ids, retired,
+                           exclude=tuple(segment['name'] for segment in merged_segments if segment['name'] != name))
+        commit_manifest(index_dir, manifest, retired)
+    return name
+
+
+def maybe_merge(index_dir):
+    """Merges segments until the tiered merge policy finds nothing to merge.
+       Returns at once if another process is merging, that process picks up the new segments
+
+    Args:
+        index_dir (str): Directory of the segmented index
+
+    Returns:
+        int: Number of merges
+    """
+    with open(os.path.join(index_dir, MERGE_LOCK_FILE), 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return 0
+        num_merges = 0
+        merges = find_merges(read_manifest(index_dir))
+        while merges:
+            for names in merges:
+                if merge_segments(index_dir, names) is not None:
+                    num_merges += 1
+            merges = find_merges(read_manifest(index_dir))
+        return num_merges
+
+
+def merge_in_background(index_dir):
+    """Runs maybe_merge in a separate process, searches and new segments can continue meanwhile
+
+    Args:
+        index_dir (str): Directory of the segmented index
+
+    Returns:
+        Process: The merging process, join it to wait for the merges
+    """
+    process = Process(target=maybe_merge, args=(index_dir,))
+    process.start()
+    return process
+
+
+class SegmentedIndex:
+    """Read-only view on the segments of a manifest, with the live documents numbered segment by segment
+
+    Attributes:
+        index_dir (str): Directory of the segmented index
+        manifest (dict): Manifest the segments were opened from
+        build_id (str): Identifies this set of segments, changes with every commit of the manifest
+        segments (list of DiskIndex): Segments in search order
+        doc_nums (list of np.ndarray): Doc number in this index of each document of each segment, -1 if deleted
+        live_docs (list of np.ndarray): Doc number in its segment of each live document of each segment
+        bases (np.ndarray): Doc number of the first live document of each segment
+        num_docs (int): Number of live documents
+        num_tokens (int): Number of terms in the live documents
+        avg_doc_len (float): Average length of the live documents
+        doc_lens (np.ndarray): Length of each live document, indexed by doc number
+        memo (OrderedDict): term - live postings (doc numbers, term frequencies) of recently used terms
+    """
+
+    def __init__(self, index_dir, block_cache_bytes=0, manifest=None):
+        """Opens the segments of a segmented index
+
+        Args:
+            index_dir (str): Directory of the segmented index
+            block_cache_bytes (int, optional): Byte budget of the caches of decoded posting blocks,
+                shared out over the segments by their number of documents, 0 for none
+            manifest (dict, optional): Manifest to open, defaults to the current one
+        """
+        self.index_dir = index_dir
+        self.manifest = manifest if manifest is not None else read_manifest(index_dir)
+        self.build_id = self.manifest['build_id']
+        total_docs = sum(segment['num_docs'] for segment in self.manifest['segments'])
+
+        self.segments = []
+        self.doc_nums = []
+        self.live_docs = []
+        bases = []
+        doc_lens = []
+        self.num_docs = 0
+        for segment in self.manifest['segments']:
+            cache_bytes = block_cache_bytes * segment['num_docs'] // max(total_docs, 1)
+            index = di.DiskIndex(os.path.join(index_dir, segment['name']), bc.BlockCache(cache_bytes) if cache_bytes else None)
+            live = np.ones(index.num_docs, dtype=bool)
+            live[read_tombstones(index_dir, segment)] = False
+            live_docs = np.flatnonzero(live)
+            doc_nums = np.full(index.num_docs, -1, dtype=np.int64)
+            doc_nums[live_docs] = self.num_docs + np.arange(len(live_docs))
+            self.segments.append(index)
+            self.doc_nums.append(doc_nums)
+            self.live_docs.append(live_docs)
+            bases.append(self.num_docs)
+            doc_lens.append(index.doc_lens[live_docs])
+            self.num_docs += len(live_docs)
+        self.bases = np.array(bases, dtype=np.int64)
+        self.doc_lens = np.concatenate(doc_lens).astype('<u4') if doc_lens else np.zeros(0, dtype='<u4')
+        self.num_tokens = int(self.doc_lens.sum(dtype=np.int64))
+        self.avg_doc_len = float(self.doc_lens.mean()) if self.num_docs else 0.0
+        self.memo = OrderedDict()
+
+    def live_postings(self, term):
+        """Postings of a term in the live documents of all segments
+
+        Returns:
+            (np.ndarray, np.ndarray): Ascending doc numbers (int64) and term frequencies, empty if no live
+                document contains the term
+        """
+        if term in self.memo:
+            self.memo.move_to_end(term)
+            return self.memo[term]
+        doc_nums, freqs = [], []
+        for index, segment_doc_nums in zip(self.segments, self.doc_nums):
+            if term not in index:
+                continue
+            gaps, term_freqs = index.postings(term)
+            term_doc_nums = segment_doc_nums[np.cumsum(gaps, dtype=np.int64)]
+            live = term_doc_nums >= 0
+            doc_nums.append(term_doc_nums[live])
+            freqs.append(term_freqs[live])
+        if doc_nums:
+            postings = np.concatenate(doc_nums), np.concatenate(freqs).astype(np.uint32)
+        else:
+            postings = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint32)
+        self.memo[term] = postings
+        while len(self.memo) > TERM_MEMO_SIZE:
+            self.memo.popitem(last=False)
+        return postings
+
+    def __contains__(self, term):
+        return len(self.live_postings(term)[0]) > 0
+
+    def postings(self, term):
+        """Gap-encoded postings of a term in the live documents, see DiskIndex.postings
+
+        Raises:
+            KeyError: If no live document contains the term
+        """
+        doc_nums, freqs = self.live_postings(term)
+        if not len(doc_nums):
+            raise KeyError(term)
+        return np.diff(doc_nums, prepend=0).astype(np.uint32), freqs
+
+    __getitem__ = postings
+
+    def doc_freq(self, term):
+        """Number of live documents containing the term
+        """
+        return len(self.live_postings(term)[0])
+
+    def collection_freq(self, term):
+        """Total number of occurences of the term in the live documents
+        """
+        return int(self.live_postings(term)[1].sum(dtype=np.int64))
+
+    def collection_stats(self):
+        """Collection statistics of the live documents used by the ranking functions
+
+        Returns:
+            dict: num_docs, num_tokens and avg_doc_len
+        """
+        return {'num_docs': self.num_docs, 'num_tokens': self.num_tokens, 'avg_doc_len': self.avg_doc_len}
+
+    def doc_id(self, doc_num):
+        """doc_id string of a document number
+        """
+        return self.doc_id_list([doc_num])[0]
+
+    def doc_num(self, doc_id):
+        """Number of a live document
+
+        Returns:
+            int: Number of the document, None if there is no live document with this doc_id
+        """
+        for index, doc_nums in zip(self.segments, self.doc_nums):
+            segment_doc_num = index.doc_num(doc_id)
+            if segment_doc_num is not None and doc_nums[segment_doc_num] >= 0:
+                return int(doc_nums[segment_doc_num])
+        return None
+
+    def doc_id_list(self, doc_nums):
+        """doc_id strings of many document numbers
+
+        Args:
+            doc_nums (list of int): Document numbers
+
+        Returns:
+            list of str: doc_id of each document
+        """
+        doc_nums = np.asarray(doc_nums, dtype=np.int64)
+        segment_nums = np.searchsorted(self.bases, doc_nums, side='right') - 1
+        doc_ids = [None] * len(doc_nums)
+        for i in np.unique(segment_nums).tolist():
+            selected = np.flatnonzero(segment_nums == i)
+            segment_doc_ids = self.segments[i].doc_id_list(self.live_docs[i][doc_nums[selected] - self.bases[i]])
+            for j, doc_id in zip(selected.tolist(), segment_doc_ids):
+                doc_ids[j] = doc_id
+        return doc_ids
+
+
+def open_index(index_dir, block_cache_bytes=0, manifest=None):
+    """Opens a segmented index or a single on-disk index, whichever the directory holds
+
+    Args:
+        index_dir (str): Directory of the index
+        block_cache_bytes (int, optional): Byte budget of the cache of decoded posting blocks, 0 for none
+        manifest (dict, optional): Manifest of a segmented index to open, defaults to the current one
+
+    Returns:
+        SegmentedIndex or DiskIndex: Index
+    """
+    if is_segmented(index_dir):
+        return SegmentedIndex(index_dir, block_cache_bytes, manifest)
+    return di.DiskIndex(index_dir, bc.BlockCache(block_cache_bytes) if block_cache_bytes else None)
@@ -0,0 +1,278 @@
+"""Document-partitioned search: the documents of an index are split into doc-range shards,
+each searched by its own worker process
+
+A shard is a range [start, end) of doc numbers of an on-disk index. Its worker opens the index with mmap and only
+decodes the blocks of postings that overlap its range (see ShardIndex), numbered from the start of the range,
+so the retrieval strategies search it like a small index. Document and collection frequencies come from the lexicon
+of the whole index, and the collection statistics from its metadata, so every document gets the same score
+as in the unsharded index. The coordinator sends each query to all shards (scatter) and heap-merges their top k
+on score and doc number (gather). The strategies break ties on the highest doc number as well, so the merged ranking
+is identical to the ranking of the unsharded index.
+
+Attributes:
+    SHARD_WINDOW (int): Number of queries sent to a shard before the first results are read back
+"""
+import heapq
+import os
+import traceback
+
+from itertools import islice
+from multiprocessing import Pipe, Process
+
+import numpy as np
+
+import block_cache as bc
+import disk_index as di
+import postings as ps
+import ranking as rk
+import text_manipulation as tm
+
+SHARD_WINDOW = 4
+
+
+def shard_ranges(num_docs, num_shards):
+    """Splits the doc numbers of an index into ranges of (almost) equal numbers of documents
+
+    Returns:
+        list of (int, int): Start and end of each shard
+    """
+    bounds = [num_docs * i // num_shards for i in range(num_shards + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+class ShardIndex:
+    """View on a doc-range of an on-disk index, with the global term statistics
+
+    Attributes:
+        index (DiskIndex): Index of the whole collection
+        start (int): First doc number of the shard
+        end (int): Doc number after the last one of the shard
+        doc_lens (np.ndarray): Length of each document of the shard, indexed by doc number minus start
+    """
+
+    def __init__(self, index, start, end):
+        """
+        Args:
+            index (DiskIndex): Index of the whole collection
+            start (int): First doc number of the shard
+            end (int): Doc number after the last one of the shard
+        """
+        self.index = index
+        self.start = start
+        self.end = end
+        self.doc_lens = index.doc_lens[start:end]
+
+    def __contains__(self, term):
+        return term in self.index
+
+    def postings(self, term):
+        """Gap-encoded postings of a term in the shard, doc numbers counted from the start of the shard,
+        decoded from the blocks that overlap the shard
+
+        Returns:
+            (np.ndarray, np.ndarray): Doc gaps and term frequencies, empty if no document of the shard has the term
+        """
+        lasts = self.index.block_table(term)['last_doc'].astype(np.int64)
+        first = int(np.searchsorted(lasts, self.start))
+        stop = min(int(np.searchsorted(lasts, self.end)) + 1, len(lasts))
+        doc_nums, freqs = self.index.block_range(term, first, stop)
+        in_shard = (doc_nums >= self.start) & (doc_nums < self.end)
+        gaps = np.diff(doc_nums[in_shard] - self.start, prepend=0).astype(np.uint32)
+        return gaps, freqs[in_shard].astype(np.uint32)
+
+    __getitem__ = postings
+
+    def doc_freq(self, term):
+        """Number of documents of the whole collection containing the term
+        """
+        return self.index.doc_freq(term)
+
+    def collection_freq(self, term):
+        """Total number of occurences of the term in the whole collection
+        """
+        return self.index.collection_freq(term)
+
+
+def serve_shard(index_dir, start, end, block_cache_bytes, connection):
+    """Searches queries on one shard until it receives None, run by the worker process of the shard
+
+    Args:
+        index_dir (str): Directory of the index
+        start (int): First doc number of the shard
+        end (int): Doc number after the last one of the shard
+        block_cache_bytes (int): Byte budget of the cache of decoded posting blocks of the worker, 0 for none
+        connection (Connection): Receives (query, k, ranking function, parameters), sends back the rankings
+            with doc numbers of the whole index, or the error of a failed search
+    """
+    index = di.DiskIndex(index_dir, bc.BlockCache(block_cache_bytes) if block_cache_bytes else None)
+    stats = index.collection_stats()
+    if not len(tm.STEM_CACHE):
+        tm.STEM_CACHE.load(os.path.join(index_dir, tm.STEM_CACHE_FILE))
+    shard = ShardIndex(index, start, end)
+    doc_len_index = memoryview(np.ascontiguousarray(shard.doc_lens)).cast('B').cast(ps.TYPECODE)
+    while True:
+        task = connection.recv()
+        if task is None:
+            break
+        try:
+            query, k, scorer, params = task
+            retrieve = rk.RETRIEVAL_STRATEGIES[params.get('strategy', 'exhaustive')]
+            inv_idx, doc_freq_idx, term_freq_idx = rk.filter_disk_index(shard, tm.process_text(query))
+            results = {}
+            retrieve(k, query, scorer, inv_idx, doc_freq_idx, doc_len_index, term_freq_idx, results, query,
+                     rk.with_stats(params, stats))
+            ranking = [(score, doc_num + start) for score, doc_num in results[query]]
+        except Exception:
+            # Raised by the coordinator, the worker keeps serving the next queries
+            ranking = RuntimeError('Search failed on shard {}-{}:\n{}'.format(start, end, traceback.format_exc()))
+        connection.send(ranking)
+    connection.close()
+
+
+def merge_rankings(rankings, k):
+    """Merges the top k of each shard into the top k of the collection
+
+    Args:
+        rankings (list of list of (float, int)): Ranking of each shard, best first
+        k (int): Number of documents to keep
+
+    Returns:
+        list of (float, int): Score and doc number of the top k documents, best first
+    """
+    return list(islice(heapq.merge(*rankings, reverse=True), k))
+
+
+def check_responses(responses):
+    """Raises the first error among the responses of the shards to a query
+
+    Args:
+        responses (list): Ranking of each shard, or the error of a failed search, see serve_shard
+
+    Returns:
+        list of list of (float, int): Ranking of each shard
+
+    Raises:
+        RuntimeError: If the search failed on a shard
+    """
+    for response in responses:
+        if isinstance(response, Exception):
+            raise response
+    return responses
+
+
+class ShardPool:
+    """Worker process of each shard of an index, and the coordinator that scatters queries and gathers rankings
+
+    Attributes:
+        ranges (list of (int, int)): Doc range of each shard
+        processes (list of Process): Worker process of each shard
+        connections (list of Connection): Connection to the worker of each shard
+    """
+
+    def __init__(self, index_dir, num_shards, block_cache_bytes=bc.BLOCK_CACHE_BYTES):
+        """Starts a worker for each shard
+
+        Args:
+            index_dir (str): Directory of the index
+            num_shards (int): Number of doc-range shards
+            block_cache_bytes (int, optional): Byte budget of the cache of decoded posting blocks of each worker
+        """
+        self.ranges = shard_ranges(di.DiskIndex(index_dir).num_docs, num_shards)
+        self.processes = []
+        self.connections = []
+        for start, end in self.ranges:
+            connection, worker_connection = Pipe()
+            process = Process(target=serve_shard, args=(index_dir, start, end, block_cache_bytes, worker_connection),
+                              daemon=True)
+            process.start()
+            worker_connection.close()
+            self.processes.append(process)
+            self.connections.append(connection)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def search(self, query, k=1000, scorer=rk.bm25, params={}):
+        """Retrieves the ordered top k documents for a query from all shards
+
+        Args:
+            query (str): Query text
+            k (int, optional): Number of documents to retrieve
+            scorer (function): Ranking function, e.g. ranking.bm25
+            params (dict, optional): Parameters for the ranking function, see Searcher.search
+
+        Returns:
+            list of (float, int): Score and doc number of the top k documents, best first
+
+        Raises:
+            RuntimeError: If the search failed on a shard
+        """
+        for connection in self.connections:
+            connection.send((query, k, scorer, params))
+        return merge_rankings(self.gather(), k)
+
+    def search_many(self, tasks):
+        """Searches a sequence of queries, keeping up to SHARD_WINDOW queries in flight on every shard
+
+        Args:
+            tasks (list of (str, str, int, function, dict)): Topic number, query text, k, ranking function
+                and its parameters
+
+        Yields:
+            (str, list of (float, int)): Topic number and ranking, in the order of the tasks
+
+        Raises:
+            RuntimeError: If the search of a query failed on a shard
+        """
+        sent = received = 0
+        try:
+            for task in tasks[:SHARD_WINDOW]:
+                for connection in self.connections:
+                    connection.send(task[1:])
+                sent += 1
+            for num, _, k, _, _ in tasks:
+                responses = self.gather(check=False)
+                received += 1
+                if sent < len(tasks):
+                    for connection in self.connections:
+                        connection.send(tasks[sent][1:])
+                    sent += 1
+                yield num, merge_rankings(check_responses(responses), k)
+        finally:
+            # Rankings of queries still in flight after an error or an early exit, read so the next search
+            # gets its own rankings
+            for _ in range(received, sent):
+                self.gather(check=False)
+
+    def gather(self, check=True):
+        """Receives the ranking of the next query from every shard
+
+        Args:
+            check (bool, optional): Raise the error of a shard whose search failed
+
+        Returns:
+            list of list of (float, int): Ranking of each shard
+
+        Raises:
+            RuntimeError: If the search failed on a shard
+        """
+        responses = [connection.recv() for connection in self.connections]
+        return check_responses(responses) if check else responses
+
+    def close(self):
+        """Stops the workers
+        """
+        for connection in self.connections:
+            try:
+                connection.send(None)
+            except OSError:
+                # The worker already exited
+                pass
+            connection.close()
+        for process in self.processes:
+            process.join()
+        self.connections = []
+        self.processes = []
@@ -1,13 +1,23 @@
 """Text manipulation methods and attributes used to parse TREC data
 
 Attributes:
+    ANALYZER (Analyzer): Analyzer used by process_text
+    CHUNK_SIZE (int): Number of characters read at a time by read_trec_documents
+    CONTRACTIONS_REGEX (re): Regex that splits the contractions word_tokenize splits, on text without punctuation
     EXTRA_STOP_WORDS (list of str): Manually added stopwords for STOP_WORDS
+    HTML_UNESCAPE_REGEX (re): Regex that matches the keys of HTML_UNESCAPE_TABLE
     HTML_UNESCAPE_TABLE (dict): HTML Character references to unescape
     PUNCT_REGEX (re): Regex that removes punctuation
+    TOKENIZER_PADDED (str): Characters word_tokenize splits off as separate tokens, when there is no punctuation
+    STEM_CACHE (CachedStemmer): Cached Porter stemmer used by stop_and_stem and ANALYZER
+    STEM_CACHE_FILE (str): File name of the stem cache stored in an index directory
+    STEM_CACHE_SIZE (int): Maximum number of cached stems
     STEMMER (stemmer): Porter stemmer
     STOP_WORDS (list of str): Stopwords to remove
 """
 import collections
+import os
+import _pickle as pickle
 import re
 import string
 # import nltk
@@ -65,8 +75,18 @@ HTML_UNESCAPE_TABLE = {
     "&uuml;": "u",
 }
 
+HTML_UNESCAPE_REGEX = re.compile("|".join(re.escape(k) for k in HTML_UNESCAPE_TABLE))
+
 PUNCT_REGEX = re.compile('[%s]' % re.escape(string.punctuation + "1234567890"))
 
+STEM_CACHE_FILE = 'stem_cache.pkl'
+STEM_CACHE_SIZE = 1 << 21
+
+# Quotes and dashes padded by nltk's NLTKWordTokenizer, the rest of its rules need ASCII punctuation
+TOKENIZER_PADDED = "«“‘„»”’\u2012\u2013\u2014\u2015"
+# Contractions NLTKWordTokenizer splits that contain no apostrophe, e.g. cannot -> can not
+CONTRACTIONS_REGEX = re.compile(r"\b(can(?=not\b)|gim(?=me\b)|gon(?=na\b)|got(?=ta\b)|lem(?=me\b)|wan(?=na(?:\s|$)))(\w+)", re.I)
+
 EXTRA_STOP_WORDS = [
     "the",
     "also",
@@ -77,6 +97,8 @@ EXTRA_STOP_WORDS = [
 
 STEMMER = PorterStemmer()
 
+CHUNK_SIZE = 1 << 20
+
 def html_unescape(text):
     """Unescapes HTML character references from HTML_UNESCAPE_TABLE
 
@@ -86,9 +108,7 @@ def html_unescape(text):
     Returns:
         str: Text with referenced characters
     """
-    rep = dict((re.escape(k), v) for k, v in HTML_UNESCAPE_TABLE.items())
-    pattern = re.compile("|".join(rep.keys()))
-    return pattern.sub(lambda m: rep[re.escape(m.group(0))], text)
+    return HTML_UNESCAPE_REGEX.sub(lambda m: HTML_UNESCAPE_TABLE[m.group(0)], text)
 
 
 def remove_punctuation(text):
@@ -129,7 +149,149 @@ def stop_and_stem(bow):
     Deleted Parameters:
         bag_of_words (list of str): Terms to be stopped and stemmed
     """
-    return [STEMMER.stem(t) for t in bow if t not in STOP_WORDS]
+    return [STEM_CACHE.stem(t) for t in bow if t not in STOP_WORDS]
+
+class CachedStemmer:
+    """Stemmer that remembers the stem of every surface form it has stemmed,
+    so each distinct word is only stemmed once. Once max_size words are cached,
+    new words are stemmed without being cached
+
+    Attributes:
+        cache (dict): Surface form - stem
+        max_size (int): Maximum number of cached stems
+        new_words (list of str): Words cached since the last call to take_new
+        stemmer (stemmer): Stemmer with a stem method
+    """
+
+    def __init__(self, stemmer=STEMMER, max_size=STEM_CACHE_SIZE):
+        """
+        Args:
+            stemmer (stemmer, optional): Stemmer with a stem method
+            max_size (int, optional): Maximum number of cached stems
+        """
+        self.stemmer = stemmer
+        self.max_size = max_size
+        self.cache = {}
+        self.new_words = []
+
+    def __len__(self):
+        return len(self.cache)
+
+    def stem(self, word):
+        """Stem of a word, from the cache if it was stemmed before
+
+        Args:
+            word (str): Surface form
+
+        Returns:
+            str: Stem
+        """
+        stem = self.cache.get(word)
+        if stem is None:
+            stem = self.stemmer.stem(word)
+            if len(self.cache) < self.max_size:
+                self.cache[word] = stem
+                self.new_words.append(word)
+        return stem
+
+    def take_new(self):
+        """Returns the stems cached since the last call, used to collect the stems of worker processes
+
+        Returns:
+            dict: Surface form - stem
+        """
+        new_stems = {word: self.cache[word] for word in self.new_words}
+        self.new_words = []
+        return new_stems
+
+    def update(self, stems):
+        """Adds stems to the cache, up to max_size
+
+        Args:
+            stems (dict): Surface form - stem
+        """
+        for word, stem in stems.items():
+            if len(self.cache) >= self.max_size:
+                break
+            self.cache.setdefault(word, stem)
+
+    def save(self, path):
+        """Pickles the cache
+
+        Args:
+            path (str): File to write the cache to
+        """
+        with open(path, 'wb') as file:
+            pickle.dump(self.cache, file)
+
+    def load(self, path):
+        """Adds the stems of a pickled cache, if the file exists
+
+        Args:
+            path (str): File written by save
+
+        Returns:
+            bool: Whether the file exists
+        """
+        if not os.path.exists(path):
+            return False
+        with open(path, 'rb') as file:
+            self.update(pickle.load(file))
+        return True
+
+STEM_CACHE = CachedStemmer()
+
+class Analyzer:
+    """Reusable text analysis pipeline, gives token-for-token the same terms as
+    stop_and_stem(bag_of_words(remove_punctuation(html_unescape(text))))
+    in one regex pass for the character references, one str.translate pass for punctuation,
+    and a whitespace split instead of nltk word_tokenize
+
+    Attributes:
+        stem (function): Stemming function
+        stop_words (frozenset of str): Stopwords to remove
+        translate_table (dict): Character - replacement, removes punctuation and pads TOKENIZER_PADDED
+    """
+
+    def __init__(self, stop_words=STOP_WORDS, stemmer=STEMMER):
+        """
+        Args:
+            stop_words (list of str, optional): Stopwords to remove
+            stemmer (stemmer, optional): Stemmer with a stem method
+        """
+        self.stop_words = frozenset(stop_words)
+        self.stem = stemmer.stem
+        self.translate_table = {ord(c): ' ' for c in string.punctuation + "1234567890"}
+        self.translate_table.update({ord(c): ' ' + c + ' ' for c in TOKENIZER_PADDED})
+
+    def tokenize(self, text):
+        """Converts input text to lowercase list of terms, without punctuation
+
+        Args:
+            text (str): Text
+
+        Returns:
+            list of str: Terms
+        """
+        if '&' in text:
+            text = html_unescape(text)
+        text = text.translate(self.translate_table).lower()
+        return CONTRACTIONS_REGEX.sub(r' \1 \2 ', text).split()
+
+    def analyze(self, text):
+        """Converts input text to list of processed terms
+
+        Args:
+            text (str): Text to be processed
+
+        Returns:
+            list of str: Processed terms
+        """
+        stop_words = self.stop_words
+        stem = self.stem
+        return [stem(t) for t in self.tokenize(text) if t not in stop_words]
+
+ANALYZER = Analyzer(stemmer=STEM_CACHE)
 
 def process_text(text):
     """Converts input text to list of processed terms
@@ -140,7 +302,7 @@ def process_text(text):
     Returns:
         list of str: Processed terms
     """
-    return stop_and_stem(bag_of_words(remove_punctuation(html_unescape(text))))
+    return ANALYZER.analyze(text)
 
 def to_frequency_pairs(terms):
     """Converts terms to frequency pairs
@@ -168,3 +330,65 @@ def get_blocks(text, tag, extra_space=1):
     offset = 2 + extra_space
     all_blocks = re.findall(r'(<' + tag + r'>((?!<\/DOC>)[\s\S])*<\/' + tag + '>)', text)
     return [b[0][len(tag)+offset:-len(tag)-offset-1] for b in all_blocks]
+
+
+def parse_trec_document(doc, extra_space=1):
+    """Extracts the doc_id and text of one TREC document, gives the same result as get_blocks
+    (text from the first <TEXT> to the last </TEXT>, without the lines starting with a tag)
+
+    Args:
+        doc (str): Contents of a DOC block
+        extra_space (bool, optional): Whether to remove an extra space around the doc_id
+
+    Returns:
+        (str, str): doc_id and text, None if the document has no DOCNO or TEXT block
+    """
+    text_start = doc.find('<TEXT>')
+    text_end = doc.rfind('</TEXT>')
+    if text_start == -1 or text_end < text_start + len('<TEXT>'):
+        return None
+    doc_no_start = doc.find('<DOCNO>')
+    doc_no_end = doc.rfind('</DOCNO>')
+    if doc_no_start == -1 or doc_no_end < doc_no_start + len('<DOCNO>'):
+        return None
+
+    doc_id = doc[doc_no_start + len('<DOCNO>') + extra_space:doc_no_end - extra_space]
+    text_lines = doc[text_start + len('<TEXT>'):text_end].split('\n')
+    text = '\n'.join([line for line in text_lines if not line.startswith('<')])
+    return doc_id, text
+
+def read_trec_documents(file_path, extra_space=1, chunk_size=CHUNK_SIZE):
+    """Streams the documents of a file of TREC data, scanning the file once in chunks
+
+    Args:
+        file_path (str): Path of the file
+        extra_space (bool, optional): Whether to remove an extra space around the doc_id,
+            0 for FT, 1 for the other collections
+        chunk_size (int, optional): Number of characters to read at a time
+
+    Yields:
+        (str, str): doc_id and text of each document with a TEXT block
+    """
+    with open(file_path, 'r', encoding='latin-1') as file:
+        buffer = ''
+        pos = 0
+        eof = False
+        while True:
+            start = buffer.find('<DOC>', pos)
+            end = buffer.find('</DOC>', start + len('<DOC>')) if start != -1 else -1
+            if end == -1:
+                if eof:
+                    return
+                chunk = file.read(chunk_size)
+                eof = not chunk
+                # Keep the unfinished document, or what could be the start of a split <DOC> tag
+                keep = start if start != -1 else max(len(buffer) - len('<DOC>') + 1, pos)
+                buffer = buffer[keep:] + chunk
+                pos = 0
+                continue
+
+            # Same as get_blocks(data, 'DOC'), without the tags and the character after/before them
+            document = parse_trec_document(buffer[start + len('<DOC>') + 1:end - 1], extra_space)
+            pos = end + len('</DOC>')
+            if document:
+                yield document
@@ -0,0 +1,76 @@
+"""Synthetic corpus and indexes shared by the tests, run with python -m pytest tests from the repository root
+"""
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import disk_index as di
+import postings as ps
+import text_manipulation as tm
+
+VOCABULARY = ['apple', 'river', 'stone', 'cloud', 'garden', 'engine', 'silver', 'forest', 'window', 'market',
+              'candle', 'bridge', 'planet', 'harbor', 'violin', 'desert', 'meadow', 'rocket', 'castle', 'lantern',
+              'pepper', 'glacier', 'thunder', 'compass', 'orchard', 'tunnel', 'island', 'mirror', 'copper', 'falcon']
+NUM_DOCS = 700
+
+
+def make_docs(num_docs=NUM_DOCS, seed=7, prefix='DOC'):
+    """Documents of random length with a skewed term distribution, including empty ones
+
+    Returns:
+        list of (str, str): doc_id and text of each document, doc_ids out of sorted order
+    """
+    rnd = random.Random(seed)
+    docs = []
+    for i in range(num_docs):
+        length = rnd.choice([0, 1, 3]) if i % 50 == 0 else rnd.randint(2, 80)
+        words = [VOCABULARY[min(int(rnd.paretovariate(0.8)) - 1, len(VOCABULARY) - 1)] for _ in range(length)]
+        docs.append(('{}-{:05d}'.format(prefix, rnd.randrange(10 ** 5)) + '-' + str(i), ' '.join(words)))
+    return docs
+
+
+def index_batch(docs):
+    """Indexes documents in indexing order, as build_index.add_document does
+
+    Returns:
+        (list of str, array, dict): doc_id and length of each document, term - (doc numbers, term frequencies)
+    """
+    doc_ids, doc_lens, inverted_index = [], ps.array(ps.TYPECODE), {}
+    for doc_id, text in docs:
+        terms = tm.process_text(text)
+        doc_num = len(doc_ids)
+        doc_ids.append(doc_id)
+        doc_lens.append(len(terms))
+        for term, freq in tm.to_frequency_pairs(terms):
+            postings = inverted_index.get(term)
+            if postings is None:
+                postings = inverted_index[term] = ps.new_postings()
+            ps.append_posting(postings, doc_num, freq)
+    return doc_ids, doc_lens, inverted_index
+
+
+def write_docs(index_dir, docs):
+    """Writes an on-disk index of documents
+    """
+    di.write_index(index_dir, *ps.sort_doc_numbers(*index_batch(docs)))
+    return index_dir
+
+
+@pytest.fixture(scope='session')
+def docs():
+    return make_docs()
+
+
+@pytest.fixture(scope='session')
+def index_dir(tmp_path_factory, docs):
+    return write_docs(str(tmp_path_factory.mktemp('index')), docs)
+
+
+@pytest.fixture(scope='session')
+def queries():
+    rnd = random.Random(3)
+    return [' '.join(rnd.choice(VOCABULARY) for _ in range(rnd.randint(1, 4))) for _ in range(25)]
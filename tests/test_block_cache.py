@@ -0,0 +1,37 @@
+import numpy as np
+
+import block_cache as bc
+
+
+def block(num_bytes):
+    """Decoded block of num_bytes bytes
+    """
+    return np.zeros(num_bytes // 8, dtype=np.int64), np.zeros(0, dtype=np.uint32)
+
+
+def test_lru_eviction():
+    cache = bc.BlockCache(240)
+    for term in ('a', 'b', 'c'):
+        assert cache.put((term, 0), block(80))
+    cache.get(('a', 0))
+    assert cache.put(('d', 0), block(160))
+    # b and c were the least recently used
+    assert list(cache.entries) == [('a', 0), ('d', 0)] and cache.bytes_resident == 240 and cache.evictions == 2
+    assert not cache.put(('e', 0), block(248))
+
+
+def test_rejected_block_evicts_nothing():
+    cache = bc.BlockCache(240)
+    for term in ('cold', 'hot', 'x'):
+        cache.put((term, 0), block(80))
+    cache.record_query('hot')
+    cache.record_query('hot')
+    cache.record_query('mid')
+    # Making room needs cold and hot, hot is queried more often than mid
+    assert not cache.put(('mid', 0), block(160))
+    assert list(cache.entries) == [('cold', 0), ('hot', 0), ('x', 0)]
+    assert cache.bytes_resident == 240 and cache.evictions == 0 and cache.rejections == 1
+
+    cache.record_query('mid')
+    assert cache.put(('mid', 0), block(160))
+    assert list(cache.entries) == [('x', 0), ('mid', 0)] and cache.bytes_resident == 240 and cache.evictions == 2
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+import disk_index as di
+import postings as ps
+import postings_codec as pc
+
+VALUES = [[], [0], [1, 0, 127, 128, 16383, 16384, 2 ** 21, 2 ** 32 - 1], [5] * 300,
+          [3] * 120 + [2 ** 31] * 3 + [1] * 5]
+
+
+@pytest.mark.parametrize('codec', sorted(pc.CODECS))
+@pytest.mark.parametrize('values', VALUES)
+def test_codec_round_trip(codec, values):
+    encode, decode = pc.CODECS[codec]
+    values = np.array(values, dtype=np.uint32)
+    assert decode(encode(values), len(values)).tolist() == values.tolist()
+
+
+def random_postings(rng, num_docs, doc_freq):
+    doc_nums = np.sort(rng.choice(num_docs, doc_freq, replace=False))
+    freqs = rng.zipf(1.5, doc_freq).clip(1, 10 ** 6)
+    return ps.encode_postings(doc_nums, freqs), doc_nums, freqs
+
+
+@pytest.mark.parametrize('codec', sorted(pc.CODECS))
+@pytest.mark.parametrize('block_size', [1, 7, 128])
+@pytest.mark.parametrize('doc_freq', [1, 128, 129, 1000])
+def test_term_round_trip(codec, block_size, doc_freq):
+    rng = np.random.default_rng(doc_freq)
+    doc_lens = rng.integers(1, 500, 5000)
+    (gaps, freqs), doc_nums, _ = random_postings(rng, len(doc_lens), doc_freq)
+    data = pc.encode_term(gaps, freqs, doc_lens, codec, block_size)
+
+    decoded_gaps, decoded_freqs = pc.decode_term(data, doc_freq, codec, block_size)
+    assert decoded_gaps.tolist() == list(gaps) and decoded_freqs.tolist() == list(freqs)
+
+    table = pc.block_table(data, doc_freq, block_size)
+    assert len(table) == pc.num_blocks(doc_freq, block_size)
+    for block, start in enumerate(range(0, doc_freq, block_size)):
+        block_docs, block_freqs = pc.decode_block(data, doc_freq, block, codec, block_size)
+        assert block_docs.tolist() == doc_nums[start:start + block_size].tolist()
+        assert block_freqs.tolist() == list(freqs)[start:start + block_size]
+        assert table['last_doc'][block] == block_docs[-1]
+        assert table['max_tf'][block] == block_freqs.max()
+        assert table['min_doc_len'][block] == doc_lens[block_docs].min()
+
+
+@pytest.mark.parametrize('codec', sorted(pc.CODECS))
+def test_disk_index_round_trip(tmp_path, codec):
+    rng = np.random.default_rng(1)
+    doc_table = ['D{:04d}'.format(i) for i in range(400)]
+    doc_lens = ps.array(ps.TYPECODE, rng.integers(0, 300, len(doc_table)).tolist())
+    inverted_index = {term: random_postings(rng, len(doc_table), doc_freq)[0]
+                      for term, doc_freq in [('alpha', 1), ('beta', 130), ('gamma', 400), ('ünïcode', 17)]}
+    di.write_index(str(tmp_path), doc_table, doc_lens, inverted_index, codec)
+
+    index = di.DiskIndex(str(tmp_path))
+    assert index.num_docs == len(doc_table) and index.doc_lens.tolist() == doc_lens.tolist()
+    assert sorted(index.terms_iter()) == sorted(inverted_index) and 'delta' not in index
+    for term, (gaps, freqs) in inverted_index.items():
+        postings = index.postings(term)
+        assert postings[0].tolist() == list(gaps) and postings[1].tolist() == list(freqs)
+        assert index.doc_freq(term) == len(gaps) and index.collection_freq(term) == sum(freqs)
+        doc_nums, block_freqs = index.block_range(term, 0, len(index.block_table(term)))
+        assert doc_nums.tolist() == np.cumsum(gaps).tolist() and block_freqs.tolist() == list(freqs)
+    assert [index.doc_num(doc_id) for doc_id in doc_table[:5]] == list(range(5))
+    assert index.doc_id_list([3, 0]) == [doc_table[3], doc_table[0]]
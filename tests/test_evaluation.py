@@ -0,0 +1,40 @@
+import os
+
+import pytest
+
+import evaluation as ev
+
+TEST_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'trec_eval.9.0', 'test')
+
+
+def read_trec_eval_output(path):
+    """Values printed by trec_eval, as formatted
+
+    Returns:
+        dict: Topic number - measure - value
+    """
+    values = {}
+    with open(os.path.join(TEST_DIR, path)) as file:
+        for line in file:
+            measure, topic, value = line.split()
+            values.setdefault(topic, {})[measure] = value
+    return values
+
+
+@pytest.mark.parametrize('qrels_file, results_file, options, output_file', [
+    ('qrels.test', 'results.test', {}, 'out.test.aq'),
+    ('qrels.test', 'results.trunc', {'complete': True}, 'out.test.aqc'),
+    ('qrels.test', 'results.trunc', {'complete': True, 'max_docs': 100}, 'out.test.aqcM'),
+    ('qrels.rel_level', 'results.test', {'relevance_level': 2}, 'out.test.aql'),
+])
+def test_same_as_trec_eval(qrels_file, results_file, options, output_file):
+    qrels = ev.read_qrels(os.path.join(TEST_DIR, qrels_file))
+    run = ev.read_run(os.path.join(TEST_DIR, results_file))
+    values, topic_values = ev.evaluate(qrels, run, per_topic=True, **options)
+    expected = read_trec_eval_output(output_file)
+
+    assert sorted(expected) == sorted(list(topic_values) + ['all'])
+    for topic, topic_value in list(topic_values.items()) + [('all', values)]:
+        for measure in topic_value:
+            _, _, value = ev.format_measures(topic_value, [measure], topic).split()
+            assert value == expected[topic][measure], (topic, measure)
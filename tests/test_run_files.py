@@ -0,0 +1,52 @@
+import pytest
+
+import disk_index as di
+import run_files as rn
+from conftest import write_docs
+
+
+@pytest.fixture(scope='module')
+def index(index_dir):
+    return di.DiskIndex(index_dir)
+
+
+def test_round_trip(tmp_path, index):
+    path = str(tmp_path / 'run.run')
+    with rn.RunWriter(path, index) as writer:
+        writer.add_ranking('301', [(2.5, 7), (1.0, 3)])
+        writer.add_topic('302', [], [])
+    assert rn.is_binary_run(path)
+    run = rn.load_run(path, index)
+    assert run == {'301': [(index.doc_id(7), 2.5), (index.doc_id(3), 1.0)], '302': []}
+
+    trec_path, binary_path = str(tmp_path / 'run.txt'), str(tmp_path / 'converted.run')
+    rn.binary_to_trec(path, trec_path, index)
+    rn.trec_to_binary(trec_path, binary_path, index)
+    # A topic without documents has no lines in a text run
+    assert rn.load_run(binary_path, index) == {'301': run['301']}
+
+
+def test_other_build_is_rejected(tmp_path, index, docs):
+    path = str(tmp_path / 'run.run')
+    with rn.RunWriter(path, index) as writer:
+        writer.add_ranking('301', [(1.0, 0)])
+    rebuilt = di.DiskIndex(write_docs(str(tmp_path / 'rebuilt'), docs))
+    assert rebuilt.num_docs == index.num_docs
+    with pytest.raises(ValueError, match='build'):
+        rn.load_run(path, rebuilt)
+
+
+def test_long_topic_is_rejected(tmp_path, index):
+    with rn.RunWriter(str(tmp_path / 'run.run'), index) as writer:
+        writer.add_topic('x' * 16, [1], [1.0])
+        with pytest.raises(ValueError, match='longer than 16 bytes'):
+            writer.add_topic('x' * 17, [1], [1.0])
+
+
+def test_failed_run_is_removed(tmp_path, index):
+    path = str(tmp_path / 'run.run')
+    with pytest.raises(RuntimeError):
+        with rn.RunWriter(path, index) as writer:
+            writer.add_ranking('301', [(1.0, 0)])
+            raise RuntimeError('search failed')
+    assert not (tmp_path / 'run.run').exists()
@@ -0,0 +1,33 @@
+import pytest
+
+import ranking as rk
+from searcher import Searcher
+
+OOV = 'zyzzyva'
+
+
+@pytest.fixture(scope='module')
+def searcher(index_dir):
+    with Searcher(index_dir, processes=1, cache_size=0) as searcher:
+        yield searcher
+
+
+@pytest.mark.parametrize('strategy', sorted(rk.RETRIEVAL_STRATEGIES))
+@pytest.mark.parametrize('scorer, params', [(rk.bm25, {}), (rk.ql, {'smoothing': 'dir', 'mu': 500}),
+                                            (rk.ql, {'smoothing': 'jm', 'lambda': 0.5})])
+def test_out_of_vocabulary_terms_are_skipped(searcher, queries, strategy, scorer, params):
+    params = dict(params, strategy=strategy)
+    for query in queries[:5]:
+        assert searcher.rank(query + ' ' + OOV, 20, scorer, params) == searcher.rank(query, 20, scorer, params)
+    assert len(searcher.rank(OOV, 20, scorer, params)) == 20
+
+
+def test_out_of_vocabulary_terms_sweep_hybrid_cascade(searcher, queries):
+    query = queries[0]
+    grid = [{'k1': 0.9, 'b': 0.4}, {'k1': 1.2, 'b': 0.75}]
+    assert searcher.search_sweep(OOV + ' ' + query, 10, rk.bm25, grid) == searcher.search_sweep(query, 10, rk.bm25, grid)
+    scorers = [{'fun': rk.bm25}, {'fun': rk.ql, 'smoothing': 'dir', 'mu': 500}]
+    assert searcher.search_hybrid(query + ' ' + OOV, 10, scorers) == searcher.search_hybrid(query, 10, scorers)
+    cascade = {'fun': rk.ql, 'candidates': 50}
+    assert searcher.search_cascade(query + ' ' + OOV, 10, cascade, recall=True) == \
+        searcher.search_cascade(query, 10, cascade, recall=True)
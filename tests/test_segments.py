@@ -0,0 +1,90 @@
+import fcntl
+import os
+
+import pytest
+
+import ranking as rk
+import segments as sg
+from conftest import index_batch, make_docs, write_docs
+from searcher import Searcher
+
+CONFIGS = [(rk.bm25, {}), (rk.bm25, {'strategy': 'wand'}), (rk.ql, {'smoothing': 'dir', 'mu': 500, 'strategy': 'bmw'})]
+
+
+def full_ranking(index_dir, query, scorer, params):
+    """Score and doc_id of every document, independent of the doc numbering of the index
+    """
+    with Searcher(index_dir, processes=1, cache_size=0) as searcher:
+        ranking = searcher.rank(query, searcher.index.num_docs, scorer, params)
+        return sorted(zip([score for score, _ in ranking], searcher.index.doc_id_list([doc for _, doc in ranking])))
+
+
+def assert_same_as_rebuilt(index_dir, live_docs, rebuilt_dir, queries):
+    write_docs(rebuilt_dir, live_docs)
+    for scorer, params in CONFIGS:
+        for query in queries[:8]:
+            assert full_ranking(index_dir, query, scorer, params) == full_ranking(rebuilt_dir, query, scorer, params)
+
+
+@pytest.fixture
+def segmented(tmp_path):
+    """Segmented index of three batches, the last one updating documents of the first, and some deletions
+
+    Returns:
+        (str, dict): Directory of the index and doc_id - text of its live documents
+    """
+    index_dir = str(tmp_path / 'segmented')
+    batches = [make_docs(150, seed=1, prefix='A'), make_docs(120, seed=2, prefix='B')]
+    batches.append([(doc_id, 'river ' + text) for doc_id, text in batches[0][:30]] + make_docs(40, seed=3, prefix='C'))
+    live = {}
+    for docs in batches:
+        sg.add_segment(index_dir, *index_batch(docs))
+        live.update(docs)
+    deleted = [doc_id for doc_id, _ in batches[1][::4]] + ['unknown']
+    assert sg.delete_documents(index_dir, deleted) == len(deleted) - 1
+    for doc_id in deleted:
+        live.pop(doc_id, None)
+    return index_dir, live
+
+
+def test_add_and_delete(tmp_path, segmented, queries):
+    index_dir, live = segmented
+    index = sg.SegmentedIndex(index_dir)
+    assert len(index.manifest['segments']) == 3 and index.num_docs == len(live)
+    assert sorted(index.doc_id_list(range(index.num_docs))) == sorted(live)
+    assert sg.delete_documents(index_dir, ['unknown']) == 0
+    assert_same_as_rebuilt(index_dir, sorted(live.items()), str(tmp_path / 'rebuilt'), queries)
+
+
+def test_merge(tmp_path, monkeypatch, segmented, queries):
+    index_dir, live = segmented
+    build_id = sg.read_manifest(index_dir)['build_id']
+    # All three segments are in the lowest tier
+    monkeypatch.setattr(sg, 'MERGE_FACTOR', 3)
+    assert sg.maybe_merge(index_dir) >= 1
+
+    manifest = sg.read_manifest(index_dir)
+    assert len(manifest['segments']) == 1 and manifest['build_id'] != build_id
+    assert manifest['segments'][0]['num_docs'] == len(live) and manifest['segments'][0]['tombstones'] is None
+    assert_same_as_rebuilt(index_dir, sorted(live.items()), str(tmp_path / 'rebuilt'), queries)
+
+
+def test_stale_and_concurrent_merge(monkeypatch, segmented):
+    index_dir, live = segmented
+    names = [segment['name'] for segment in sg.read_manifest(index_dir)['segments']]
+    merged = sg.merge_segments(index_dir, names[:2])
+    assert merged is not None
+    # Both segments were merged away, or only one of them
+    assert sg.merge_segments(index_dir, names[:2]) is None
+    assert sg.merge_segments(index_dir, names[1:]) is None
+    manifest = sg.read_manifest(index_dir)
+    assert [segment['name'] for segment in manifest['segments']] == [merged, names[2]]
+
+    # Another process holds the merge lock
+    monkeypatch.setattr(sg, 'MERGE_FACTOR', 2)
+    with open(os.path.join(index_dir, sg.MERGE_LOCK_FILE), 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        assert sg.maybe_merge(index_dir) == 0
+    assert sg.read_manifest(index_dir) == manifest
+    assert sg.maybe_merge(index_dir) == 1
+    assert sg.SegmentedIndex(index_dir).num_docs == len(live)
@@ -0,0 +1,57 @@
+import pytest
+
+import ranking as rk
+import shards as sh
+from searcher import Searcher
+
+
+@pytest.fixture(scope='module')
+def searcher(index_dir):
+    with Searcher(index_dir, processes=1, cache_size=0) as searcher:
+        yield searcher
+
+
+@pytest.fixture(scope='module')
+def pool(index_dir):
+    with sh.ShardPool(index_dir, 3, 0) as pool:
+        yield pool
+
+
+def test_shard_ranges():
+    assert sh.shard_ranges(10, 3) == [(0, 3), (3, 6), (6, 10)]
+
+
+def test_merge_rankings():
+    rankings = [[(3.0, 1), (1.0, 0)], [(3.0, 7), (2.0, 5)], []]
+    assert sh.merge_rankings(rankings, 3) == [(3.0, 7), (3.0, 1), (2.0, 5)]
+
+
+@pytest.mark.parametrize('scorer, params', [(rk.bm25, {}), (rk.bm25, {'strategy': 'bmw'}),
+                                            (rk.ql, {'smoothing': 'dir', 'mu': 500, 'strategy': 'taat'}),
+                                            (rk.ql, {'smoothing': 'jm', 'lambda': 0.5, 'strategy': 'wand'})])
+def test_sharded_rankings_equal_unsharded(searcher, pool, queries, scorer, params):
+    for query in queries:
+        assert pool.search(query, 15, scorer, params) == searcher.rank(query, 15, scorer, params)
+
+
+def test_failed_search_keeps_workers(searcher, pool, queries):
+    with pytest.raises(RuntimeError, match='KeyError'):
+        pool.search(queries[0], 10, rk.bm25, {'strategy': 'no such strategy'})
+    assert pool.search(queries[0], 10, rk.bm25, {}) == searcher.rank(queries[0], 10, rk.bm25, {})
+
+    tasks = [(str(i), query, 10, rk.bm25, {}) for i, query in enumerate(queries)]
+    tasks[2] = ('2', queries[2], 10, rk.bm25, {'strategy': 'no such strategy'})
+    with pytest.raises(RuntimeError):
+        list(pool.search_many(tasks))
+    # The rankings still in flight were read, the next search gets its own
+    assert dict(pool.search_many(tasks[3:])) == {num: searcher.rank(query, 10, rk.bm25, {})
+                                                  for num, query, _, _, _ in tasks[3:]}
+
+
+def test_close_after_workers_exited(index_dir):
+    pool = sh.ShardPool(index_dir, 2, 0)
+    for process in pool.processes:
+        process.terminate()
+        process.join()
+    pool.close()
+    assert pool.processes == []
@@ -0,0 +1,77 @@
+import pytest
+
+import disk_index as di
+import postings as ps
+import ranking as rk
+
+SCORERS = [(rk.bm25, {}), (rk.bm25, {'k1': 0.9, 'b': 0.4}), (rk.ql, {'smoothing': 'dir', 'mu': 500}),
+           (rk.ql, {'smoothing': 'jm', 'lambda': 0.5})]
+
+
+@pytest.fixture(scope='module')
+def index(index_dir):
+    return di.DiskIndex(index_dir)
+
+
+def rank(index, query, k, scorer, params, strategy, eager=False):
+    inv_idx, doc_freq_idx, term_freq_idx = rk.filter_disk_index(index, rk.tm.process_text(query))
+    if eager:
+        # Postings without a stored block table
+        inv_idx = {term: inv_idx[term] for term in inv_idx}
+    doc_len_idx = memoryview(index.doc_lens).cast('B').cast(ps.TYPECODE)
+    results = {}
+    rk.RETRIEVAL_STRATEGIES[strategy](k, query, scorer, inv_idx, doc_freq_idx, doc_len_idx, term_freq_idx, results,
+                                      query, rk.with_stats(params, index.collection_stats()))
+    return results[query]
+
+
+@pytest.mark.parametrize('scorer, params', SCORERS)
+@pytest.mark.parametrize('strategy', ['wand', 'bmw', 'taat'])
+@pytest.mark.parametrize('k', [1, 30, 600])
+def test_strategies_equal_exhaustive(index, queries, scorer, params, strategy, k):
+    for query in queries:
+        expected = rank(index, query, k, scorer, params, 'exhaustive')
+        ranking = rank(index, query, k, scorer, params, strategy)
+        if strategy == 'taat':
+            # Same up to floating point rounding, see retrieve_top_k_taat
+            assert [score for score, _ in ranking] == pytest.approx([score for score, _ in expected])
+        else:
+            assert ranking == expected
+            assert rank(index, query, k, scorer, params, strategy, eager=True) == expected
+
+
+def test_empty_query(index):
+    for strategy in rk.RETRIEVAL_STRATEGIES:
+        assert rank(index, '', 10, rk.bm25, {}, strategy) == rank(index, '', 10, rk.bm25, {}, 'exhaustive')
+
+
+def test_posting_cursor_skips_blocks():
+    doc_nums = list(range(3, 300, 7))
+    postings = ps.encode_postings(doc_nums, [1 + doc_num % 5 for doc_num in doc_nums])
+    doc_len_idx = ps.array(ps.TYPECODE, [10] * 300)
+    table, read_block = rk.posting_blocks(postings, doc_len_idx, block_size=8)
+    stats = {'num_docs': 300, 'num_tokens': 3000, 'avg_doc_len': 10}
+    cursor = rk.PostingCursor('term', table, read_block, (rk.bm25_term_bound, len(doc_nums), 100, {'stats': stats}))
+    assert cursor.block_lasts == [doc_nums[min(i + 8, len(doc_nums)) - 1] for i in range(0, len(doc_nums), 8)]
+    assert cursor.upper_bound == max(cursor.block_bounds)
+
+    cursor.next_geq(100)
+    assert (cursor.block, cursor.doc()) == (1, 101)
+    cursor.next_gt(101)
+    assert cursor.doc() == 108
+    cursor.next_geq(250)
+    assert (cursor.block, cursor.doc()) == (4, 255)
+    cursor.next()
+    assert cursor.doc() == 262
+    assert cursor.contains(3) and cursor.contains(297) and not cursor.contains(4) and not cursor.contains(299)
+    assert cursor.doc() == 262
+    cursor.next_gt(297)
+    assert cursor.exhausted()
+
+
+def test_unmatched_docs_order():
+    doc_len_idx = ps.array(ps.TYPECODE, [5, 3, 5, 0, 3, 9])
+    for unmatched_score in (lambda doc_len: 0.0, lambda doc_len: -doc_len, lambda doc_len: -min(doc_len, 5)):
+        expected = sorted(((unmatched_score(doc_len), doc_num) for doc_num, doc_len in enumerate(doc_len_idx)),
+                          reverse=True)
+        assert list(rk.unmatched_docs(doc_len_idx, unmatched_score)) == expected